@@ -0,0 +1,643 @@
+"""
+
+mlbatch.py
+Vectorised move generation for many multi-level chess positions at once
+Samuel Bauman 2020
+
+"""
+
+import argparse
+import collections
+import random
+import time
+
+import numpy as np
+
+import mlgeometry
+import mlpiece
+from mlchess import Piece, Board
+
+# Data analysis wants the moves, attacked squares and mobility of millions of
+# positions, and generating them one piece at a time through Board is far too
+# slow for that. Here every position of a batch is handled at once with NumPy:
+# the positions are an (N, 192) array of board bytes, the same bytes as
+# Board.data, and a vector of N turn values.
+#
+# The tables of mlgeometry.py are turned into fixed width index arrays, one row
+# per square, padded with index 192. Every position gets an extra, always empty
+# column 192, so looking up a padded entry reads an empty square, and a padded
+# entry is told apart from a real square by its index alone. For each rank all
+# pieces of that rank in the batch are found together and their rows of the
+# table are looked up in one step:
+#   offsets  knights, kings and pawns reach every square of their row
+#   rays     queens, rooks and bishops have a row of rays, each padded to
+#            seven squares; a square is reached if no piece stands on the
+#            squares of its ray before it, which is a running sum along the ray
+# The squares reached are then kept or dropped by what stands on them, just as
+# Board.move_targets does, and castling is tested from mlgeometry.CASTLE.
+#
+# A move is legal if afterwards no piece of the opponent attacks the king.
+# Outside of check that follows from what is known once per position: the
+# squares the opponent attacks, for the king's own moves, and the pieces
+# pinned to the king, which are the first piece on a ray from the king with an
+# opponent slider behind it. Moves out of check are tested one by one the way
+# Board.is_attacked does it, walking outwards from the king's square, with the
+# moved piece taken off its square and put on its target in the values looked
+# up, so the board itself is never copied.
+#
+# The batch is split into chunks of positions so the intermediate arrays of a
+# very large batch stay small.
+#
+# Requires numpy.
+#
+# Usage: batch = mlbatch.analyse(data, turns), or with Board objects
+#        mlbatch.analyse(*mlbatch.board_arrays(boards));
+#        python3 mlbatch.py check [-n 500] compares against Board;
+#        python3 mlbatch.py bench [-n 100000] measures the speed of both.
+
+SQUARES = mlgeometry.SQUARES
+# The padding index, which is also the always empty column of every position.
+NONE = SQUARES
+
+# Positions handled together by analyse.
+CHUNK = 4096
+
+# The kinds of squares a piece reaches: squares knights, kings and sliders
+# can move to or take on, the squares pawns take on, and the squares pawns
+# move to and double move to.
+STEP, TAKE, PUSH, DOUBLE = range(4)
+
+# The results of analyse for N positions:
+#   targets       (N, 192) the squares the side to move can move to, without
+#                 testing for check
+#   legal         (N, 192) the squares the side to move can legally move to
+#   attacks       (2, N, 192) the squares attacked by white and by black
+#   mobility      (2, N) the number of moves of white and of black, without
+#                 testing for check
+#   legal_counts  (N,) the number of legal moves of the side to move
+Batch = collections.namedtuple(
+    "Batch", "targets legal attacks mobility legal_counts")
+
+
+def pad_table(rows):
+
+    """ Returns a table of index positions per square as an array, every row
+    padded with NONE to the length of the longest """
+
+    width = max(len(row) for row in rows)
+    table = np.full((len(rows), width), NONE, dtype=np.intp)
+    for index, row in enumerate(rows):
+        table[index, :len(row)] = row
+    return table
+
+
+def pad_rays(rays_table):
+
+    """ Returns a table of rays per square as a (192, rays, 7) array padded
+    with NONE """
+
+    width = max(len(rays) for rays in rays_table)
+    table = np.full((len(rays_table), width, 7), NONE, dtype=np.intp)
+    for index, rays in enumerate(rays_table):
+        for number, ray in enumerate(rays):
+            table[index, number, :len(ray)] = ray
+    return table
+
+
+KNIGHT_TABLE = pad_table(mlgeometry.KNIGHT)
+KING_TABLE = pad_table(mlgeometry.KING)
+PAWN_MOVE_TABLES = tuple(pad_table(table) for table in mlgeometry.PAWN_MOVE)
+PAWN_DOUBLE_TABLES = tuple(
+    pad_table(table) for table in mlgeometry.PAWN_DOUBLE)
+PAWN_TAKE_TABLES = tuple(pad_table(table) for table in mlgeometry.PAWN_TAKE)
+
+ROOK_TABLE = pad_rays(mlgeometry.ROOK_RAYS)
+BISHOP_TABLE = pad_rays(mlgeometry.BISHOP_RAYS)
+QUEEN_TABLE = pad_rays(mlgeometry.QUEEN_RAYS)
+
+OFFSET_TABLES = ((mlpiece.KNIGHT, KNIGHT_TABLE), (mlpiece.KING, KING_TABLE))
+RAY_TABLES = ((mlpiece.QUEEN, QUEEN_TABLE), (mlpiece.ROOK, ROOK_TABLE),
+              (mlpiece.BISHOP, BISHOP_TABLE))
+
+# The castling squares of a king on each square (see mlgeometry.castle_table),
+# and whether the square next to the king on each side is one the king can
+# step to, which castling requires.
+CASTLE_TABLE = np.array(mlgeometry.CASTLE, dtype=np.intp)
+KING_SIDE_STEP = np.array(
+    [row[2] in mlgeometry.KING[index]
+     for index, row in enumerate(mlgeometry.CASTLE)])
+QUEEN_SIDE_STEP = np.array(
+    [row[3] in mlgeometry.KING[index]
+     for index, row in enumerate(mlgeometry.CASTLE)])
+
+# The rook and bishop rays from each square together, and the rank of slider
+# that moves along each of them, for finding the pieces pinned to a king.
+KING_RAYS = np.concatenate([ROOK_TABLE, BISHOP_TABLE], axis=1)
+STEPS = np.arange(KING_RAYS.shape[2])
+KING_RAY_RANKS = np.array(
+    [mlpiece.ROOK] * ROOK_TABLE.shape[1] +
+    [mlpiece.BISHOP] * BISHOP_TABLE.shape[1], dtype=np.uint8)
+
+# The tables of mlpiece.py indexed by piece byte, by side index for FRIEND_OF
+# and ENEMY_OF.
+RANK_OF = np.array(mlpiece.RANK, dtype=np.uint8)
+STATE_OF = np.array(mlpiece.STATE, dtype=np.uint8)
+FRIEND_OF = np.array([mlpiece.FRIEND[side] for side in mlpiece.SIDES])
+ENEMY_OF = np.array([mlpiece.ENEMY[side] for side in mlpiece.SIDES])
+
+
+def board_arrays(boards):
+
+    """ Returns the (N, 192) data array and turn vector of a list of boards """
+
+    data = np.frombuffer(b"".join(bytes(board.data) for board in boards),
+                         dtype=np.uint8).reshape(-1, SQUARES)
+    turns = np.array([board.turn.value for board in boards], dtype=np.uint8)
+    return data, turns
+
+
+def turn_sides(turns):
+
+    """ Returns the side index of each turn value, 0 for white and 1 for
+    black """
+
+    turns = np.asarray(turns)
+    if not np.isin(turns, mlpiece.SIDES).all():
+        raise ValueError("turns must be %d (white) or %d (black)" %
+                         mlpiece.SIDES)
+    return (turns // mlpiece.BLACK).astype(np.intp)
+
+
+def pad_positions(data):
+
+    """ Returns the positions with the always empty column added """
+
+    data = np.asarray(data, dtype=np.uint8)
+    if data.ndim != 2 or data.shape[1] != SQUARES:
+        raise ValueError("positions must be an (N, %d) array" % SQUARES)
+    padded = np.zeros((len(data), SQUARES + 1), dtype=np.uint8)
+    padded[:, :SQUARES] = data
+    return padded
+
+
+def offset_reach(positions, origins, table, kind):
+
+    """ Returns the position, origin, target and kind arrays of the squares of
+    the table rows of the given pieces """
+
+    targets = table[origins]
+    found, column = np.nonzero(targets != NONE)
+    return (positions[found], origins[found], targets[found, column],
+            np.full(len(found), kind, dtype=np.uint8))
+
+
+def ray_reach(padded, positions, origins, table):
+
+    """ Returns the position, origin, target and kind arrays of the squares
+    the given sliders reach along their rays, up to and including the first
+    piece on each ray """
+
+    targets = table[origins]
+    occupied = padded[positions[:, None, None], targets] != mlpiece.EMPTY
+    # The number of pieces on each ray before each square.
+    before = occupied.cumsum(axis=2, dtype=np.uint8) - occupied
+    found, ray, step = np.nonzero((targets != NONE) & (before == 0))
+    return (positions[found], origins[found], targets[found, ray, step],
+            np.full(len(found), STEP, dtype=np.uint8))
+
+
+def side_reach(padded, side):
+
+    """ Returns the position, origin, target and kind arrays of every square
+    the pieces of a side reach in every position, whatever stands on it """
+
+    data = padded[:, :SQUARES]
+    own = FRIEND_OF[side][data]
+    ranks = RANK_OF[data]
+    parts = []
+
+    for rank, table in OFFSET_TABLES:
+        positions, origins = np.nonzero(own & (ranks == rank))
+        parts.append(offset_reach(positions, origins, table, STEP))
+
+    positions, origins = np.nonzero(own & (ranks == mlpiece.PAWN))
+    for tables, kind in [(PAWN_TAKE_TABLES, TAKE), (PAWN_MOVE_TABLES, PUSH),
+                         (PAWN_DOUBLE_TABLES, DOUBLE)]:
+        parts.append(offset_reach(positions, origins, tables[side], kind))
+
+    for rank, table in RAY_TABLES:
+        positions, origins = np.nonzero(own & (ranks == rank))
+        parts.append(ray_reach(padded, positions, origins, table))
+
+    return tuple(np.concatenate(arrays) for arrays in zip(*parts))
+
+
+def castle_moves(padded, side):
+
+    """ Returns the position, origin and target arrays of the castling moves
+    of a side, tested the same way as in Board.move_targets """
+
+    data = padded[:, :SQUARES]
+    kings = FRIEND_OF[side][data] & (RANK_OF[data] == mlpiece.KING) & \
+        (STATE_OF[data] == mlpiece.UNMOVED)
+    positions, origins = np.nonzero(kings)
+    squares = CASTLE_TABLE[origins]
+    values = padded[positions[:, None], squares]
+    empty = values == mlpiece.EMPTY
+    rook_unmoved = STATE_OF[values] == mlpiece.UNMOVED
+
+    king_side = KING_SIDE_STEP[origins] & empty[:, 1] & empty[:, 2] & \
+        rook_unmoved[:, 0]
+    queen_side = QUEEN_SIDE_STEP[origins] & empty[:, 3] & empty[:, 4] & \
+        empty[:, 5] & rook_unmoved[:, 6]
+
+    return (np.concatenate([positions[king_side], positions[queen_side]]),
+            np.concatenate([origins[king_side], origins[queen_side]]),
+            np.concatenate([squares[king_side, 1], squares[queen_side, 4]]))
+
+
+def pseudo_moves(padded, side, reach):
+
+    """ Returns the position, origin and target arrays of the moves of a side
+    without testing for check, from the squares its pieces reach """
+
+    positions, origins, targets, kinds = reach
+    values = padded[positions, targets]
+    empty = values == mlpiece.EMPTY
+    enemy = ENEMY_OF[side][values]
+
+    keep = np.where(kinds == STEP, empty | enemy,
+                    np.where(kinds == TAKE, enemy, empty))
+    keep &= (kinds != DOUBLE) | \
+        (STATE_OF[padded[positions, origins]] == mlpiece.UNMOVED)
+
+    castle_positions, castle_origins, castle_targets = \
+        castle_moves(padded, side)
+    return (np.concatenate([positions[keep], castle_positions]),
+            np.concatenate([origins[keep], castle_origins]),
+            np.concatenate([targets[keep], castle_targets]))
+
+
+def attacked(padded, positions, squares, side, origins, targets):
+
+    """ Returns for each entry whether any piece of the side attacks the
+    square in the position after the piece on origin has moved to target,
+    as Board.is_attacked would """
+
+    moving = padded[positions, origins]
+
+    def look(table):
+
+        # The values on the table rows of the squares, with the move made.
+        indexes = table[squares]
+        shape = (-1,) + (1,) * (indexes.ndim - 1)
+        values = padded[positions.reshape(shape), indexes]
+        values = np.where(indexes == origins.reshape(shape), mlpiece.EMPTY,
+                          values)
+        return np.where(indexes == targets.reshape(shape),
+                        moving.reshape(shape), values)
+
+    attacker = FRIEND_OF[side]
+    found = np.zeros(len(positions), dtype=bool)
+
+    for table, rank in [(PAWN_TAKE_TABLES[1 - side], mlpiece.PAWN),
+                        (KNIGHT_TABLE, mlpiece.KNIGHT),
+                        (KING_TABLE, mlpiece.KING)]:
+        values = look(table)
+        found |= (attacker[values] & (RANK_OF[values] == rank)).any(axis=1)
+
+    # Only the first piece on each ray can attack along it, and queens attack
+    # along the rook and the bishop rays.
+    for table, rank in [(ROOK_TABLE, mlpiece.ROOK),
+                        (BISHOP_TABLE, mlpiece.BISHOP)]:
+        values = look(table)
+        occupied = values != mlpiece.EMPTY
+        first = occupied & (occupied.cumsum(axis=2, dtype=np.uint8) == 1)
+        ranks = RANK_OF[values]
+        found |= (first & attacker[values] &
+                  ((ranks == rank) | (ranks == mlpiece.QUEEN))).any(axis=(1, 2))
+
+    return found
+
+
+def attack_map(count, reach):
+
+    """ Returns the (count, 192) squares attacked by the pieces of a side,
+    from the squares they reach """
+
+    positions, origins, targets, kinds = reach
+    attacking = (kinds == STEP) | (kinds == TAKE)
+    attacks = np.zeros((count, SQUARES), dtype=bool)
+    attacks[positions[attacking], targets[attacking]] = True
+    return attacks
+
+
+def pinned(padded, side, kings):
+
+    """ Returns a (N, 192) array holding for each piece of the side pinned to
+    its king the number of the ray of KING_RAYS it is pinned along, and -1
+    everywhere else, and a (N, rays) array of the step along each ray the
+    pinning piece stands on """
+
+    count = len(padded)
+    squares = KING_RAYS[kings]
+    values = padded[np.arange(count)[:, None, None], squares]
+    occupied = values != mlpiece.EMPTY
+    pieces = occupied.cumsum(axis=2, dtype=np.uint8)
+    ranks = RANK_OF[values]
+
+    # A piece is pinned if it is the first piece on a ray from the king and
+    # the second is an opponent slider that moves along the ray.
+    first = occupied & (pieces == 1)
+    second = occupied & (pieces == 2)
+    own = (first & FRIEND_OF[side][values]).any(axis=2)
+    slider = (second & ENEMY_OF[side][values] &
+              ((ranks == KING_RAY_RANKS[:, None]) |
+               (ranks == mlpiece.QUEEN))).any(axis=2)
+    positions, rays = np.nonzero(own & slider)
+
+    pins = np.full((count, SQUARES + 1), -1, dtype=np.intp)
+    steps = np.argmax(first[positions, rays], axis=1)
+    pins[positions, squares[positions, rays, steps]] = rays
+    return pins, np.argmax(second, axis=2)
+
+
+def side_moves(padded, sides, side, moves, opponent_attacks):
+
+    """ Returns the position, origin, target and legal arrays of the moves of
+    a side in the positions it is to move in, from its moves without testing
+    for check and the squares the opponent attacks """
+
+    positions, origins, targets = moves
+    mine = sides[positions] == side
+    positions, origins, targets = \
+        positions[mine], origins[mine], targets[mine]
+
+    data = padded[:, :SQUARES]
+    kings = np.argmax(
+        FRIEND_OF[side][data] & (RANK_OF[data] == mlpiece.KING), axis=1)
+    checked = opponent_attacks[np.arange(len(data)), kings]
+    king = kings[positions]
+
+    # As in Board.filter_targets, a move can only expose the king if the king
+    # is already in check, if the king itself moves, or if it opens one of
+    # the lines running out from the king. The moves out of check are tested
+    # square by square. Otherwise no line of attack runs through the king's
+    # square, so the king can move to any square the opponent does not
+    # attack, and only pinned pieces are held back: they stay legal only
+    # while they move along their pin ray no further than the pinning piece,
+    # which a pawn's double move could jump over.
+    king_moves = origins == king
+    test = checked[positions]
+    pins, pinners = pinned(padded, side, kings)
+    pin_rays = pins[positions, origins]
+    ray = np.maximum(pin_rays, 0)
+    on_ray = ((KING_RAYS[king, ray] == targets[:, None]) &
+              (STEPS <= pinners[positions, ray][:, None])).any(axis=1)
+    legal = np.where(king_moves, ~opponent_attacks[positions, targets],
+                     (pin_rays < 0) | on_ray)
+    legal[test] = ~attacked(
+        padded, positions[test],
+        np.where(king_moves, targets, king)[test], 1 - side,
+        origins[test], targets[test])
+    return positions, origins, targets, legal
+
+
+def move_arrays(data, turns):
+
+    """ Returns the position, origin, target and legal arrays of every move of
+    the side to move in each position, without testing for check. A move is
+    legal where the legal array is true. Every position must have a king of
+    each side. """
+
+    padded = pad_positions(data)
+    sides = turn_sides(turns)
+    reaches = [side_reach(padded, side) for side in (0, 1)]
+    attacks = [attack_map(len(padded), reach) for reach in reaches]
+    parts = [side_moves(padded, sides, side,
+                        pseudo_moves(padded, side, reaches[side]),
+                        attacks[1 - side])
+             for side in (0, 1)]
+    return tuple(np.concatenate(arrays) for arrays in zip(*parts))
+
+
+def analyse_chunk(data, sides):
+
+    """ Returns the Batch of a chunk of positions """
+
+    count = len(data)
+    padded = pad_positions(data)
+    targets = np.zeros((count, SQUARES), dtype=bool)
+    legal = np.zeros((count, SQUARES), dtype=bool)
+    mobility = np.zeros((2, count), dtype=np.intp)
+    legal_counts = np.zeros(count, dtype=np.intp)
+
+    reaches = [side_reach(padded, side) for side in (0, 1)]
+    attacks = np.array([attack_map(count, reach) for reach in reaches])
+
+    for side in (0, 1):
+        moves = pseudo_moves(padded, side, reaches[side])
+        mobility[side] = np.bincount(moves[0], minlength=count)
+
+        positions, origins, squares, is_legal = \
+            side_moves(padded, sides, side, moves, attacks[1 - side])
+        targets[positions, squares] = True
+        legal[positions[is_legal], squares[is_legal]] = True
+        legal_counts += np.bincount(positions[is_legal], minlength=count)
+
+    return Batch(targets, legal, attacks, mobility, legal_counts)
+
+
+def analyse(data, turns, chunk = CHUNK):
+
+    """ Returns the Batch of moves, attacks and mobility of an (N, 192) array
+    of board data and a vector of N turn values. Every position must have a
+    king of each side. """
+
+    data = np.asarray(data, dtype=np.uint8)
+    sides = turn_sides(turns)
+    if len(sides) != len(data):
+        raise ValueError("%d positions but %d turns" % (len(data), len(sides)))
+
+    count = len(data)
+    batch = Batch(np.zeros((count, SQUARES), dtype=bool),
+                  np.zeros((count, SQUARES), dtype=bool),
+                  np.zeros((2, count, SQUARES), dtype=bool),
+                  np.zeros((2, count), dtype=np.intp),
+                  np.zeros(count, dtype=np.intp))
+    for start in range(0, count, chunk):
+        end = min(start + chunk, count)
+        part = analyse_chunk(data[start:end], sides[start:end])
+        batch.targets[start:end] = part.targets
+        batch.legal[start:end] = part.legal
+        batch.attacks[:, start:end] = part.attacks
+        batch.mobility[:, start:end] = part.mobility
+        batch.legal_counts[start:end] = part.legal_counts
+    return batch
+
+
+def random_boards(count, rng, plies = 80):
+
+    """ Returns count boards of positions reached by playing random legal
+    moves from the start position, every position of each game in turn """
+
+    start = Board.load("newgame")
+    start_data = bytearray([start.turn.value]) + start.data
+    boards = []
+    while len(boards) < count:
+        board = Board(bytearray(start_data))
+        for ply in range(rng.randint(1, plies)):
+            if board.turn not in [Piece.WHITE, Piece.BLACK]:
+                break
+            boards.append(Board(bytearray([board.turn.value]) + board.data))
+            moves = board.legal_moves(board.turn)
+            if not moves:
+                break
+            board.make_move(rng.choice(moves))
+    return boards[:count]
+
+
+def scattered_board(rng):
+
+    """ Returns a board with both kings and up to 24 other pieces on random
+    squares, unmoved or not, which reaches rules a game rarely does, such as
+    castling and double moves from anywhere on the board """
+
+    data = bytearray(SQUARES)
+    squares = rng.sample(range(SQUARES), 26)
+    for side, index in zip(mlpiece.SIDES, squares):
+        data[index] = mlpiece.encode(
+            side, mlpiece.KING, rng.choice([mlpiece.UNMOVED, mlpiece.NORMAL]))
+    for index in squares[2:2 + rng.randint(0, 24)]:
+        data[index] = mlpiece.encode(
+            rng.choice(mlpiece.SIDES), rng.choice(mlpiece.RANKS[1:]),
+            rng.choice([mlpiece.UNMOVED, mlpiece.NORMAL]))
+    return Board(bytearray([rng.choice(mlpiece.SIDES)]) + data)
+
+
+def compare(boards, report = None):
+
+    """ Compares the batch results for the boards against Board's own move
+    generation and attack tests. Returns the number of positions that
+    differ. """
+
+    data, turns = board_arrays(boards)
+    batch = analyse(data, turns)
+    moves = move_arrays(data, turns)
+
+    pseudo = [collections.Counter() for board in boards]
+    legal = [set() for board in boards]
+    for position, origin, target, is_legal in zip(*(a.tolist() for a in moves)):
+        pseudo[position][origin, target] += 1
+        if is_legal:
+            legal[position].add((origin, target))
+
+    failures = 0
+    for number, board in enumerate(boards):
+        side = board.turn.value // mlpiece.BLACK
+        expected_pseudo = collections.Counter()
+        expected_legal = set()
+        for index in board.pieces[side]:
+            piece = board.data[index]
+            for target in board.move_targets(index, piece):
+                expected_pseudo[index, target] += 1
+            mask = board.generate_move_mask(index)
+            expected_legal.update(
+                (index, target) for target in range(SQUARES) if mask[target])
+
+        expected_mobility = [
+            sum(len(board.move_targets(index, board.data[index]))
+                for index in board.pieces[s]) for s in (0, 1)]
+        expected_attacks = [
+            [board.is_attacked(square, Piece(s * mlpiece.BLACK))
+             for square in range(SQUARES)] for s in (0, 1)]
+
+        problems = []
+        if pseudo[number] != expected_pseudo:
+            problems.append("moves")
+        if legal[number] != expected_legal:
+            problems.append("legal moves")
+        if batch.targets[number].tolist() != [
+                any(target == square for _, target in expected_pseudo)
+                for square in range(SQUARES)]:
+            problems.append("targets")
+        if batch.legal[number].tolist() != [
+                any(target == square for _, target in expected_legal)
+                for square in range(SQUARES)]:
+            problems.append("legal targets")
+        if batch.legal_counts[number] != len(board.legal_moves(board.turn)):
+            problems.append("legal count")
+        if batch.mobility[:, number].tolist() != expected_mobility:
+            problems.append("mobility")
+        if [batch.attacks[s, number].tolist() for s in (0, 1)] != \
+                expected_attacks:
+            problems.append("attacks")
+
+        if problems:
+            failures += 1
+            if report:
+                report("position %d (%s): %s differ" % (
+                    number, (bytes([board.turn.value]) + board.data).hex(),
+                    ", ".join(problems)))
+    return failures
+
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(
+        description="Vectorised move generation for many positions at once.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    check_parser = commands.add_parser(
+        "check", help="compare against Board on random positions")
+    check_parser.add_argument(
+        "-n", "--positions", type=int, default=500,
+        help="positions from random games and as many scattered ones "
+             "(default 500)")
+    check_parser.add_argument("--seed", type=int, default=1)
+
+    bench_parser = commands.add_parser(
+        "bench", help="measure positions per second against Board")
+    bench_parser.add_argument(
+        "-n", "--positions", type=int, default=100000,
+        help="positions in the batch (default 100000)")
+    bench_parser.add_argument(
+        "--distinct", type=int, default=1000,
+        help="distinct positions the batch is made of (default 1000)")
+    bench_parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+
+    if args.command == "check":
+        boards = random_boards(args.positions, rng) + \
+            [scattered_board(rng) for number in range(args.positions)]
+        failures = compare(boards, print)
+        print("%d positions, %d differ" % (len(boards), failures))
+        return failures == 0
+
+    elif args.command == "bench":
+        boards = random_boards(args.distinct, rng)
+        data, turns = board_arrays(boards)
+        repeats = -(-args.positions // len(boards))
+        data = np.tile(data, (repeats, 1))[:args.positions]
+        turns = np.tile(turns, repeats)[:args.positions]
+
+        start = time.perf_counter()
+        batch = analyse(data, turns)
+        seconds = time.perf_counter() - start
+        print("batch %10d positions %8.3f s %10d positions/s %d moves" % (
+            len(data), seconds, len(data) / seconds, batch.legal_counts.sum()))
+
+        start = time.perf_counter()
+        moves = 0
+        for board in boards:
+            for index in board.pieces[board.turn.value // mlpiece.BLACK]:
+                moves += board.generate_move_mask(index).count()
+        seconds = time.perf_counter() - start
+        print("board %10d positions %8.3f s %10d positions/s %d moves" % (
+            len(boards), seconds, len(boards) / seconds, moves))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,419 @@
+"""
+
+mlbitboard.py
+Integer bitboard backend for multi-level chess
+Samuel Bauman 2020
+
+"""
+
+from bitarray.util import int2ba
+import mlgeometry
+import mlpiece
+from mlchess import Piece, Board
+
+# Each of the 192 squares is one bit of a Python int, bit N being the square at
+# index position N. Python ints have no size limit, so a whole board fits in a
+# single int and occupancy tests, mask unions and counts are single operations
+# instead of loops over the board.
+
+BIT = tuple(1 << i for i in range(mlgeometry.SQUARES))
+
+# Side indexes used for the occupancy boards.
+WHITE = mlgeometry.WHITE
+BLACK = mlgeometry.BLACK
+
+# Rank indexes used for the occupancy boards (the rank value divided by 12).
+KING = mlpiece.KING // 12
+QUEEN = mlpiece.QUEEN // 12
+ROOK = mlpiece.ROOK // 12
+KNIGHT = mlpiece.KNIGHT // 12
+BISHOP = mlpiece.BISHOP // 12
+PAWN = mlpiece.PAWN // 12
+
+
+def mask_table(table):
+
+    """ Converts a table of index position tuples from mlgeometry.py into a
+    table of bitboards """
+
+    masks = []
+    for targets in table:
+        mask = 0
+        for index in targets:
+            mask |= BIT[index]
+        masks.append(mask)
+    return tuple(masks)
+
+
+def direction_tables(direction):
+
+    """ Returns the ray bitboard for every square along a direction and whether
+    index positions increase along it """
+
+    step = direction[0] + direction[1] * 8 + direction[2] * 8 * 8
+    table = mlgeometry.ray_table([direction])
+    rays = mask_table(sum(square_rays, ()) for square_rays in table)
+    return rays, step > 0
+
+
+# Bitboards of the squares reachable from each square by offset pieces, pawns
+# and each single slider direction. Sliders also keep which way the index
+# positions run along the ray so the first blocker can be found with a single
+# bit scan.
+
+KNIGHT_MASK = mask_table(mlgeometry.KNIGHT)
+KING_MASK = mask_table(mlgeometry.KING)
+
+PAWN_MOVE_MASK = tuple(mask_table(table) for table in mlgeometry.PAWN_MOVE)
+PAWN_DOUBLE_MASK = tuple(mask_table(table) for table in mlgeometry.PAWN_DOUBLE)
+PAWN_TAKE_MASK = tuple(mask_table(table) for table in mlgeometry.PAWN_TAKE)
+
+DIRECTIONS = [direction_tables(d) for d in mlgeometry.QUEEN_DIRECTIONS]
+
+
+def slider_table(directions):
+
+    """ Builds a tuple holding, for every square, the (ray, rays, ascending)
+    entries of each direction that does not leave the board straight away """
+
+    entries = [DIRECTIONS[mlgeometry.QUEEN_DIRECTIONS.index(d)]
+               for d in directions]
+    table = []
+    for index in range(mlgeometry.SQUARES):
+        table.append(tuple(
+            (rays[index], rays, ascending) for rays, ascending in entries
+            if rays[index]
+        ))
+    return tuple(table)
+
+
+SLIDER_RAYS = {
+    QUEEN: slider_table(mlgeometry.QUEEN_DIRECTIONS),
+    ROOK: slider_table(mlgeometry.ROOK_DIRECTIONS),
+    BISHOP: slider_table(mlgeometry.BISHOP_DIRECTIONS)
+}
+
+# All squares a rook or bishop could reach on an empty board, used to skip the
+# ray walks when no matching slider is lined up with a square at all.
+ROOK_LINES = tuple(
+    sum(entry[0] for entry in rays) for rays in SLIDER_RAYS[ROOK])
+BISHOP_LINES = tuple(
+    sum(entry[0] for entry in rays) for rays in SLIDER_RAYS[BISHOP])
+
+
+def slider_attacks(rays, occupied):
+
+    """ Returns the bitboard of squares a slider reaches along the given rays,
+    including the first blocker on each ray """
+
+    attacks = 0
+    for ray, ray_table, ascending in rays:
+        blockers = ray & occupied
+        if blockers:
+            if ascending:
+                blocker = (blockers & -blockers).bit_length() - 1
+            else:
+                blocker = blockers.bit_length() - 1
+            ray ^= ray_table[blocker]
+        attacks |= ray
+    return attacks
+
+
+def first_blockers(rays, occupied):
+
+    """ Returns the bitboard of the first blocker on each of the given rays """
+
+    found = 0
+    for ray, ray_table, ascending in rays:
+        blockers = ray & occupied
+        if blockers:
+            if ascending:
+                found |= blockers & -blockers
+            else:
+                found |= BIT[blockers.bit_length() - 1]
+    return found
+
+
+def to_bitarray(bits):
+
+    """ Converts a bitboard to the 192 element bitarray used by Board masks """
+
+    return int2ba(bits, length=mlgeometry.SQUARES, endian="little")
+
+
+class BitBoard(Board):
+
+    """ A Board that keeps per-side and per-rank occupancy as 192-bit ints and
+    generates movement masks with bitboard operations """
+
+    def __init__(self, board_data):
+
+        super().__init__(board_data)
+        self.refresh_bits()
+
+
+    def refresh_bits(self):
+
+        """ Rebuilds all occupancy bitboards from the board data """
+
+        self.sides = [0, 0]
+        self.ranks = [0] * 7
+        for index in range(mlgeometry.SQUARES):
+            self.add_bit(index, self.data[index])
+
+
+    def add_bit(self, index, piece):
+
+        """ Adds a piece to the occupancy bitboards """
+
+        if piece != mlpiece.EMPTY:
+            self.sides[mlpiece.SIDE_INDEX[piece]] |= BIT[index]
+            self.ranks[mlpiece.RANK[piece] // 12] |= BIT[index]
+
+
+    def remove_bit(self, index, piece):
+
+        """ Removes a piece from the occupancy bitboards """
+
+        if piece != mlpiece.EMPTY:
+            self.sides[mlpiece.SIDE_INDEX[piece]] &= ~BIT[index]
+            self.ranks[mlpiece.RANK[piece] // 12] &= ~BIT[index]
+
+
+    def set_piece(self, index, value):
+
+        """ Sets the encoded piece byte value at the given index position and
+        keeps the occupancy bitboards up to date """
+
+        if self.index_in_bounds(index):
+            self.remove_bit(index, self.data[index])
+            Board.set_piece(self, index, value)
+            self.add_bit(index, value)
+
+
+    def is_empty(self, index):
+
+        """ Determines if the board is empty at the given index position """
+
+        return not self.index_in_bounds(index) or \
+            not (self.sides[WHITE] | self.sides[BLACK]) & BIT[index]
+
+
+    def pseudo_move_bits(self, index, piece):
+
+        """ Returns the bitboard of squares the given piece could move to from
+        the index position, without testing for check """
+
+        if piece == mlpiece.EMPTY:
+            return 0
+
+        side = mlpiece.SIDE_INDEX[piece]
+        rank = mlpiece.RANK[piece] // 12
+        state = mlpiece.STATE[piece]
+        own = self.sides[side]
+        occupied = own | self.sides[1 - side]
+
+        if rank == PAWN:
+            bits = PAWN_TAKE_MASK[side][index] & self.sides[1 - side]
+            bits |= PAWN_MOVE_MASK[side][index] & ~occupied
+            if state == mlpiece.UNMOVED:
+                bits |= PAWN_DOUBLE_MASK[side][index] & ~occupied
+
+        elif rank == KNIGHT:
+            bits = KNIGHT_MASK[index] & ~own
+
+        elif rank == KING:
+            bits = KING_MASK[index] & ~own
+
+            # Castling logic, see Board.move_targets.
+            if state == mlpiece.UNMOVED:
+                rook_king_side, king_side_1, king_side_2, queen_side_1, \
+                    queen_side_2, queen_side_3, rook_queen_side = \
+                    mlgeometry.CASTLE[index]
+
+                if (not occupied & (BIT[king_side_1] | BIT[king_side_2]) and
+                    bits & BIT[king_side_2] and
+                    mlpiece.STATE[self.data[rook_king_side]] == mlpiece.UNMOVED):
+                    bits |= BIT[king_side_1]
+
+                if (not occupied & (BIT[queen_side_1] | BIT[queen_side_2] |
+                                    BIT[queen_side_3]) and
+                    bits & BIT[queen_side_1] and
+                    mlpiece.STATE[self.data[rook_queen_side]] == mlpiece.UNMOVED):
+                    bits |= BIT[queen_side_2]
+
+        elif rank in SLIDER_RAYS:
+            bits = slider_attacks(SLIDER_RAYS[rank][index], occupied) & ~own
+
+        else:
+            return 0
+
+        return bits
+
+
+    def filter_move_bits(self, index, side, bits):
+
+        """ Removes the moves of the piece at the index position from bits that
+        would leave the king of the given side index in check """
+
+        king_side = Piece.WHITE if side == WHITE else Piece.BLACK
+        legal = 0
+        while bits:
+            low = bits & -bits
+            to_index = low.bit_length() - 1
+            if not self.move_results_in_check(king_side, index, to_index):
+                legal |= low
+            bits ^= low
+        return legal
+
+
+    def generate_move_bits(self, index, test_piece = None):
+
+        """ Generates a movement mask for a particular piece and returns it as
+        a bitboard """
+
+        piece = self.get_piece(index) if test_piece == None else test_piece
+        bits = self.pseudo_move_bits(index, piece)
+
+        # Removes all locations that would result in check for this player.
+        # As in Board.legal_targets, only pieces that could expose the king
+        # need their moves tested.
+        if not test_piece and bits:
+            side = mlpiece.SIDE_INDEX[piece]
+            king_index = self.king[Piece.WHITE if side == WHITE else
+                                   Piece.BLACK]
+            if (index == king_index or
+                    index in mlgeometry.QUEEN_LINES[king_index] or
+                    self.is_attacked(king_index, Piece.WHITE if side == BLACK
+                                     else Piece.BLACK)):
+                bits = self.filter_move_bits(index, side, bits)
+
+        return bits
+
+
+    def generate_move_mask(self, index, test_piece = None):
+
+        """ Generates a movement mask for a particular piece and returns it. """
+
+        return to_bitarray(self.generate_move_bits(index, test_piece))
+
+
+    @staticmethod
+    def attacked_bits(square, by_side, occupied, attackers, ranks):
+
+        """ Returns true if any of the attackers bitboard pieces, which belong
+        to the given side index, attack the square with the given occupancy and
+        rank bitboards """
+
+        if (KING_MASK[square] & attackers & ranks[KING] or
+            KNIGHT_MASK[square] & attackers & ranks[KNIGHT] or
+            PAWN_TAKE_MASK[1 - by_side][square] & attackers & ranks[PAWN]):
+            return True
+
+        rook_like = attackers & (ranks[ROOK] | ranks[QUEEN])
+        if rook_like & ROOK_LINES[square] and first_blockers(
+                SLIDER_RAYS[ROOK][square], occupied) & rook_like:
+            return True
+
+        bishop_like = attackers & (ranks[BISHOP] | ranks[QUEEN])
+        if bishop_like & BISHOP_LINES[square] and first_blockers(
+                SLIDER_RAYS[BISHOP][square], occupied) & bishop_like:
+            return True
+
+        return False
+
+
+    def is_attacked(self, square, by_side, from_index = None, to_index = None):
+
+        """ Returns true if any piece of by_side attacks the square, optionally
+        as if the piece at from_index had been moved to to_index """
+
+        # The move is applied to copies of the bitboards only, so the board
+        # itself is never touched.
+        side = WHITE if by_side == Piece.WHITE else BLACK
+        occupied = self.sides[WHITE] | self.sides[BLACK]
+        attackers = self.sides[side]
+        ranks = self.ranks
+
+        if from_index is not None and from_index != to_index:
+            occupied = occupied & ~BIT[from_index] | BIT[to_index]
+            if attackers & BIT[from_index]:
+                # One of the attacking pieces is the one being moved.
+                piece = self.data[from_index]
+                ranks = [bits & ~BIT[to_index] for bits in ranks]
+                ranks[mlpiece.RANK[piece] // 12] |= BIT[to_index]
+                attackers = attackers & ~BIT[from_index] | BIT[to_index]
+            else:
+                attackers &= ~BIT[to_index]
+
+        return self.attacked_bits(square, side, occupied, attackers, ranks)
+
+
+    def move_results_in_check(self, king_side, from_index, to_index):
+
+        """ Determines if a move would result in check without changing the
+        board """
+
+        king_index = self.king[king_side]
+        if king_index == from_index:
+            king_index = to_index
+
+        opponent_side = Piece.WHITE if king_side == Piece.BLACK else Piece.BLACK
+        return self.is_attacked(king_index, opponent_side, from_index, to_index)
+
+
+    def generate_legal_moves(self, side, captures_only = False):
+
+        """ Generates the packed legal moves of every piece of the given side
+        one at a time, or only its captures if captures_only is set """
+
+        side_index = WHITE if side == Piece.WHITE else BLACK
+        opponent_side = Piece.WHITE if side == Piece.BLACK else Piece.BLACK
+        enemy = self.sides[1 - side_index]
+        king_index = self.king[side]
+        in_check = self.is_attacked(king_index, opponent_side)
+        king_lines = mlgeometry.QUEEN_LINES[king_index]
+        target_mask = enemy if captures_only else -1
+
+        pieces = self.sides[side_index]
+        while pieces:
+            low = pieces & -pieces
+            index = low.bit_length() - 1
+            pieces ^= low
+
+            piece = self.data[index]
+            rank = mlpiece.RANK[piece] // 12
+            bits = self.pseudo_move_bits(index, piece) & target_mask
+            if bits and (in_check or index == king_index or
+                         index in king_lines):
+                bits = self.filter_move_bits(index, side_index, bits)
+
+            while bits:
+                target = bits & -bits
+                to_index = target.bit_length() - 1
+                bits ^= target
+
+                flags = 0
+                if target & enemy:
+                    flags |= Board.MOVE_CAPTURE
+                if rank == KING:
+                    if Board.castle_rook(index, to_index):
+                        flags |= Board.MOVE_CASTLE
+                elif rank == PAWN:
+                    if target & PAWN_DOUBLE_MASK[side_index][index]:
+                        flags |= Board.MOVE_DOUBLE
+
+                yield index | (to_index << 8) | (flags << 16)
+
+
+    def has_legal_move(self, side):
+
+        """ Returns true if any piece of the given side has a legal move """
+
+        pieces = self.sides[WHITE if side == Piece.WHITE else BLACK]
+        while pieces:
+            low = pieces & -pieces
+            if self.generate_move_bits(low.bit_length() - 1):
+                return True
+            pieces ^= low
+        return False
@@ -0,0 +1,265 @@
+"""
+
+mlbook.py
+Opening books for multi-level chess
+Samuel Bauman 2020
+
+"""
+
+import argparse
+import collections
+import mmap
+import os
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import mlbitboard
+import mlrecord
+from mlchess import Piece, Board
+
+# An opening book holds the moves played from the positions early in recorded
+# games, how often each move was played and how the games went on to end, so
+# the engine can play them straight away instead of searching the opening,
+# where the search is slowest.
+#
+# It is built from game record files (see mlrecord.py) in two steps. Every
+# file is counted on its own by a worker process: its games are replayed move
+# by move up to a number of plies, and each move is counted under the key of
+# the position it was played from, the board's Zobrist hash. The counts of
+# all files are then added up, and moves played in fewer than a minimum
+# number of games are dropped, which also drops the rare lines that start
+# with them, as no position after a rare move can have been reached more
+# often than the move itself unless it was also reached another way.
+#
+# The file is a header and one fixed size record per move, sorted by key and
+# then by the number of games, most played first. A probe maps the file and
+# binary searches the keys, so a book is ready to use as soon as it is
+# opened, however big it is.
+#
+# Usage: python3 mlbook.py build book.mlbk games.mlg ... [-w workers]
+#        python3 mlbook.py probe book.mlbk [game file]
+#        python3 mlsearch.py [game file] --book book.mlbk
+#        python3 tmlchess.py --book book.mlbk
+
+MAGIC = b"MLBK"
+VERSION = 1
+# Magic, version and number of records.
+HEADER = struct.Struct(">4sB3xQ")
+# Key, move (from and to index positions), games, wins and draws for the side
+# that played the move.
+RECORD = struct.Struct(">QIIII")
+KEY = struct.Struct(">Q")
+
+EXTENSION = ".mlbk"
+
+# The plies of each game that are counted, and the fewest games a move has
+# to be played in to be kept.
+BOOK_PLIES = 16
+MIN_GAMES = 2
+
+BookMove = collections.namedtuple("BookMove", "move games wins draws")
+
+
+def count_file(path, plies = BOOK_PLIES):
+
+    """ Returns the counts of the moves played in the first plies of the
+    games of a record file, as {key: {move: [games, wins, draws]}} """
+
+    counts = {}
+    for game in mlrecord.read_file(path):
+        board = game.board(mlbitboard.BitBoard)
+        for ply, move in enumerate(game.moves()):
+            if ply >= plies:
+                break
+            side = board.turn.value // 127
+            moves = counts.setdefault(board.hash, {})
+            count = moves.get(move & 0xffff)
+            if count is None:
+                count = moves[move & 0xffff] = [0, 0, 0]
+            count[0] += 1
+            if game.result == ("1-0" if side == 0 else "0-1"):
+                count[1] += 1
+            elif game.result == "1/2-1/2":
+                count[2] += 1
+            board.make_move(move)
+    return counts
+
+
+def add_counts(total, counts):
+
+    """ Adds the counts of one file to the total counts """
+
+    for key, moves in counts.items():
+        total_moves = total.setdefault(key, {})
+        for move, count in moves.items():
+            total_count = total_moves.get(move)
+            if total_count is None:
+                total_moves[move] = count
+            else:
+                for i in range(3):
+                    total_count[i] += count[i]
+
+
+def write_book(path, counts, min_games = MIN_GAMES):
+
+    """ Writes the moves played in at least min_games games as a book file,
+    replacing the file at path in one step. Returns the number of moves. """
+
+    records = []
+    for key, moves in counts.items():
+        for move, (games, wins, draws) in moves.items():
+            if games >= min_games:
+                records.append((key, -games, move, wins, draws))
+    records.sort()
+
+    data = bytearray(HEADER.size + len(records) * RECORD.size)
+    HEADER.pack_into(data, 0, MAGIC, VERSION, len(records))
+    for number, (key, games, move, wins, draws) in enumerate(records):
+        RECORD.pack_into(data, HEADER.size + number * RECORD.size,
+                         key, move, -games, wins, draws)
+
+    temporary = "%s.%d.tmp" % (path, os.getpid())
+    with open(temporary, "wb") as file:
+        file.write(data)
+    os.replace(temporary, path)
+    return len(records)
+
+
+def build(path, sources, plies = BOOK_PLIES, min_games = MIN_GAMES,
+          workers = None, report = None):
+
+    """ Builds a book from game record files, counting each file in its own
+    worker process. Returns the number of moves in the book. """
+
+    total = {}
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for source, counts in zip(sources, pool.map(
+                count_file, sources, [plies] * len(sources))):
+            add_counts(total, counts)
+            if report:
+                report("%s: %d positions" % (source, len(total)))
+    return write_book(path, total, min_games)
+
+
+class Book:
+
+    """ A book file, probed through a memory map """
+
+    def __init__(self, path):
+
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count = HEADER.unpack_from(self.map)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not an opening book" % path)
+        if len(self.map) != HEADER.size + self.count * RECORD.size:
+            raise ValueError("%s has the wrong size" % path)
+
+    def close(self):
+
+        self.map.close()
+        self.file.close()
+
+    def __len__(self):
+
+        return self.count
+
+    def key_at(self, number):
+
+        return KEY.unpack_from(self.map, HEADER.size + number * RECORD.size)[0]
+
+    def moves(self, board):
+
+        """ Returns the BookMoves of a board's position, most played first """
+
+        # Finds the first record of the key with a binary search.
+        key = board.hash
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.key_at(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        moves = []
+        while low < self.count and self.key_at(low) == key:
+            moves.append(BookMove._make(RECORD.unpack_from(
+                self.map, HEADER.size + low * RECORD.size)[1:]))
+            low += 1
+        return moves
+
+    def choose(self, board, rng = None):
+
+        """ Returns the packed legal move to play from the book, or None if
+        the position is not in it. The most played move is chosen, or with
+        rng a move at random in proportion to how often it was played. """
+
+        if board.turn not in [Piece.WHITE, Piece.BLACK]:
+            return None
+        moves = self.moves(board)
+        if not moves:
+            return None
+        if rng is None:
+            choice = moves[0]
+        else:
+            choice = rng.choices(moves, [move.games for move in moves])[0]
+        # The key could belong to another position with the same hash, so
+        # the move is only played if it is legal here.
+        for move in board.legal_moves(board.turn):
+            if move & 0xffff == choice.move:
+                return move
+        return None
+
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(
+        description="Build and probe multi-level chess opening books.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = commands.add_parser(
+        "build", help="build a book from game record files")
+    build_parser.add_argument("book", help="book file to write")
+    build_parser.add_argument(
+        "sources", nargs="+", help="game record files (see mlrecord.py)")
+    build_parser.add_argument(
+        "--plies", type=int, default=BOOK_PLIES,
+        help="plies of each game to count (default %d)" % BOOK_PLIES)
+    build_parser.add_argument(
+        "--min-games", type=int, default=MIN_GAMES,
+        help="fewest games a move is kept for (default %d)" % MIN_GAMES)
+    build_parser.add_argument(
+        "-w", "--workers", type=int, default=os.cpu_count(),
+        help="number of worker processes (default one per CPU)")
+
+    probe_parser = commands.add_parser("probe", help="probe a saved game")
+    probe_parser.add_argument("book")
+    probe_parser.add_argument(
+        "game_file", nargs="?", default="newgame",
+        help="name of a game in saves/ or a path (default newgame)")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        start = time.perf_counter()
+        count = build(args.book, args.sources, args.plies, args.min_games,
+                      args.workers, print)
+        print("%d moves in %s, %.3f s" % (
+            count, args.book, time.perf_counter() - start))
+
+    elif args.command == "probe":
+        book = Book(args.book)
+        board = Board.load(args.game_file)
+        moves = book.moves(board)
+        if not moves:
+            print("not in book")
+        for move in moves:
+            print("%s games %d wins %d draws %d" % (
+                mlrecord.move_text(board, move.move), move.games, move.wins,
+                move.draws))
+
+
+if __name__ == '__main__':
+    main()
@@ -9,6 +9,11 @@ Samuel Bauman 2020
 from enum import Enum
 from bitarray import bitarray
 from datetime import date
+import random
+import warnings
+import mleval
+import mlgeometry
+import mlpiece
 
 class Piece(Enum):
 
@@ -36,10 +41,69 @@ class Piece(Enum):
     CHECK_NORMAL    =   6
     CHECKMATE       =   7
 
+    # Turn values of games that ended in a draw.
+    STALEMATE       =   8
+    DRAW            =   9
+
     MOVE            =   254
     TAKE            =   255
 
 
+# The [side, rank, state] Piece values of every byte, or None for bytes that
+# do not decode. Board.decode_piece looks pieces up here instead of building
+# the Enum members every time; code that only needs the values works with the
+# plain ints and tables in mlpiece.py instead.
+
+def decode_table():
+
+    """ Builds the tuple of decoded Piece values for every byte """
+
+    table = []
+    for byte in range(256):
+        try:
+            table.append((Piece(mlpiece.SIDE[byte]), Piece(mlpiece.RANK[byte]),
+                          Piece(mlpiece.STATE[byte])))
+        except ValueError:
+            table.append(None)
+    return tuple(table)
+
+DECODED = decode_table()
+
+# The side Piece values indexed by side index (mlpiece.SIDE_INDEX).
+SIDES = (Piece.WHITE, Piece.BLACK)
+
+
+# Random 64-bit keys used for Zobrist hashing of positions: one for every
+# possible piece value on every square and one for every turn value. XORing
+# together the keys of everything in a position gives its hash, and a move only
+# has to XOR out the old keys and XOR in the new ones of the squares it changes.
+# The keys come from a fixed seed so hashes are the same in every process.
+
+def zobrist_keys(count, seed):
+
+    """ Returns a tuple of 256 random 64-bit keys per count, with the key for
+    the empty value (0) always being 0 """
+
+    rng = random.Random(seed)
+    return tuple(
+        tuple([0] + [rng.getrandbits(64) for value in range(1, 256)])
+        for i in range(count)
+    )
+
+ZOBRIST_PIECE = zobrist_keys(192, 0x6d6c6368657373)
+ZOBRIST_TURN = zobrist_keys(1, 0x6d6c636865737374)[0]
+
+# The material and square value of every piece byte on every square, which
+# set_piece adds to and subtracts from the score the same way as the keys.
+SQUARE_VALUES = mleval.SQUARE_VALUES
+
+# A game is drawn once the same position has been reached REPETITIONS times,
+# or after DRAW_PLIES plies (the fifty-move rule's hundred) without a capture
+# or a pawn move.
+DRAW_PLIES = 100
+REPETITIONS = 3
+
+
 class Board:
 
     """ This class contains the logic for a multi-level chess game """
@@ -48,45 +112,17 @@ class Board:
     # The direction vectors used by queen, bishop, and rook movement.
 
     MOVE_TAKE_DIRECTION = {
-        Piece.QUEEN: [
-            [-1, 0, 0], [ 1, 0, 0], [ 0, 0,-1], [ 0, 0, 1], [-1, 0,-1],
-            [-1, 0, 1], [ 1, 0,-1], [ 1, 0, 1], [-1,-1, 0], [ 1,-1, 0],
-            [ 0,-1,-1], [ 0,-1, 1], [-1,-1,-1], [-1,-1, 1], [ 1,-1,-1],
-            [ 1,-1, 1], [-1, 1, 0], [ 1, 1, 0], [ 0, 1,-1], [ 0, 1, 1],
-            [-1, 1,-1], [-1, 1, 1], [ 1, 1,-1], [ 1, 1, 1], [ 0, 1, 0],
-            [ 0,-1, 0]
-        ],
-        Piece.BISHOP: [
-            [-1,-1, 0], [-1, 1, 0], [ 1,-1, 0], [ 1, 1, 0], [-1,-1, 1],
-            [-1, 1, 1], [ 1,-1, 1], [ 1, 1, 1], [-1,-1,-1], [-1, 1,-1],
-            [ 1,-1,-1], [ 1, 1,-1]
-        ],
-        Piece.ROOK: [
-            [-1, 0, 0], [ 1, 0, 0], [ 0, 1, 0], [ 0,-1, 0], [ 0, 0,-1],
-            [ 0, 0, 1], [-1, 0,-1], [ 1, 0,-1], [ 0, 1,-1], [ 0,-1,-1],
-            [-1, 0, 1], [ 1, 0, 1], [ 0, 1, 1], [ 0,-1, 1]
-        ]
+        Piece.QUEEN: mlgeometry.QUEEN_DIRECTIONS,
+        Piece.BISHOP: mlgeometry.BISHOP_DIRECTIONS,
+        Piece.ROOK: mlgeometry.ROOK_DIRECTIONS
     }
 
 
     # The offset positions used by knight and king movement.
 
     MOVE_TAKE_OFFSET = {
-        Piece.KNIGHT: [
-            [ 1,-2, 0], [ 2,-1, 0], [ 2, 1, 0], [ 1, 2, 0], [-1, 2, 0],
-            [-2, 1, 0], [-2,-1, 0], [-1,-2, 0], [ 0,-2, 1], [ 2, 0, 1],
-            [ 0, 2, 1], [-2, 0, 1], [-1, 0, 2], [ 0,-1, 2], [ 1, 0, 2],
-            [ 0, 1, 2], [ 0,-2,-1], [ 2, 0,-1], [ 0, 2,-1], [-2, 0,-1],
-            [-1, 0,-2], [ 0,-1,-2], [ 1, 0,-2], [ 0, 1,-2]
-        ],
-        Piece.KING: [
-            [-1, 1, 1], [ 0, 1, 1], [ 1, 1, 1], [-1, 0, 1], [ 0, 0, 1],
-            [ 1, 0, 1], [-1,-1, 1], [ 0,-1, 1], [ 1,-1, 1], [-1, 1, 0],
-            [ 0, 1, 0], [ 1, 1, 0], [-1, 0, 0], [ 1, 0, 0], [-1,-1, 0],
-            [ 0,-1, 0], [ 1,-1, 0], [-1, 1,-1], [ 0, 1,-1], [ 1, 1,-1],
-            [-1, 0,-1], [ 0, 0,-1], [ 1, 0,-1], [-1,-1,-1], [ 0,-1,-1],
-            [ 1,-1,-1]
-        ]
+        Piece.KNIGHT: mlgeometry.KNIGHT_OFFSETS,
+        Piece.KING: mlgeometry.KING_OFFSETS
     }
 
 
@@ -94,32 +130,32 @@ class Board:
 
     PAWN = {
         Piece.WHITE: {
-            Piece.MOVE: [
-                [ 0, 1, 0], [ 0, 1, 1], [ 0, 1,-1], [ 0, 0, 1], [ 0, 0,-1]
-            ],
-            Piece.UNMOVED: [
-                [ 0, 2, 0], [ 0, 2, 2], [ 0, 2,-2]
-            ],
-            Piece.TAKE: [
-                [-1, 1,-1], [-1, 1, 0], [-1, 1, 1], [ 1, 1,-1], [ 1, 1, 0],
-                [ 1, 1, 1]
-            ]
+            Piece.MOVE: mlgeometry.PAWN_MOVE_OFFSETS[mlgeometry.WHITE],
+            Piece.UNMOVED: mlgeometry.PAWN_DOUBLE_OFFSETS[mlgeometry.WHITE],
+            Piece.TAKE: mlgeometry.PAWN_TAKE_OFFSETS[mlgeometry.WHITE]
         },
         Piece.BLACK: {
-            Piece.MOVE: [
-                [ 0,-1, 0], [ 0,-1, 1], [ 0,-1,-1], [ 0, 0, 1], [ 0, 0,-1]
-            ],
-            Piece.UNMOVED: [
-                [ 0,-2, 0], [ 0,-2, 2], [ 0,-2,-2]
-            ],
-            Piece.TAKE: [
-                [-1,-1,-1], [-1,-1, 0], [-1,-1, 1], [ 1,-1,-1], [ 1,-1, 0],
-                [ 1,-1, 1]
-            ]
+            Piece.MOVE: mlgeometry.PAWN_MOVE_OFFSETS[mlgeometry.BLACK],
+            Piece.UNMOVED: mlgeometry.PAWN_DOUBLE_OFFSETS[mlgeometry.BLACK],
+            Piece.TAKE: mlgeometry.PAWN_TAKE_OFFSETS[mlgeometry.BLACK]
         }
     }
 
 
+    # The precomputed target squares for each rank value, see mlgeometry.py.
+
+    OFFSET_TARGETS = {
+        mlpiece.KNIGHT: mlgeometry.KNIGHT,
+        mlpiece.KING: mlgeometry.KING
+    }
+
+    DIRECTION_RAYS = {
+        mlpiece.QUEEN: mlgeometry.QUEEN_RAYS,
+        mlpiece.BISHOP: mlgeometry.BISHOP_RAYS,
+        mlpiece.ROOK: mlgeometry.ROOK_RAYS
+    }
+
+
     @staticmethod
     def index_in_bounds(index):
 
@@ -165,10 +201,10 @@ class Board:
 
         """ Converts a number (0-255) to side, rank, and state values """
 
-        side = Piece(byte // 127 * 127)
-        rank = Piece((byte - side.value) // 12 * 12)
-        state = Piece(byte - side.value - rank.value)
-        return [side, rank, state]
+        decoded = DECODED[byte]
+        if decoded is None:
+            raise ValueError("%r is not a valid piece value" % byte)
+        return list(decoded)
 
 
     def __init__(self, board_data):
@@ -176,44 +212,118 @@ class Board:
         self.data = bytearray(192)
         self.masks = {}
         self.current_mask = -1
+        self.mask_queue = None
         self.king = {}
+        self.undo = []
+        self.pieces = [set(), set()]
 
         # Set the turn to the first byte of board_date and the actual data to
         # the rest.
         self.turn = Piece(int.from_bytes(board_data[:1],byteorder="big"))
         self.data = board_data[1:]
 
+        self.refresh_pieces()
         self.set_king_indexes()
+        self.hash = self.compute_hash()
+        self.score = self.compute_score()
 
-    def set_king_indexes(self):
+        # The keys of the positions reached since the last capture or pawn
+        # move (their hashes, which cover the turn and every piece byte
+        # including its state), the number of times each of them was reached
+        # and the number of plies since that move. Positions before such a
+        # move can never be reached again, so make_move starts a new history
+        # instead of keeping them.
+        self.history = [self.hash]
+        self.seen = {self.hash: 1}
+        self.quiet_plies = 0
+
+
+    @classmethod
+    def load(cls, game_file):
+
+        """ Creates a board from a game file name in saves/ or a path to one """
+
+        path = game_file
+        if "/" not in path and not path.endswith(".txt"):
+            path = "saves/" + path + ".txt"
+        with open(path, "r") as file:
+            return cls(bytearray.fromhex(file.read().strip()))
 
-        #with open(file, "r") as f:
-        #    board_data = f.readline()
-        #self.data = bytearray.fromhex(board_data)
+
+    def compute_hash(self):
+
+        """ Computes the Zobrist hash of the position from the turn and the
+        board data """
+
+        value = ZOBRIST_TURN[self.turn.value]
+        for index in range(192):
+            value ^= ZOBRIST_PIECE[index][self.data[index]]
+        return value
+
+
+    def compute_score(self):
+
+        """ Computes the material and square score of the position (see
+        mleval.py) from the board data """
+
+        return mleval.score_data(self.data)
+
+
+    def set_turn(self, turn):
+
+        """ Sets the turn and keeps the position hash up to date """
+
+        self.hash ^= ZOBRIST_TURN[self.turn.value] ^ ZOBRIST_TURN[turn.value]
+        self.turn = turn
+
+
+    def refresh_pieces(self):
+
+        """ Rebuilds the per-side piece lists from the board data """
+
+        # pieces[0] holds the index positions of every white piece and
+        # pieces[1] those of every black piece. set_piece keeps them up to
+        # date afterwards, so loops over one side's pieces never have to scan
+        # all 192 squares.
+        self.pieces = [set(), set()]
+        for index in range(192):
+            if self.data[index] != mlpiece.EMPTY:
+                self.pieces[mlpiece.SIDE_INDEX[self.data[index]]].add(index)
+
+
+    def set_king_indexes(self):
 
         # Finds the white and black king piece index values from loaded game
-        self.king[Piece.WHITE] = next(
-            i for i in range(192) if Board.decode_piece(self.data[i])[:2] == \
-            [Piece.WHITE, Piece.KING]
-        )
-        self.king[Piece.BLACK] = next(
-            i for i in range(192) if Board.decode_piece(self.data[i])[:2] == \
-            [Piece.BLACK, Piece.KING]
-        )
+        for side in [Piece.WHITE, Piece.BLACK]:
+            self.king[side] = next(
+                i for i in self.pieces[side.value // 127]
+                if mlpiece.RANK[self.data[i]] == mlpiece.KING
+            )
 
     def get_piece(self, index):
 
         """ Returns the encoded piece byte value at the given index position """
 
-        return Piece.EMPTY.value if not Board.index_in_bounds(index) \
+        return mlpiece.EMPTY if not Board.index_in_bounds(index) \
         else self.data[index]
 
 
     def set_piece(self, index, value):
 
-        """ Sets the encoded piece byte value at the given index position """
-
-        if self.index_in_bounds(index): self.data[index] = value
+        """ Sets the encoded piece byte value at the given index position and
+        keeps the position hash, score and piece lists up to date """
+
+        if self.index_in_bounds(index):
+            old_value = self.data[index]
+            if old_value != mlpiece.EMPTY:
+                self.pieces[mlpiece.SIDE_INDEX[old_value]].discard(index)
+            if value != mlpiece.EMPTY:
+                self.pieces[mlpiece.SIDE_INDEX[value]].add(index)
+            self.hash ^= ZOBRIST_PIECE[index][old_value] ^ \
+                ZOBRIST_PIECE[index][value]
+            square_values = SQUARE_VALUES[index]
+            self.score += square_values[value] - square_values[old_value]
+            self.data[index] = value
 
     def get_info(self, index):
         info = Board.decode_piece(self.get_piece(index))
@@ -223,7 +333,7 @@ class Board:
 
         """ Determines if the board is empty at the given index position """
 
-        return True if self.get_piece(index) == Piece.EMPTY.value else False
+        return True if self.get_piece(index) == mlpiece.EMPTY else False
 
 
     def get_mask(self, index):
@@ -235,26 +345,10 @@ class Board:
         self.current_mask == -1 else self.masks[self.current_mask][index]
 
 
-    def generate_move_mask(self, index, test_piece = None):
-
-        """ Generates a movement mask for a particular piece and returns it. """
-
-        # A movement mask can be associated with any piece on the board and 
-        # indicates all of the possible legal moves that piece can make. 
-        # All movement masks are then stored in memory (in the board.masks 
-        # dictionary) while the player is deciding their move. All movement
-        # masks are cleared after each move. They are generated on an as-needed
-        # basis as the player moves the cursor over pieces without an 
-        # associated movement mask.
-
-        # Generate a new blank mask for this piece.
-        new_mask = 192 * bitarray([False])
-
-        # Get information from the board about the current piece.
-        pos = Board.index_to_vector(index)
-        piece = self.get_piece(index) if test_piece == None else test_piece
-        side, rank, state = Board.decode_piece(piece)
+    def move_targets(self, index, piece):
 
+        """ Returns a list of the index positions the given piece could move to
+        from the given index position, without testing for check. """
 
         # Determines the movement rules to be used for the selected piece. 
         # There are three categories of basic movement types: Pawn, offset, 
@@ -265,111 +359,106 @@ class Board:
         # specific offset relative to their position.
         # Direction movement refers to queen, rook, and bishop movement as they
         # move/take along multiple directions.
+        # The squares reachable from each index position are looked up in the
+        # tables from mlgeometry.py, so only the pieces on the board have to be
+        # tested here.
 
-        if rank == Piece.PAWN:
-
-            for move_or_take in Board.PAWN[side]:
-
-                for offset in Board.PAWN[side][move_or_take]:
+        data = self.data
+        side = mlpiece.SIDE[piece]
+        rank = mlpiece.RANK[piece]
+        state = mlpiece.STATE[piece]
+        enemy = mlpiece.ENEMY[side]
+        targets = []
 
-                    new_pos = [pos[i] + offset[i] for i in range(3)]
-                    if Board.vector_in_bounds(new_pos):
+        if rank == mlpiece.PAWN:
 
-                        new_index = Board.vector_to_index(new_pos)
-                        new_piece = self.get_piece(new_index)
-                        new_side, new_rank, new_state = \
-                            Board.decode_piece(new_piece)
+            pawn_side = mlpiece.SIDE_INDEX[piece]
 
-                        if move_or_take == Piece.TAKE:
-                            if (new_piece != Piece.EMPTY.value and
-                            new_side != side):
-                                new_mask[new_index] = True
+            for new_index in mlgeometry.PAWN_TAKE[pawn_side][index]:
+                if enemy[data[new_index]]:
+                    targets.append(new_index)
 
-                        elif (move_or_take == Piece.MOVE or
-                        move_or_take == state):
-                            if new_piece == Piece.EMPTY.value:
-                                new_mask[new_index] = True
+            for new_index in mlgeometry.PAWN_MOVE[pawn_side][index]:
+                if data[new_index] == mlpiece.EMPTY:
+                    targets.append(new_index)
 
-        elif rank in Board.MOVE_TAKE_OFFSET:
+            if state == mlpiece.UNMOVED:
+                for new_index in mlgeometry.PAWN_DOUBLE[pawn_side][index]:
+                    if data[new_index] == mlpiece.EMPTY:
+                        targets.append(new_index)
 
-            for offset in Board.MOVE_TAKE_OFFSET[rank]:
+        elif rank in Board.OFFSET_TARGETS:
 
-                new_pos = [pos[i] + offset[i] for i in range(3)]
-                if Board.vector_in_bounds(new_pos):
-
-                    new_index = Board.vector_to_index(new_pos)
-                    new_piece = self.get_piece(new_index)
-                    new_side, new_rank, new_state = \
-                        Board.decode_piece(new_piece)
-                    if ((new_piece != Piece.EMPTY.value and new_side != side)
-                    or new_piece == Piece.EMPTY.value):
-                        new_mask[new_index] = True
+            for new_index in Board.OFFSET_TARGETS[rank][index]:
+                new_piece = data[new_index]
+                if new_piece == mlpiece.EMPTY or enemy[new_piece]:
+                    targets.append(new_index)
 
             # Castling logic
-            if rank == Piece.KING and state == Piece.UNMOVED:
-                rook_king_side  = Board.vector_to_index(
-                    [ pos[0] - 3, pos[1], pos[2] ] )
-                king_side_1     = Board.vector_to_index(
-                    [ pos[0] - 2, pos[1], pos[2] ] )
-                king_side_2     = Board.vector_to_index(
-                    [ pos[0] - 1, pos[1], pos[2] ] )
-                queen_side_1    = Board.vector_to_index(
-                    [ pos[0] + 1, pos[1], pos[2] ] )
-                queen_side_2    = Board.vector_to_index(
-                    [ pos[0] + 2, pos[1], pos[2] ] )
-                queen_side_3    = Board.vector_to_index(
-                    [ pos[0] + 3, pos[1], pos[2] ] )
-                rook_queen_side = Board.vector_to_index(
-                    [ pos[0] + 4, pos[1], pos[2] ] )
+            if rank == mlpiece.KING and state == mlpiece.UNMOVED:
+                rook_king_side, king_side_1, king_side_2, queen_side_1, \
+                    queen_side_2, queen_side_3, rook_queen_side = \
+                    mlgeometry.CASTLE[index]
 
                 # Check king-side castling
-                if (self.is_empty(king_side_1) and
-                    self.is_empty(king_side_2) and
-                    new_mask[king_side_2] == True and
-                    self.get_info(rook_king_side)["state"] == Piece.UNMOVED):
-                    new_mask[king_side_1] = True
+                if (data[king_side_1] == mlpiece.EMPTY and
+                    data[king_side_2] == mlpiece.EMPTY and
+                    king_side_2 in targets and
+                    mlpiece.STATE[data[rook_king_side]] == mlpiece.UNMOVED):
+                    targets.append(king_side_1)
 
                 # Check queen-side castling
-                if (self.is_empty(queen_side_1) and
-                    self.is_empty(queen_side_2) and
-                    self.is_empty(queen_side_3) and
-                    new_mask[queen_side_1] == True and
-                    self.get_info(rook_queen_side)["state"] == Piece.UNMOVED):
-                    new_mask[queen_side_2] = True
+                if (data[queen_side_1] == mlpiece.EMPTY and
+                    data[queen_side_2] == mlpiece.EMPTY and
+                    data[queen_side_3] == mlpiece.EMPTY and
+                    queen_side_1 in targets and
+                    mlpiece.STATE[data[rook_queen_side]] == mlpiece.UNMOVED):
+                    targets.append(queen_side_2)
+
+        elif rank in Board.DIRECTION_RAYS:
+
+            for ray in Board.DIRECTION_RAYS[rank][index]:
 
-        elif rank in Board.MOVE_TAKE_DIRECTION:
+                for new_index in ray:
 
-            for direction in Board.MOVE_TAKE_DIRECTION[rank]:
+                    new_piece = data[new_index]
+                    if new_piece == mlpiece.EMPTY:
+                        targets.append(new_index)
+                    else:
+                        if enemy[new_piece]:
+                            targets.append(new_index)
+                        break
 
-                for distance in range(1,8):
+        return targets
 
-                    extension = [direction[i] * distance for i in range(3)]
-                    new_pos = [pos[i] + extension[i] for i in range(3)]
-                    if Board.vector_in_bounds(new_pos):
 
-                        new_index = Board.vector_to_index(new_pos)
-                        new_piece = self.get_piece(new_index)
-                        new_side, new_rank, new_state = \
-                            Board.decode_piece(new_piece)
+    def generate_move_mask(self, index, test_piece = None):
 
-                        if new_piece != Piece.EMPTY.value and new_side != side:
-                            new_mask[new_index] = True
-                            break
-                        elif new_piece == Piece.EMPTY.value:
-                            new_mask[new_index] = True
-                        else:
-                            break
+        """ Generates a movement mask for a particular piece and returns it. """
 
-                    else:
-                        break
+        # A movement mask can be associated with any piece on the board and 
+        # indicates all of the possible legal moves that piece can make. 
+        # All movement masks are then stored in memory (in the board.masks 
+        # dictionary) while the player is deciding their move. All movement
+        # masks are cleared after each move. They are generated on an as-needed
+        # basis as the player moves the cursor over pieces without an 
+        # associated movement mask.
+
+        # Generate a new blank mask for this piece.
+        new_mask = 192 * bitarray([False])
 
-        # Iterates through all mask bits in the newly generated mask and 
-        # removes all locations that would result in check for this player.
+        # Get information from the board about the current piece.
+        piece = self.get_piece(index) if test_piece == None else test_piece
+
+        # Marks every target in the mask, leaving out the ones that would
+        # result in check for this player.
         if not test_piece:
-            for i in range(192):
-                if new_mask[i]:
-                    check = self.move_results_in_check(side,index,i)
-                    new_mask[i] = not check
+            targets = self.legal_targets(index, piece)
+        else:
+            targets = self.move_targets(index, piece)
+
+        for i in targets:
+            new_mask[i] = True
 
         return new_mask
 
@@ -384,7 +473,7 @@ class Board:
         # a new mask using gen_move_mask and add it to the masks dictionary. 
         # The mask dictionary should be cleared after each turn as it will need 
         # to be updated.
-        if self.get_piece(index) != Piece.EMPTY.value:
+        if self.get_piece(index) != mlpiece.EMPTY:
             if index not in self.masks:
                 self.masks[index] = self.generate_move_mask(index)
             self.current_mask = index
@@ -392,12 +481,43 @@ class Board:
             self.current_mask = -1
 
 
+    def precompute_masks(self, count = 1):
+
+        """ Generates the movement masks of up to count pieces that do not
+        have one yet. Returns true if there are pieces left without a mask. """
+
+        # Masks are generated a few at a time so this can be called whenever
+        # the client has nothing else to do, e.g. between keyboard polls, and
+        # never blocks it for longer than a few masks take. The pieces of the
+        # side to move come first, then the opponent's. Making a move clears
+        # the queue along with the masks, so work for an old position is
+        # never finished or published.
+        if self.mask_queue is None:
+            if self.turn not in [Piece.WHITE, Piece.BLACK]:
+                self.mask_queue = []
+            else:
+                side = mlpiece.SIDE_INDEX[self.turn.value]
+                self.mask_queue = sorted(self.pieces[1 - side], reverse=True) \
+                    + sorted(self.pieces[side], reverse=True)
+
+        while count > 0 and self.mask_queue:
+            index = self.mask_queue.pop()
+            if index not in self.masks:
+                # Masks are only ever added whole, so select_piece and
+                # move_piece see either no mask or a finished one.
+                self.masks[index] = self.generate_move_mask(index)
+                count -= 1
+
+        return bool(self.mask_queue)
+
+
     def move_piece(self, from_pos, to_pos,
         update_turn = True, castle_move = False):
 
         """ Moves the current piece in 'from_pos' to 'to_pos'. Does not check
         for legality but assumes move is based on legal movement masks already
-        generated. """
+        generated. update_turn = False, which keeps the side to move, is
+        deprecated. """
 
         # Gets the index values for the from and to positions.
         from_index = Board.vector_to_index(from_pos)
@@ -405,137 +525,513 @@ class Board:
 
         # Proceeds with movement if from_index has a movement mask and the 
         # to_index is listed as a legal move in the from_index movement mask.
+        # castle_move skips this test.
         if not castle_move and from_index not in self.masks:
             self.masks[from_index] = self.generate_move_mask(from_index)
 
         if castle_move or self.masks[from_index][to_index] == True:
 
-            # Gets piece information.
-            piece = self.get_piece(from_index)
-            side, rank, state = Board.decode_piece(piece)
+            # Performs the move itself, including moving the rook when
+            # castling and updating the check state of both kings.
+            turn = self.turn
+            self.make_move(Board.pack_move(from_index, to_index))
+            if not update_turn:
+                warnings.warn(
+                    "move_piece(update_turn=False) is deprecated; use "
+                    "make_move and set_turn instead",
+                    DeprecationWarning, stacklevel=2)
+                self.keep_turn(turn)
+
+            # Clear and reset movement masks for next turn.
+            self.masks.clear()
+            self.current_mask = -1
+            self.mask_queue = None
+
+            self.update_checkmate()
+            if update_turn:
+                self.update_draw()
+
+                # Kept for every move, including the one that ends the game,
+                # as it is what gets sent to a network opponent.
+                self.last_move_from = from_index
+                self.last_move_to = to_index
+                self.last_move_piece = Board.moved_piece(self.undo[-1][1])
 
-            # Update piece state to normal if previously unmoved or in check.
-            if state in \
-                    [Piece.UNMOVED, Piece.CHECK_UNMOVED, Piece.CHECK_NORMAL]:
-                state = Piece.NORMAL
 
-            # Update local king index variable.
-            if rank == Piece.KING:
-                self.king[side] = to_index
-                # Check if move is a castle move and move rook accordingly.
+    def keep_turn(self, turn):
 
-                # Check king side castling.
-                if to_pos[0] == from_pos[0] - 2:
-                    rook_from = [from_pos[0] - 3, from_pos[1], from_pos[2]]
-                    rook_to = [from_pos[0] - 1, from_pos[1], from_pos[2]]
-                    self.move_piece(rook_from, rook_to, False, True)
+        """ Gives the turn back to the side that just moved, keeping the
+        position history in step with the hash """
 
-                # Check queen side castling.
-                elif to_pos[0] == from_pos[0] + 2:
-                    rook_from = [from_pos[0] + 4, from_pos[1], from_pos[2]]
-                    rook_to = [from_pos[0] + 1, from_pos[1], from_pos[2]]
-                    self.move_piece(rook_from, rook_to, False, True)
+        # make_move counted the position under the other side's turn. That
+        # entry is replaced by the position as it now stands, so
+        # is_repetition and unmake_move still see the current hash.
+        key = self.history.pop()
+        count = self.seen[key]
+        if count > 1:
+            self.seen[key] = count - 1
+        else:
+            del self.seen[key]
+        self.set_turn(turn)
+        self.history.append(self.hash)
+        self.seen[self.hash] = self.seen.get(self.hash, 0) + 1
 
 
-            # Encode the piece information.
-            updated_piece = Board.encode_piece(rank, side, state)
+    def update_checkmate(self):
 
-            # Update board data.
-            self.set_piece(from_index, Piece.EMPTY.value)
-            self.set_piece(to_index, updated_piece)
+        """ Ends the game if a king is checkmated """
 
-            # Clear and reset movement masks for next turn.
-            self.masks.clear()
-            self.current_mask = -1
+        # A king left in check is checkmate if its side has no legal moves
+        # left.
+        for check_side in [Piece.WHITE, Piece.BLACK]:
+            king_index = self.king[check_side]
+            if (mlpiece.STATE[self.data[king_index]] in
+                    [mlpiece.CHECK_UNMOVED, mlpiece.CHECK_NORMAL] and
+                    not self.has_legal_move(check_side)):
 
-            # Update the check/checkmate state of both kings after each move.
-            for check_side in [Piece.WHITE, Piece.BLACK]:
-                king_index = self.king[check_side]
-                king_state = self.get_info(king_index)["state"]
-                if self.move_results_in_check(
-                    check_side, king_index, king_index):
-
-                    # Check_side's king is in check, now test if it is checkmate
-                    # by testing if any pieces have legal
-                    # moves left.
-                    checkmate = True
-                    for i in range(192):
-                        if (not self.is_empty(i) and
-                            self.get_info(i)["side"] == check_side):
-                            if self.generate_move_mask(i).count() > 0:
-                                checkmate = False
-                                break
-
-                    if checkmate:
-                        # Set the king's state to checkmate and end the game by
-                        # setting the turn variable to neither player.
-                        new_check_state = Piece.CHECKMATE
-                        self.turn = Piece.CHECKMATE
-                    else:
-                        # Set the king's state to check, whether or not it has 
-                        # moved yet.
-                        new_check_state = Piece.CHECK_NORMAL if king_state in \
-                            [Piece.NORMAL, Piece.CHECK_NORMAL] else \
-                            Piece.CHECK_UNMOVED
-                else:
-                    # Reset the king's state if not in check anymore.
-                    new_check_state = Piece.NORMAL if king_state in \
-                        [Piece.NORMAL, Piece.CHECK_NORMAL] else Piece.UNMOVED
-
-                # Finally, update king's state.
+                # Set the king's state to checkmate and end the game by
+                # setting the turn variable to neither player.
                 self.set_piece(
                     king_index,
-                    Board.encode_piece(check_side, Piece.KING, new_check_state))
+                    mlpiece.encode(
+                        check_side.value, mlpiece.KING, mlpiece.CHECKMATE))
+                self.set_turn(Piece.CHECKMATE)
 
-            # Change turn.
-            if update_turn and not self.turn == Piece.CHECKMATE:
-                self.turn = Piece.BLACK if self.turn == Piece.WHITE else \
-                    Piece.WHITE
 
-                self.last_move_from = from_index
-                self.last_move_to = to_index
-                self.last_move_piece = updated_piece
+    def update_draw(self):
 
-    def move_results_in_check(self, king_side, from_index, to_index):
+        """ Ends the game in a draw on stalemate, on the third repetition of
+        a position or after DRAW_PLIES plies without a capture or pawn move """
 
-        """ Performs a temporary move to determine if that move would result in
-        check """
+        if self.turn not in SIDES:
+            return
+        if self.is_repetition(REPETITIONS) or self.quiet_plies >= DRAW_PLIES:
+            self.set_turn(Piece.DRAW)
+        elif self.is_stalemate():
+            self.set_turn(Piece.STALEMATE)
 
-        from_piece = self.get_piece(from_index)
-        to_piece = self.get_piece(to_index)
 
-        self.set_piece(from_index, Piece.EMPTY.value)
-        self.set_piece(to_index, from_piece)
+    def set_history(self, history):
 
-        result = False
+        """ Continues the position history of a game, given as the hashes of
+        its positions since the last capture or pawn move ending with the
+        current one, so repetitions and quiet plies count from there """
 
-        king_index = self.king[king_side]
-        opponent_side = Piece.WHITE if king_side == Piece.BLACK else Piece.BLACK
-        if king_index == from_index: king_index = to_index
+        self.history = list(history)
+        self.seen = {}
+        for key in self.history:
+            self.seen[key] = self.seen.get(key, 0) + 1
+        self.quiet_plies = len(self.history) - 1
 
-        for test_rank in [
-                Piece.PAWN,
-                Piece.BISHOP,
-                Piece.KNIGHT,
-                Piece.ROOK,
-                Piece.QUEEN,
-                Piece.KING]:
-            test_mask = self.generate_move_mask(
-                king_index,
-                Board.encode_piece(king_side, test_rank, Piece.NORMAL)
-            )
-            for index in range(192):
-                if test_mask[index] and not self.is_empty(index):
-                    if Board.decode_piece(self.get_piece(index))[:2] == \
-                            [opponent_side, test_rank]:
-                        result = True
+
+    def is_repetition(self, count = 2):
+
+        """ Returns true if the current position has been reached at least
+        count times since the last capture or pawn move """
+
+        return self.seen.get(self.hash, 0) >= count
+
+
+    def is_stalemate(self):
+
+        """ Returns true if the side to move is not in check and has no
+        legal move """
+
+        # make_move keeps the check state of both kings up to date, so only
+        # a side that is not in check needs its moves looked at, and the
+        # search for them stops at the first legal move.
+        if self.turn not in SIDES:
+            return False
+        if mlpiece.STATE[self.data[self.king[self.turn]]] in \
+                [mlpiece.CHECK_UNMOVED, mlpiece.CHECK_NORMAL]:
+            return False
+        return not self.has_legal_move(self.turn)
+
+
+    # Flags packed into a move above the from and to index positions.
+
+    MOVE_CAPTURE = 1
+    MOVE_CASTLE = 2
+    MOVE_DOUBLE = 4
+
+
+    @staticmethod
+    def pack_move(from_index, to_index, flags = 0):
+
+        """ Packs a move into a single int used by make_move """
+
+        return from_index | (to_index << 8) | (flags << 16)
+
+
+    @staticmethod
+    def unpack_move(move):
+
+        """ Converts a packed move to from index, to index and flags values """
+
+        return [move & 0xff, (move >> 8) & 0xff, move >> 16]
+
+
+    @staticmethod
+    def move_to_str(move):
+
+        """ Converts a packed move to a readable string of its from and to
+        [X,Y,Z] values, e.g. 312-332 """
+
+        from_index, to_index = Board.unpack_move(move)[:2]
+        return "%s-%s" % (
+            "".join(str(i) for i in Board.index_to_vector(from_index)),
+            "".join(str(i) for i in Board.index_to_vector(to_index)))
+
+
+    @staticmethod
+    def castle_rook(from_index, to_index):
+
+        """ Returns the rook's from and to index positions if a king moving
+        from from_index to to_index is castling, otherwise None """
+
+        rook_king_side, king_side_1, king_side_2, queen_side_1, \
+            queen_side_2, queen_side_3, rook_queen_side = \
+            mlgeometry.CASTLE[from_index]
+
+        # Castling moves the king two squares along the X-axis.
+        if to_index == king_side_1 and from_index % 8 >= 2:
+            return [rook_king_side, king_side_2]
+        elif to_index == queen_side_2 and from_index % 8 < 6:
+            return [rook_queen_side, queen_side_1]
+        return None
+
+
+    @staticmethod
+    def moved_piece(piece):
+
+        """ Returns the encoded piece value a piece has after it has moved """
+
+        # Update piece state to normal if previously unmoved or in check.
+        return mlpiece.MOVED[piece]
+
+
+    def make_move(self, move):
+
+        """ Applies a packed move to the board without testing its legality or
+        regenerating any movement masks. The move can be taken back with
+        unmake_move. """
+
+        from_index = move & 0xff
+        to_index = (move >> 8) & 0xff
+
+        data = self.data
+        piece = data[from_index]
+        captured = data[to_index]
+        rank = mlpiece.RANK[piece]
+
+        # Everything needed to take the move back is kept in a single tuple on
+        # the undo stack: the move, the moved and captured pieces, the castling
+        # rook, both kings' positions and pieces, the turn, the hash, the quiet
+        # ply count and, for captures and pawn moves, the position history they
+        # replaced.
+        irreversible = captured != mlpiece.EMPTY or rank == mlpiece.PAWN
+        castle = None
+        if rank == mlpiece.KING:
+            # Check if move is a castle move and move rook accordingly.
+            rook = Board.castle_rook(from_index, to_index)
+            if rook:
+                castle = (rook[0], rook[1], data[rook[0]])
+
+        white_king = self.king[Piece.WHITE]
+        black_king = self.king[Piece.BLACK]
+        self.undo.append((
+            move, piece, captured, castle,
+            white_king, data[white_king],
+            black_king, data[black_king],
+            self.turn, self.hash,
+            self.quiet_plies,
+            (self.history, self.seen) if irreversible else None
+        ))
+
+        if castle:
+            rook_from, rook_to, rook = castle
+            self.set_piece(rook_from, mlpiece.EMPTY)
+            self.set_piece(rook_to, mlpiece.MOVED[rook])
+
+        self.set_piece(from_index, mlpiece.EMPTY)
+        self.set_piece(to_index, mlpiece.MOVED[piece])
+
+        # Update local king index variable.
+        if rank == mlpiece.KING:
+            self.king[SIDES[mlpiece.SIDE_INDEX[piece]]] = to_index
+
+        # Update the check state of both kings.
+        for check_side, opponent_side in [
+                (Piece.WHITE, Piece.BLACK),
+                (Piece.BLACK, Piece.WHITE)]:
+            king_index = self.king[check_side]
+            king_state = mlpiece.STATE[data[king_index]]
+            moved = king_state in [mlpiece.NORMAL, mlpiece.CHECK_NORMAL]
+            if self.is_attacked(king_index, opponent_side):
+                new_check_state = mlpiece.CHECK_NORMAL if moved else \
+                    mlpiece.CHECK_UNMOVED
+            else:
+                new_check_state = mlpiece.NORMAL if moved else mlpiece.UNMOVED
+            if new_check_state != king_state:
+                self.set_piece(king_index, mlpiece.encode(
+                    check_side.value, mlpiece.KING, new_check_state))
+
+        # Change turn.
+        self.set_turn(
+            Piece.BLACK if self.turn == Piece.WHITE else Piece.WHITE)
+
+        if irreversible:
+            self.history = [self.hash]
+            self.seen = {self.hash: 1}
+            self.quiet_plies = 0
+        else:
+            self.history.append(self.hash)
+            self.seen[self.hash] = self.seen.get(self.hash, 0) + 1
+            self.quiet_plies += 1
+
+
+    def unmake_move(self):
+
+        """ Takes back the last move applied with make_move """
+
+        move, piece, captured, castle, white_king, white_king_piece, \
+            black_king, black_king_piece, turn, position_hash, quiet_plies, \
+            history = self.undo.pop()
+
+        # The key is taken from the history rather than the hash, which no
+        # longer matches it once the game has ended after the move.
+        if history is None:
+            key = self.history.pop()
+            count = self.seen[key]
+            if count > 1:
+                self.seen[key] = count - 1
+            else:
+                del self.seen[key]
+        else:
+            self.history, self.seen = history
+        self.quiet_plies = quiet_plies
+
+        self.set_piece(move >> 8 & 0xff, captured)
+        self.set_piece(move & 0xff, piece)
+
+        if castle:
+            rook_from, rook_to, rook = castle
+            self.set_piece(rook_to, mlpiece.EMPTY)
+            self.set_piece(rook_from, rook)
+
+        self.set_piece(white_king, white_king_piece)
+        self.set_piece(black_king, black_king_piece)
+        self.king[Piece.WHITE] = white_king
+        self.king[Piece.BLACK] = black_king
+        self.turn = turn
+        self.hash = position_hash
+
+
+    def legal_targets(self, index, piece = None):
+
+        """ Returns a list of the index positions the piece at the index
+        position can legally move to """
+
+        piece = self.get_piece(index) if piece == None else piece
+        return self.filter_targets(index, piece,
+                                   self.move_targets(index, piece))
+
+
+    def filter_targets(self, index, piece, targets):
+
+        """ Returns the targets the piece at the index position can move to
+        without leaving its own king in check """
+
+        side = SIDES[mlpiece.SIDE_INDEX[piece]]
+        opponent_side = Piece.WHITE if side == Piece.BLACK else Piece.BLACK
+        king_index = self.king[side]
+
+        # Moving a piece can only expose its own king if the king is already
+        # in check, if the king itself moves, or if the piece stands on one of
+        # the lines running out from the king. Every other move is legal
+        # without testing it.
+        if targets and (index == king_index or
+                index in mlgeometry.QUEEN_LINES[king_index] or
+                self.is_attacked(king_index, opponent_side)):
+            targets = [
+                i for i in targets
+                if not self.move_results_in_check(side, index, i)
+            ]
+
+        return targets
+
+
+    def generate_legal_moves(self, side, captures_only = False):
+
+        """ Generates the packed legal moves of every piece of the given side
+        one at a time, or only its captures if captures_only is set """
+
+        # Pseudo-legal moves are generated for all of the side's pieces in a
+        # single pass and filtered for king safety. Testing whether the king
+        # is in check, and which pieces are lined up with it, is done once for
+        # the whole side.
+        data = self.data
+        opponent_side = Piece.WHITE if side == Piece.BLACK else Piece.BLACK
+        king_index = self.king[side]
+        in_check = self.is_attacked(king_index, opponent_side)
+        king_lines = mlgeometry.QUEEN_LINES[king_index]
+        pawn_side = mlgeometry.WHITE if side == Piece.WHITE else \
+            mlgeometry.BLACK
+
+        # The piece list is walked in index order so the moves come out in
+        # the same order as a scan of the whole board would give them.
+        for index in sorted(self.pieces[side.value // 127]):
+
+            piece = data[index]
+            rank = mlpiece.RANK[piece]
+
+            test = in_check or index == king_index or index in king_lines
+
+            for to_index in self.move_targets(index, piece):
+
+                if captures_only and data[to_index] == mlpiece.EMPTY:
+                    continue
+                if test and self.move_results_in_check(side, index, to_index):
+                    continue
+
+                flags = 0
+                if data[to_index] != mlpiece.EMPTY:
+                    flags |= Board.MOVE_CAPTURE
+                if rank == mlpiece.KING:
+                    if Board.castle_rook(index, to_index):
+                        flags |= Board.MOVE_CASTLE
+                elif rank == mlpiece.PAWN:
+                    if to_index in mlgeometry.PAWN_DOUBLE[pawn_side][index]:
+                        flags |= Board.MOVE_DOUBLE
+
+                yield index | (to_index << 8) | (flags << 16)
+
+
+    def legal_moves(self, side, captures_only = False):
+
+        """ Returns a list of the packed legal moves of the given side, or only
+        its captures if captures_only is set """
+
+        return list(self.generate_legal_moves(side, captures_only))
+
+
+    def has_legal_move(self, side):
+
+        """ Returns true if any piece of the given side has a legal move """
+
+        # Generation stops at the first legal move found.
+        for move in self.generate_legal_moves(side):
+            return True
+        return False
+
+
+    def perft(self, depth):
+
+        """ Counts the leaf positions reached by playing every legal move
+        sequence of the given depth from the current position """
+
+        if depth < 1:
+            return 1
+        if self.turn not in [Piece.WHITE, Piece.BLACK]:
+            return 0
+
+        moves = self.legal_moves(self.turn)
+        if depth == 1:
+            return len(moves)
+
+        nodes = 0
+        for move in moves:
+            self.make_move(move)
+            nodes += self.perft(depth - 1)
+            self.unmake_move()
+        return nodes
+
+
+    def divide(self, depth):
+
+        """ Returns a dictionary of the perft leaf count below each legal move
+        from the current position """
+
+        counts = {}
+        if self.turn not in [Piece.WHITE, Piece.BLACK] or depth < 1:
+            return counts
+
+        for move in self.legal_moves(self.turn):
+            self.make_move(move)
+            counts[move] = self.perft(depth - 1)
+            self.unmake_move()
+        return counts
+
+
+    def is_attacked(self, square, by_side, from_index = None, to_index = None):
+
+        """ Returns true if any piece of by_side attacks the square. If
+        from_index and to_index are given, the board is tested as if the piece
+        at from_index had been moved to to_index. """
+
+        # Instead of generating the movement of every opponent piece, this
+        # walks outwards from the square itself. A piece attacks the square if
+        # it stands on a square the same rank of piece could reach from the
+        # square being tested, so the first matching piece ends the search.
+
+        data = self.data
+        if from_index is not None and from_index != to_index:
+            # The hypothetical move is made on a copy, the board itself is
+            # never changed.
+            data = bytearray(data)
+            data[to_index] = data[from_index]
+            data[from_index] = mlpiece.EMPTY
+
+        side_value = by_side.value
+        defender = mlgeometry.BLACK if by_side == Piece.WHITE else \
+            mlgeometry.WHITE
+
+        # An attacker is a piece of by_side with the right rank.
+        attacker = mlpiece.FRIEND[side_value]
+        rank_of = mlpiece.RANK
+
+        for index in mlgeometry.PAWN_TAKE[defender][square]:
+            piece = data[index]
+            if attacker[piece] and rank_of[piece] == mlpiece.PAWN:
+                return True
+
+        for index in mlgeometry.KNIGHT[square]:
+            piece = data[index]
+            if attacker[piece] and rank_of[piece] == mlpiece.KNIGHT:
+                return True
+
+        for index in mlgeometry.KING[square]:
+            piece = data[index]
+            if attacker[piece] and rank_of[piece] == mlpiece.KING:
+                return True
+
+        # Rook and bishop directions together make up the queen directions, so
+        # queens are looked for along both.
+        for rays, slider in [
+                (mlgeometry.ROOK_RAYS, mlpiece.ROOK),
+                (mlgeometry.BISHOP_RAYS, mlpiece.BISHOP)]:
+            for ray in rays[square]:
+                for index in ray:
+                    piece = data[index]
+                    if piece != mlpiece.EMPTY:
+                        if attacker[piece] and \
+                                rank_of[piece] in [slider, mlpiece.QUEEN]:
+                            return True
                         break
-            if result: break
 
-        self.set_piece(from_index, from_piece)
-        self.set_piece(to_index, to_piece)
+        return False
+
+
+    def move_results_in_check(self, king_side, from_index, to_index):
+
+        """ Determines if moving the piece at from_index to to_index would
+        leave the king of king_side in check """
 
-        return result
+        king_index = self.king[king_side]
+        opponent_side = Piece.WHITE if king_side == Piece.BLACK else Piece.BLACK
+        if king_index == from_index: king_index = to_index
+
+        return self.is_attacked(king_index, opponent_side, from_index, to_index)
 
 
 class MultilevelChess:
@@ -543,9 +1039,13 @@ class MultilevelChess:
     """ Class used for abstracting some of the game logic and interfacing with
     tmlchess.py. """
 
-    def __init__(self, player_sides, board_hex_data):
+    def __init__(self, player_sides, board_hex_data, board_class = Board):
 
-        self.board = Board(bytearray.fromhex(board_hex_data))
+        # board_class can be any Board subclass, such as mlbitboard.BitBoard.
+        self.board = board_class(bytearray.fromhex(board_hex_data))
+        # The position the game started from, which together with the moves
+        # on the board's undo stack makes up the record of the game.
+        self.start_data = bytes.fromhex(board_hex_data)
         self.old_select_pos =   [ 0, 0, 0]
         self.select_pos =       [ 0, 0, 0]
         self.selected = False
@@ -554,20 +1054,29 @@ class MultilevelChess:
 
     def save_current_game(self, name):
         with open("saves/" + name + ".txt", "w") as file:
-            file.write(hex(self.board.turn.value)[2:] + self.board.data.hex())
+            file.write("%02x" % self.board.turn.value + self.board.data.hex())
 
     def is_my_turn(self):
         return self.board.turn in self.sides
 
+    def precompute_masks(self, count = 1):
+        # Generates a few movement masks ahead of time, see
+        # Board.precompute_masks.
+        return self.board.precompute_masks(count)
+
     def turn_str(self):
+        # Games that ended in a draw show how instead of a side.
+        if self.board.turn == Piece.STALEMATE:
+            return "stalemate"
+        if self.board.turn == Piece.DRAW:
+            return "draw"
         return "white" if self.board.turn == Piece.WHITE else "black"
 
     def get_board_at(self, x, y, z):
         index = Board.vector_to_index([x,y,z])
         mask = self.board.get_mask(index)
         raw = self.board.get_piece(index)
-        value = Board.decode_piece(raw)
-        return [value[0].value // 127, (value[1].value // 12) - 1, mask]
+        return [mlpiece.SIDE_INDEX[raw], mlpiece.RANK[raw] // 12 - 1, mask]
 
     def get_select_pos(self):
         return self.select_pos
@@ -592,7 +1101,7 @@ class MultilevelChess:
             self.old_select_pos = self.select_pos
             self.selected = True
         elif self.board.turn in self.sides:
-            self.board.move_piece(self.old_select_pos, self.select_pos, True)
+            self.board.move_piece(self.old_select_pos, self.select_pos)
             self.turn_done = True
             self.selected = False
         else:
@@ -606,10 +1115,19 @@ class MultilevelChess:
                    hex(lmt)[2:4].zfill(2) +
                    hex(lmp)[2:4].zfill(2))
 
+    def last_move(self):
+        # The from index, to index and moved piece of the last local move.
+        return [self.board.last_move_from, self.board.last_move_to,
+                self.board.last_move_piece]
+
     def opponent_move(self, value):
-        move_from = int("0x"+value[0:2],0)
-        move_to = int("0x"+value[2:4],0)
-        move_piece = int("0x"+value[4:6],0)
+        # value is either the 6 hex characters of my_move or the 3 bytes of a
+        # binary protocol move.
+        if isinstance(value, str):
+            value = bytes.fromhex(value[0:6])
+        move_from = value[0]
+        move_to = value[1]
+        move_piece = value[2]
         self.board.move_piece(Board.index_to_vector(move_from),
-                              Board.index_to_vector(move_to), True)
+                              Board.index_to_vector(move_to))
 
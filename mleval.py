@@ -0,0 +1,146 @@
+"""
+
+mleval.py
+Static evaluation of multi-level chess positions
+Samuel Bauman 2020
+
+"""
+
+import mlgeometry
+import mlpiece
+
+# A position is scored in centipawns, positive when it is good for white. Most
+# of the score is a sum over the pieces on the board: the material value of
+# the piece plus a bonus or penalty for the square it stands on, looked up in
+# a single table indexed by square and piece byte. Because the score is a sum
+# of one value per square, Board.set_piece keeps it up to date by subtracting
+# the value of the old byte and adding the value of the new one, the same way
+# it keeps the Zobrist hash. Every way a piece moves, is captured, castles or
+# changes its check state goes through set_piece, so board.score always holds
+# the score of the current position and evaluating a search node is a single
+# attribute read instead of a sweep over all 192 squares.
+#
+# The square values cover:
+#   centrality  knights, bishops and queens are worth more near the middle of
+#               a level and on the middle level, which touches both others
+#   pawns       a pawn is worth more the further it has advanced, both along
+#               its ranks and across the levels towards the other side
+#   king safety the king is worth the most on its own back rank and level
+#
+# Black's tables are white's seen from the other side of the board: the
+# square (x, y, z) of a black piece scores as (x, 7 - y, 2 - z) does for
+# white, with the sign flipped.
+#
+# Mobility, the number of squares each piece can move to, depends on every
+# other piece on the board and can not be kept up to date that cheaply. It is
+# counted from the move generator when asked for (see mobility).
+#
+# Usage: board.score, or evaluate(board) for the side to move;
+# python3 mlperft.py [game file] --eval benchmarks both ways of scoring.
+
+# The material value of each rank by rank // 12: none, king, queen, rook,
+# knight, bishop, pawn.
+RANK_VALUES = [0, 0, 900, 500, 320, 330, 100]
+
+# The value of each square a pawn can move to along its ranks, by y from
+# white's side.
+PAWN_ADVANCE = [0, 0, 5, 10, 20, 35, 60, 90]
+# The value of each level a pawn has crossed towards the other side.
+PAWN_LEVEL = 10
+
+# Centipawns per square a piece can move to, by rank // 12.
+MOBILITY_WEIGHTS = [0, 0, 1, 2, 4, 3, 0]
+
+
+def centre(coordinate):
+
+    """ Returns how far an x or y coordinate is from the edge, 0 to 3 """
+
+    return min(coordinate, 7 - coordinate)
+
+
+def square_value(rank, x, y, z):
+
+    """ Returns the bonus of a white piece of the given rank on a square """
+
+    middle = centre(x) + centre(y)
+    level = 1 if z == 1 else 0
+
+    if rank == mlpiece.KNIGHT:
+        return 5 * middle - 15 + 10 * level
+    if rank == mlpiece.BISHOP:
+        return 3 * middle - 9 + 10 * level
+    if rank == mlpiece.QUEEN:
+        return 2 * middle - 6 + 5 * level
+    if rank == mlpiece.ROOK:
+        return 2 * centre(x) - 3 + (15 if y == 6 else 0) + 5 * level
+    if rank == mlpiece.PAWN:
+        return PAWN_ADVANCE[y] + PAWN_LEVEL * z + \
+            (2 * centre(x) if y >= 2 else 0)
+    if rank == mlpiece.KING:
+        # Every step away from the back rank or the home level, and towards
+        # the middle files, leaves the king more open to attack.
+        return -15 * y - 25 * z - 5 * centre(x)
+    return 0
+
+
+def square_values():
+
+    """ Returns the [square][piece byte] table of material plus square value,
+    positive for white and negative for black """
+
+    table = [[0] * 256 for index in range(mlgeometry.SQUARES)]
+    for index in range(mlgeometry.SQUARES):
+        x, y, z = index % 8, index // 8 % 8, index // 64
+        for byte in range(1, 256):
+            if not mlpiece.VALID[byte]:
+                continue
+            rank = mlpiece.RANK[byte]
+            material = RANK_VALUES[rank // 12]
+            if mlpiece.SIDE[byte] == mlpiece.WHITE:
+                table[index][byte] = material + square_value(rank, x, y, z)
+            else:
+                table[index][byte] = -material - \
+                    square_value(rank, x, 7 - y, 2 - z)
+    return table
+
+
+SQUARE_VALUES = square_values()
+
+
+def score_data(data):
+
+    """ Returns the material and square score of 192 bytes of board data by
+    summing every square, as Board.set_piece would have added it up """
+
+    score = 0
+    for index in range(mlgeometry.SQUARES):
+        score += SQUARE_VALUES[index][data[index]]
+    return score
+
+
+def mobility(board):
+
+    """ Returns the weighted difference between the number of squares white's
+    and black's pieces can move to, without testing for check """
+
+    data = board.data
+    score = 0
+    for side, sign in [(0, 1), (1, -1)]:
+        for index in board.pieces[side]:
+            piece = data[index]
+            weight = MOBILITY_WEIGHTS[mlpiece.RANK[piece] // 12]
+            if weight:
+                score += sign * weight * len(board.move_targets(index, piece))
+    return score
+
+
+def evaluate(board, with_mobility = False):
+
+    """ Returns the score of the position for the side to move, from the
+    incrementally kept board.score and the mobility term if asked for """
+
+    score = board.score
+    if with_mobility:
+        score += mobility(board)
+    return score if board.turn.value == mlpiece.WHITE else -score
@@ -0,0 +1,198 @@
+"""
+
+mlgeometry.py
+Precomputed board geometry for multi-level chess
+Samuel Bauman 2020
+
+"""
+
+# Everything a piece can reach from a square, ignoring the other pieces on the
+# board, only depends on the square itself. All of it is worked out once here
+# when the module is imported so that move generation only has to walk lists
+# of index positions instead of doing vector arithmetic and bounds checks.
+
+WIDTH = 8
+DEPTH = 8
+LEVELS = 3
+SQUARES = WIDTH * DEPTH * LEVELS
+
+# Side indexes used by the per-side pawn tables.
+WHITE = 0
+BLACK = 1
+
+
+# The direction vectors used by queen, bishop, and rook movement.
+
+QUEEN_DIRECTIONS = [
+    [-1, 0, 0], [ 1, 0, 0], [ 0, 0,-1], [ 0, 0, 1], [-1, 0,-1],
+    [-1, 0, 1], [ 1, 0,-1], [ 1, 0, 1], [-1,-1, 0], [ 1,-1, 0],
+    [ 0,-1,-1], [ 0,-1, 1], [-1,-1,-1], [-1,-1, 1], [ 1,-1,-1],
+    [ 1,-1, 1], [-1, 1, 0], [ 1, 1, 0], [ 0, 1,-1], [ 0, 1, 1],
+    [-1, 1,-1], [-1, 1, 1], [ 1, 1,-1], [ 1, 1, 1], [ 0, 1, 0],
+    [ 0,-1, 0]
+]
+
+BISHOP_DIRECTIONS = [
+    [-1,-1, 0], [-1, 1, 0], [ 1,-1, 0], [ 1, 1, 0], [-1,-1, 1],
+    [-1, 1, 1], [ 1,-1, 1], [ 1, 1, 1], [-1,-1,-1], [-1, 1,-1],
+    [ 1,-1,-1], [ 1, 1,-1]
+]
+
+ROOK_DIRECTIONS = [
+    [-1, 0, 0], [ 1, 0, 0], [ 0, 1, 0], [ 0,-1, 0], [ 0, 0,-1],
+    [ 0, 0, 1], [-1, 0,-1], [ 1, 0,-1], [ 0, 1,-1], [ 0,-1,-1],
+    [-1, 0, 1], [ 1, 0, 1], [ 0, 1, 1], [ 0,-1, 1]
+]
+
+
+# The offset positions used by knight and king movement.
+
+KNIGHT_OFFSETS = [
+    [ 1,-2, 0], [ 2,-1, 0], [ 2, 1, 0], [ 1, 2, 0], [-1, 2, 0],
+    [-2, 1, 0], [-2,-1, 0], [-1,-2, 0], [ 0,-2, 1], [ 2, 0, 1],
+    [ 0, 2, 1], [-2, 0, 1], [-1, 0, 2], [ 0,-1, 2], [ 1, 0, 2],
+    [ 0, 1, 2], [ 0,-2,-1], [ 2, 0,-1], [ 0, 2,-1], [-2, 0,-1],
+    [-1, 0,-2], [ 0,-1,-2], [ 1, 0,-2], [ 0, 1,-2]
+]
+
+KING_OFFSETS = [
+    [-1, 1, 1], [ 0, 1, 1], [ 1, 1, 1], [-1, 0, 1], [ 0, 0, 1],
+    [ 1, 0, 1], [-1,-1, 1], [ 0,-1, 1], [ 1,-1, 1], [-1, 1, 0],
+    [ 0, 1, 0], [ 1, 1, 0], [-1, 0, 0], [ 1, 0, 0], [-1,-1, 0],
+    [ 0,-1, 0], [ 1,-1, 0], [-1, 1,-1], [ 0, 1,-1], [ 1, 1,-1],
+    [-1, 0,-1], [ 0, 0,-1], [ 1, 0,-1], [-1,-1,-1], [ 0,-1,-1],
+    [ 1,-1,-1]
+]
+
+
+# The offset positions separated by side used by pawns. Pawns move to the
+# 'move' offsets, may also move to the 'double' offsets while unmoved and take
+# on the 'take' offsets.
+
+PAWN_MOVE_OFFSETS = [
+    [
+        [ 0, 1, 0], [ 0, 1, 1], [ 0, 1,-1], [ 0, 0, 1], [ 0, 0,-1]
+    ],
+    [
+        [ 0,-1, 0], [ 0,-1, 1], [ 0,-1,-1], [ 0, 0, 1], [ 0, 0,-1]
+    ]
+]
+
+PAWN_DOUBLE_OFFSETS = [
+    [
+        [ 0, 2, 0], [ 0, 2, 2], [ 0, 2,-2]
+    ],
+    [
+        [ 0,-2, 0], [ 0,-2, 2], [ 0,-2,-2]
+    ]
+]
+
+PAWN_TAKE_OFFSETS = [
+    [
+        [-1, 1,-1], [-1, 1, 0], [-1, 1, 1], [ 1, 1,-1], [ 1, 1, 0],
+        [ 1, 1, 1]
+    ],
+    [
+        [-1,-1,-1], [-1,-1, 0], [-1,-1, 1], [ 1,-1,-1], [ 1,-1, 0],
+        [ 1,-1, 1]
+    ]
+]
+
+
+def in_bounds(vector):
+
+    """ Returns true if the [X,Y,Z] values represents a valid position """
+
+    return (0 <= vector[0] < WIDTH and 0 <= vector[1] < DEPTH and
+            0 <= vector[2] < LEVELS)
+
+
+def to_vector(index):
+
+    """ Converts index position to [X,Y,Z] values """
+
+    return [ index % 8, index // 8 % 8, index // (8 * 8) ]
+
+
+def to_index(vector):
+
+    """ Converts [X,Y,Z] values to a index position value. Values wrap around
+    the same way as Board.vector_to_index. """
+
+    return vector[0] % 8 + ((vector[1] % 8) * 8) + ((vector[2] % 8) * 8 * 8)
+
+
+def offset_table(offsets):
+
+    """ Builds a tuple holding, for every square, the tuple of in-bounds index
+    positions reached by adding each offset to the square. """
+
+    table = []
+    for index in range(SQUARES):
+        pos = to_vector(index)
+        targets = []
+        for offset in offsets:
+            new_pos = [pos[i] + offset[i] for i in range(3)]
+            if in_bounds(new_pos):
+                targets.append(to_index(new_pos))
+        table.append(tuple(targets))
+    return tuple(table)
+
+
+def ray_table(directions):
+
+    """ Builds a tuple holding, for every square, a tuple of rays. Each ray is
+    the tuple of index positions along one direction, ordered outwards from the
+    square. Directions that leave the board straight away have no ray. """
+
+    table = []
+    for index in range(SQUARES):
+        pos = to_vector(index)
+        rays = []
+        for direction in directions:
+            ray = []
+            for distance in range(1, 8):
+                new_pos = [pos[i] + direction[i] * distance for i in range(3)]
+                if not in_bounds(new_pos):
+                    break
+                ray.append(to_index(new_pos))
+            if ray:
+                rays.append(tuple(ray))
+        table.append(tuple(rays))
+    return tuple(table)
+
+
+def castle_table():
+
+    """ Builds a tuple holding, for every square, the index positions involved
+    in castling for a king standing on it: the king-side rook, the two
+    king-side squares, the three queen-side squares and the queen-side rook.
+    """
+
+    table = []
+    for index in range(SQUARES):
+        x, y, z = to_vector(index)
+        table.append(tuple(
+            to_index([x + dx, y, z]) for dx in (-3, -2, -1, 1, 2, 3, 4)
+        ))
+    return tuple(table)
+
+
+KNIGHT = offset_table(KNIGHT_OFFSETS)
+KING = offset_table(KING_OFFSETS)
+
+PAWN_MOVE = tuple(offset_table(offsets) for offsets in PAWN_MOVE_OFFSETS)
+PAWN_DOUBLE = tuple(offset_table(offsets) for offsets in PAWN_DOUBLE_OFFSETS)
+PAWN_TAKE = tuple(offset_table(offsets) for offsets in PAWN_TAKE_OFFSETS)
+
+QUEEN_RAYS = ray_table(QUEEN_DIRECTIONS)
+ROOK_RAYS = ray_table(ROOK_DIRECTIONS)
+BISHOP_RAYS = ray_table(BISHOP_DIRECTIONS)
+
+CASTLE = castle_table()
+
+# Every square on any of the queen rays from a square, used to tell which
+# pieces are lined up with a king.
+QUEEN_LINES = tuple(
+    frozenset(index for ray in rays for index in ray) for rays in QUEEN_RAYS
+)
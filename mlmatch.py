@@ -0,0 +1,546 @@
+"""
+
+mlmatch.py
+Headless self-play and engine matches for multi-level chess
+Samuel Bauman 2020
+
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import mlbitboard
+import mlbook
+import mlposdb
+import mlrecord
+import mlsearch
+from mlchess import Piece, Board, DRAW_PLIES, REPETITIONS
+
+# Plays games between two move choosing policies without the curses client,
+# in a pool of worker processes, and reports the score, the Elo difference
+# between the policies and the games played per second. Every game is written
+# as one JSON line as soon as it is finished. Each opening position is played
+# twice, once with either policy as white, so neither gets the better side of
+# an opening more often than the other.
+#
+# Policies are given as a name and optional settings, e.g. "random",
+# "greedy", "search:nodes=2000", "search:depth=2,hash=4" or
+# "search:nodes=2000,positions=positions.mldb,book=book.mlbk".
+#
+# Usage: python3 mlmatch.py [policy] [policy] [-n games] [-w workers]
+
+# Plies after which a game is drawn.
+MAX_PLIES = 400
+
+# Games are also drawn after DRAW_PLIES plies without a capture or a pawn move
+# and on the REPETITIONS-th occurrence of a position, as in mlchess.py, unless
+# given otherwise.
+
+# The number of games sent to each worker in one go.
+CHUNK_GAMES = 4
+
+
+class RandomPolicy:
+
+    """ Plays a random legal move """
+
+    def __init__(self, rng):
+
+        self.rng = rng
+
+    def new_game(self):
+
+        pass
+
+    def choose(self, board, moves):
+
+        """ Returns the move to play out of the legal moves and the number of
+        nodes searched to find it """
+
+        return self.rng.choice(moves), 0
+
+
+class GreedyPolicy(RandomPolicy):
+
+    """ Plays the capture of the most valuable piece it can, or a random move
+    if it can not capture anything """
+
+    def choose(self, board, moves):
+
+        data = board.data
+        best = []
+        best_value = 0
+        for move in moves:
+            if not move >> 16 & Board.MOVE_CAPTURE:
+                continue
+            value = mlsearch.RANK_VALUES[
+                mlsearch.RANK_INDEX[data[move >> 8 & 0xff]]]
+            if value > best_value:
+                best = [move]
+                best_value = value
+            elif value == best_value:
+                best.append(move)
+        return self.rng.choice(best or moves), 0
+
+
+class SearchPolicy:
+
+    """ Plays the best move found by the alpha-beta engine """
+
+    def __init__(self, time_limit = None, node_limit = None, max_depth = None,
+                 tt_megabytes = 4, positions = None, book = None):
+
+        # positions is the path of a position database (see mlposdb.py) of
+        # earlier search results and book that of an opening book (see
+        # mlbook.py) to play from while it has moves. Every worker maps the
+        # same files.
+        self.book = mlbook.Book(book) if book else None
+        self.time_limit = time_limit
+        self.node_limit = node_limit
+        self.max_depth = max_depth
+        self.engine = mlsearch.Engine(
+            tt_megabytes, positions=mlposdb.PositionDB(positions)
+            if positions else None)
+
+    def new_game(self):
+
+        # Every game starts from an empty table, so a game plays the same
+        # way no matter which games the worker played before it.
+        self.engine.tt.clear()
+        self.engine.history = {}
+
+    def choose(self, board, moves):
+
+        if self.book:
+            move = self.book.choose(board)
+            if move is not None:
+                return move, 0
+        result = self.engine.search(
+            board, self.time_limit, self.node_limit, self.max_depth)
+        return result.best_move, result.nodes
+
+
+def parse_policy(spec):
+
+    """ Splits a policy string into its name and a dictionary of settings """
+
+    name, _, settings = spec.partition(":")
+    options = {}
+    for setting in settings.split(","):
+        if setting:
+            key, _, value = setting.partition("=")
+            options[key] = value
+    if name not in ["random", "greedy", "search"]:
+        raise ValueError("unknown policy %s" % name)
+    for key in options:
+        if name != "search" or key not in ["time", "nodes", "depth", "hash",
+                                           "positions", "book"]:
+            raise ValueError("unknown setting %s of policy %s" % (key, name))
+    return name, options
+
+
+def make_policy(spec, seed):
+
+    """ Returns a policy object for a policy string """
+
+    name, options = parse_policy(spec)
+    if name == "random":
+        return RandomPolicy(random.Random(seed))
+    if name == "greedy":
+        return GreedyPolicy(random.Random(seed))
+
+    time_limit = float(options["time"]) if "time" in options else None
+    node_limit = int(options["nodes"]) if "nodes" in options else None
+    max_depth = int(options["depth"]) if "depth" in options else None
+    # Without any limit the engine searches a fixed number of nodes, so
+    # games can be reproduced.
+    if time_limit is None and node_limit is None and max_depth is None:
+        node_limit = 1000
+    return SearchPolicy(time_limit, node_limit, max_depth,
+                        int(options.get("hash", 4)), options.get("positions"),
+                        options.get("book"))
+
+
+def encode_position(board):
+
+    """ Returns the 193 byte turn + board data encoding of a board """
+
+    return bytes([board.turn.value]) + bytes(board.data)
+
+
+def random_openings(game_hex_data, count, plies, seed):
+
+    """ Returns count positions reached by playing the given number of random
+    legal moves from the game data """
+
+    rng = random.Random(seed)
+    openings = []
+    while len(openings) < count:
+        board = mlbitboard.BitBoard(bytearray.fromhex(game_hex_data))
+        for ply in range(plies):
+            moves = board.legal_moves(board.turn)
+            if not moves:
+                break
+            board.make_move(rng.choice(moves))
+        # Openings that already end the game are of no use.
+        if board.has_legal_move(board.turn):
+            openings.append(encode_position(board).hex())
+    return openings
+
+
+def read_openings(path):
+
+    """ Reads a file with the hex game data of one position per line """
+
+    with open(path, "r") as file:
+        return [line.strip() for line in file
+                if line.strip() and not line.startswith("#")]
+
+
+# Every worker process keeps its policies from one game to the next, so a
+# search policy keeps its engine and transposition table memory.
+worker_policies = {}
+
+
+def worker_policy(spec, seed):
+
+    if spec not in worker_policies:
+        worker_policies[spec] = make_policy(spec, seed)
+    policy = worker_policies[spec]
+    if isinstance(policy, RandomPolicy):
+        policy.rng.seed(seed)
+    policy.new_game()
+    return policy
+
+
+def play_game(game):
+
+    """ Plays one game, given as a dictionary with the game number, opening
+    position, white and black policy strings, seed and draw rules, and
+    returns its record """
+
+    start = time.perf_counter()
+    board = mlbitboard.BitBoard(bytearray.fromhex(game["opening"]))
+    white = worker_policy(game["white"], game["seed"])
+    black = worker_policy(game["black"], game["seed"] + 1) \
+        if game["black"] != game["white"] else white
+    policies = {Piece.WHITE: white, Piece.BLACK: black}
+    side_names = {Piece.WHITE: "white", Piece.BLACK: "black"}
+
+    seconds = {"white": 0.0, "black": 0.0}
+    nodes = {"white": 0, "black": 0}
+    moves_made = {"white": 0, "black": 0}
+    result = None
+    reason = None
+
+    while result is None:
+        side = board.turn
+        opponent = Piece.BLACK if side == Piece.WHITE else Piece.WHITE
+        moves = board.legal_moves(side)
+        if not moves:
+            if board.is_attacked(board.king[side], opponent):
+                result = "0-1" if side == Piece.WHITE else "1-0"
+                reason = "checkmate"
+            else:
+                result = "1/2-1/2"
+                reason = "stalemate"
+            break
+        if len(board.undo) >= game["max_plies"]:
+            result, reason = "1/2-1/2", "move limit"
+            break
+
+        name = side_names[side]
+        move_start = time.perf_counter()
+        move, move_nodes = policies[side].choose(board, moves)
+        seconds[name] += time.perf_counter() - move_start
+        nodes[name] += move_nodes
+        moves_made[name] += 1
+        board.make_move(move)
+
+        # The board counts positions and quiet plies as the moves are made.
+        if board.is_repetition(game["repetitions"]):
+            result, reason = "1/2-1/2", "repetition"
+        elif board.quiet_plies >= game["draw_plies"]:
+            result, reason = "1/2-1/2", "fifty moves"
+
+    record = {
+        "game": game["game"],
+        "opening": game["opening_number"],
+        "white": game["white"],
+        "black": game["black"],
+        "first": game["first"],
+        "result": result,
+        "reason": reason,
+        "plies": len(board.undo),
+        "ms_per_move": {
+            name: round(seconds[name] * 1000 / moves_made[name], 3)
+                if moves_made[name] else 0.0
+            for name in seconds
+        },
+        "nodes": nodes,
+        "seconds": round(time.perf_counter() - start, 6)
+    }
+    if game["record"]:
+        # The moves, for writing the game to a record file (see
+        # mlrecord.py).
+        record["moves"] = [entry[0] for entry in board.undo]
+    return record
+
+
+def play_games(games):
+
+    """ Plays a list of games in a worker and returns their records """
+
+    return [play_game(game) for game in games]
+
+
+def score(record):
+
+    """ Returns the score of the first policy in a game record: 1 for a win,
+    0.5 for a draw and 0 for a loss """
+
+    if record["result"] == "1/2-1/2":
+        return 0.5
+    winner = "white" if record["result"] == "1-0" else "black"
+    return 1.0 if winner == record["first"] else 0.0
+
+
+def elo_difference(fraction):
+
+    """ Returns the Elo difference that gives the expected score fraction """
+
+    fraction = min(max(fraction, 1e-6), 1 - 1e-6)
+    return -400 * math.log10(1 / fraction - 1)
+
+
+class Tally:
+
+    """ Adds up the results of games from the point of view of the first
+    policy """
+
+    def __init__(self):
+
+        self.wins = 0
+        self.draws = 0
+        self.losses = 0
+        self.reasons = {}
+
+    def add(self, record):
+
+        points = score(record)
+        if points == 1.0:
+            self.wins += 1
+        elif points == 0.5:
+            self.draws += 1
+        else:
+            self.losses += 1
+        self.reasons[record["reason"]] = \
+            self.reasons.get(record["reason"], 0) + 1
+
+    def games(self):
+
+        return self.wins + self.draws + self.losses
+
+    def summary(self):
+
+        """ Returns the score, the Elo difference and the bounds of its 95%
+        confidence interval """
+
+        games = self.games()
+        if not games:
+            return {"games": 0}
+        fraction = (self.wins + 0.5 * self.draws) / games
+        # The standard error of the mean score of a game, from the spread of
+        # the wins, draws and losses around it.
+        variance = (self.wins * (1 - fraction) ** 2 +
+                    self.draws * (0.5 - fraction) ** 2 +
+                    self.losses * fraction ** 2) / games
+        error = 1.96 * math.sqrt(variance / games)
+        return {
+            "games": games,
+            "wins": self.wins,
+            "draws": self.draws,
+            "losses": self.losses,
+            "score": round(fraction, 4),
+            "elo": round(elo_difference(fraction), 1),
+            "elo_low": round(elo_difference(fraction - error), 1),
+            "elo_high": round(elo_difference(fraction + error), 1),
+            "reasons": dict(sorted(self.reasons.items()))
+        }
+
+
+def schedule(first, second, games, openings, seed, max_plies, draw_plies,
+             repetitions, record = False):
+
+    """ Returns the list of games to play: the openings are used in turn, each
+    one twice with the colours swapped """
+
+    scheduled = []
+    for number in range(games):
+        opening_number = (number // 2) % len(openings)
+        swap = number % 2 == 1
+        scheduled.append({
+            "game": number + 1,
+            "opening_number": opening_number,
+            "opening": openings[opening_number],
+            "white": second if swap else first,
+            "black": first if swap else second,
+            "first": "black" if swap else "white",
+            "seed": seed + 2 * number,
+            "max_plies": max_plies,
+            "draw_plies": draw_plies,
+            "repetitions": repetitions,
+            "record": record
+        })
+    return scheduled
+
+
+def run_match(first, second, games, openings, workers = None, seed = 0,
+              max_plies = MAX_PLIES, draw_plies = DRAW_PLIES,
+              repetitions = REPETITIONS, callback = None, record = False):
+
+    """ Plays games between two policies on a pool of workers, calling the
+    callback, if any, with every game record as it finishes. With record set,
+    the records also hold the packed moves of the game. Returns the summary
+    from the point of view of the first policy, with the games per second. """
+
+    workers = workers or os.cpu_count() or 1
+    scheduled = schedule(first, second, games, openings, seed, max_plies,
+                         draw_plies, repetitions, record)
+    chunks = [scheduled[i:i + CHUNK_GAMES]
+              for i in range(0, len(scheduled), CHUNK_GAMES)]
+    tally = Tally()
+    plies = 0
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Only a few chunks per worker are handed out at a time, so the
+        # records stream in while the match is still being played.
+        pending = set()
+        while chunks or pending:
+            while chunks and len(pending) < workers * 2:
+                pending.add(pool.submit(play_games, chunks.pop(0)))
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                for record in future.result():
+                    tally.add(record)
+                    plies += record["plies"]
+                    if callback:
+                        callback(record)
+
+    seconds = time.perf_counter() - start
+    summary = tally.summary()
+    summary.update({
+        "first": first,
+        "second": second,
+        "workers": workers,
+        "seconds": round(seconds, 6),
+        "games_per_second": round(games / seconds, 3) if seconds else 0.0,
+        "plies_per_second": int(plies / seconds) if seconds else 0
+    })
+    return summary
+
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(
+        description="Play multi-level chess games between two policies.")
+    parser.add_argument(
+        "first", nargs="?", default="greedy",
+        help="policy whose score is reported (default greedy)")
+    parser.add_argument(
+        "second", nargs="?", default="random",
+        help="opposing policy (default random)")
+    parser.add_argument(
+        "-n", "--games", type=int, default=100,
+        help="number of games (default 100)")
+    parser.add_argument(
+        "-w", "--workers", type=int, default=os.cpu_count(),
+        help="number of worker processes (default one per CPU)")
+    parser.add_argument(
+        "--game-file", default="newgame",
+        help="starting position, a game in saves/ or a path (default newgame)")
+    parser.add_argument(
+        "--openings", default=None,
+        help="file of hex positions, one per line, to start games from")
+    parser.add_argument(
+        "--random-plies", type=int, default=0,
+        help="start every pair of games after this many random moves from "
+             "the starting position instead")
+    parser.add_argument(
+        "--max-plies", type=int, default=MAX_PLIES,
+        help="plies after which a game is drawn (default %d)" % MAX_PLIES)
+    parser.add_argument(
+        "--draw-plies", type=int, default=DRAW_PLIES,
+        help="plies without a capture or pawn move after which a game is "
+             "drawn (default %d)" % DRAW_PLIES)
+    parser.add_argument(
+        "--seed", type=int, default=0, help="random seed (default 0)")
+    parser.add_argument(
+        "-o", "--output", default=None,
+        help="file to write the game records to (default standard output)")
+    parser.add_argument(
+        "--archive", default=None,
+        help="binary record file (see mlrecord.py) to append the moves of "
+             "every game to")
+    args = parser.parse_args(argv)
+
+    if args.games < 1:
+        parser.error("the number of games must be at least 1")
+    for spec in [args.first, args.second]:
+        try:
+            parse_policy(spec)
+        except ValueError as error:
+            parser.error(str(error))
+
+    if args.openings:
+        openings = read_openings(args.openings)
+    else:
+        board = mlbitboard.BitBoard.load(args.game_file)
+        game_hex_data = encode_position(board).hex()
+        if args.random_plies:
+            openings = random_openings(game_hex_data, (args.games + 1) // 2,
+                                       args.random_plies, args.seed)
+        else:
+            openings = [game_hex_data]
+
+    output = open(args.output, "w") if args.output else sys.stdout
+    report = sys.stdout if args.output else sys.stderr
+    archive = mlrecord.GameWriter(open(args.archive, "ab")) \
+        if args.archive else None
+
+    def write(record):
+        if archive:
+            archive.write_game(bytes.fromhex(openings[record["opening"]]),
+                               record.pop("moves"), record["result"])
+        output.write(json.dumps(record) + "\n")
+        output.flush()
+
+    try:
+        summary = run_match(args.first, args.second, args.games, openings,
+                            args.workers, args.seed, args.max_plies,
+                            args.draw_plies, REPETITIONS, write,
+                            archive is not None)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        if archive:
+            archive.file.close()
+
+    print("%s vs %s: %d games, +%d =%d -%d, score %.3f, "
+          "Elo %+.1f (%+.1f to %+.1f), %.2f games/s on %d workers" % (
+              summary["first"], summary["second"], summary["games"],
+              summary["wins"], summary["draws"], summary["losses"],
+              summary["score"], summary["elo"], summary["elo_low"],
+              summary["elo_high"], summary["games_per_second"],
+              summary["workers"]), file=report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+"""
+
+mlparallel.py
+Multi-process parallel search for multi-level chess
+Samuel Bauman 2020
+
+"""
+
+import argparse
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import mlbitboard
+import mlsearch
+from mlchess import Piece, Board
+
+# A single Python process can only keep one core busy, so the parallel search
+# runs the engine in a pool of worker processes and splits the work between
+# them at the root: every worker searches its own share of the legal moves of
+# the position with iterative deepening, and the results are merged at the
+# deepest depth all of the workers finished. Positions are sent to the workers
+# as the 193 byte turn + Board.data encoding used by the save files.
+#
+# Usage: python3 mlparallel.py [game file] [-w workers] [-t seconds]
+#        python3 mlparallel.py [game file] --bench 1,2,4,8,16 [-t seconds]
+
+# Every worker process keeps one engine per transposition table size, so its
+# table carries over from one search to the next.
+worker_engines = {}
+
+
+def encode_position(board):
+
+    """ Returns the 193 byte turn + board data encoding of a board """
+
+    return bytes([board.turn.value]) + bytes(board.data)
+
+
+def search_moves(position, moves, time_limit, node_limit, max_depth,
+                 tt_megabytes):
+
+    """ Searches the given root moves of an encoded position in a worker
+    process. Returns a list with the [depth, score, pv] of every completed
+    depth, the node count, and whether the search ended early with a mate
+    score. """
+
+    if tt_megabytes not in worker_engines:
+        worker_engines.clear()
+        worker_engines[tt_megabytes] = mlsearch.Engine(tt_megabytes)
+    engine = worker_engines[tt_megabytes]
+
+    board = mlbitboard.BitBoard(bytearray(position))
+    depths = []
+
+    def record(result):
+        depths.append([result.depth, result.score, list(result.pv)])
+
+    result = engine.search(
+        board, time_limit, node_limit, max_depth, callback=record,
+        root_moves=moves)
+    mated = bool(depths) and abs(depths[-1][1]) >= \
+        mlsearch.MATE - mlsearch.MAX_PLY
+    return [depths, result.nodes, mated]
+
+
+def split_moves(moves, parts):
+
+    """ Deals moves out round-robin into the given number of lists """
+
+    shares = [[] for part in range(min(parts, len(moves)))]
+    for i, move in enumerate(moves):
+        shares[i % len(shares)].append(move)
+    return shares
+
+
+class ParallelSearch:
+
+    """ Searches positions with a pool of worker processes """
+
+    def __init__(self, workers = 4, tt_megabytes = 16):
+
+        self.workers = workers
+        self.tt_megabytes = tt_megabytes
+        self.pool = ProcessPoolExecutor(max_workers=workers)
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *args):
+
+        self.close()
+
+    def close(self):
+
+        """ Shuts the worker processes down """
+
+        self.pool.shutdown()
+
+    def search(self, board, time_limit = None, node_limit = None,
+               max_depth = None):
+
+        """ Searches the board's position on all workers and returns a
+        mlsearch.SearchResult. The node limit applies to each worker. """
+
+        start = time.perf_counter()
+        result = mlsearch.SearchResult()
+        if board.turn not in [Piece.WHITE, Piece.BLACK]:
+            return result
+
+        moves = board.legal_moves(board.turn)
+        if not moves:
+            return result
+
+        # Captures first, so the likely best moves are spread over all of the
+        # workers instead of piling up on the first one.
+        moves.sort(key=lambda move: move >> 16 & Board.MOVE_CAPTURE,
+                   reverse=True)
+
+        position = encode_position(board)
+        futures = [
+            self.pool.submit(
+                search_moves, position, share, time_limit, node_limit,
+                max_depth, self.tt_megabytes)
+            for share in split_moves(moves, self.workers)
+        ]
+        outcomes = [future.result() for future in futures]
+
+        # Only depths finished by every worker can be compared. A worker that
+        # stopped early because it found a mate counts as having finished
+        # every depth with its last result.
+        depth = min(
+            mlsearch.MAX_PLY if mated else len(depths)
+            for depths, nodes, mated in outcomes
+        )
+
+        best = None
+        for depths, nodes, mated in outcomes:
+            result.nodes += nodes
+            if depth > 0:
+                entry = depths[min(depth, len(depths)) - 1]
+                if best is None or entry[1] > best[1]:
+                    best = entry
+
+        if best is not None:
+            result.depth = best[0]
+            result.score = best[1]
+            result.pv = best[2]
+            result.best_move = best[2][0] if best[2] else None
+        if result.best_move is None:
+            result.best_move = moves[0]
+            result.pv = [moves[0]]
+
+        result.seconds = time.perf_counter() - start
+        return result
+
+
+def benchmark(board, worker_counts, time_limit = 1.0, tt_megabytes = 16):
+
+    """ Searches the board with each number of workers for the same time and
+    returns a list of dictionaries with the nodes per second and the speedup
+    over the first worker count """
+
+    results = []
+    base_nps = None
+    for workers in worker_counts:
+        with ParallelSearch(workers, tt_megabytes) as parallel:
+            # Starts the worker processes before timing anything.
+            list(parallel.pool.map(abs, range(workers)))
+            result = parallel.search(board, time_limit)
+        nps = result.nps()
+        if base_nps is None:
+            base_nps = nps or 1
+        results.append({
+            "workers": workers,
+            "nodes": result.nodes,
+            "seconds": round(result.seconds, 6),
+            "nps": nps,
+            "speedup": round(nps / base_nps, 3),
+            "depth": result.depth,
+            "best_move": Board.move_to_str(result.best_move)
+        })
+    return results
+
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(
+        description="Search a multi-level chess position on several cores.")
+    parser.add_argument(
+        "game_file", nargs="?", default="newgame",
+        help="name of a game in saves/ or a path (default newgame)")
+    parser.add_argument(
+        "-w", "--workers", type=int, default=4,
+        help="number of worker processes (default 4)")
+    parser.add_argument(
+        "-t", "--time", type=float, default=1.0,
+        help="time limit in seconds (default 1)")
+    parser.add_argument(
+        "-d", "--depth", type=int, default=None, help="maximum depth")
+    parser.add_argument(
+        "--hash", type=int, default=16,
+        help="transposition table size per worker in megabytes (default 16)")
+    parser.add_argument(
+        "--bench", default=None,
+        help="comma separated worker counts to measure throughput for")
+    parser.add_argument(
+        "--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args(argv)
+
+    board = mlbitboard.BitBoard.load(args.game_file)
+
+    if args.bench:
+        counts = [int(count) for count in args.bench.split(",")]
+        results = benchmark(board, counts, args.time, args.hash)
+        if args.json:
+            print(json.dumps(results))
+        else:
+            for row in results:
+                print("workers %3d nodes %9d nps %8d speedup %6.2f depth %2d"
+                      % (row["workers"], row["nodes"], row["nps"],
+                         row["speedup"], row["depth"]))
+        return
+
+    with ParallelSearch(args.workers, args.hash) as parallel:
+        result = parallel.search(board, args.time, max_depth=args.depth)
+    if args.json:
+        print(json.dumps(result.to_dict()))
+    else:
+        print("depth %2d score %6d nodes %9d nps %7d time %7.3f pv %s" % (
+            result.depth, result.score, result.nodes, result.nps(),
+            result.seconds,
+            " ".join(Board.move_to_str(move) for move in result.pv)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+"""
+
+mlperft.py
+Perft node counts and move generator benchmark for multi-level chess
+Samuel Bauman 2020
+
+"""
+
+import argparse
+import json
+import sys
+import time
+
+import mlchess
+import mlbitboard
+import mleval
+
+# Counting every leaf position of every legal move sequence up to a depth
+# (perft) both measures the speed of the move generator and checks it: any
+# change to generate_move_mask, move_results_in_check, castling or pawn rules
+# that changes which moves are legal changes the counts.
+#
+# With --eval the same tree is walked to benchmark the evaluation instead: every
+# position is scored with the score the board keeps up to date as moves are
+# made and taken back, and again from scratch by summing all 192 squares and
+# with the mobility term, which also checks that the kept score is right.
+#
+# Usage: python3 mlperft.py [game file] [-d depth] [--divide] [--json] [--eval]
+
+BACKENDS = {
+    "board": mlchess.Board,
+    "bitboard": mlbitboard.BitBoard
+}
+
+
+def run(board, depth, divide = False, out = sys.stdout, as_json = False):
+
+    """ Runs perft for every depth up to the given depth and reports the leaf
+    counts, time and nodes per second unless as_json is set. Returns the
+    results dictionary. """
+
+    results = {"depths": [], "divide": {}}
+    wall_start = time.perf_counter()
+
+    for d in range(1, depth + 1):
+        start = time.perf_counter()
+        nodes = board.perft(d)
+        seconds = time.perf_counter() - start
+        nps = int(nodes / seconds) if seconds > 0 else 0
+        results["depths"].append(
+            {"depth": d, "nodes": nodes, "seconds": round(seconds, 6),
+             "nps": nps})
+        if not as_json:
+            out.write("depth %2d %12d nodes %10.3f s %10d nodes/s\n" %
+                      (d, nodes, seconds, nps))
+            out.flush()
+
+    if divide and depth > 0:
+        start = time.perf_counter()
+        counts = board.divide(depth)
+        seconds = time.perf_counter() - start
+        for move in sorted(counts):
+            name = mlchess.Board.move_to_str(move)
+            results["divide"][name] = counts[move]
+            if not as_json:
+                out.write("%s %d\n" % (name, counts[move]))
+        if not as_json:
+            out.write("%d moves %d nodes %.3f s\n" %
+                      (len(counts), sum(counts.values()), seconds))
+
+    results["seconds"] = round(time.perf_counter() - wall_start, 6)
+    if not as_json:
+        out.write("total %.3f s\n" % results["seconds"])
+    return results
+
+
+def eval_nodes(board, depth, visit):
+
+    """ Calls visit with the board at every position of the tree of legal
+    moves up to the given depth, the root included """
+
+    visit(board)
+    if depth < 1 or board.turn not in [mlchess.Piece.WHITE,
+                                       mlchess.Piece.BLACK]:
+        return
+    for move in board.legal_moves(board.turn):
+        board.make_move(move)
+        eval_nodes(board, depth - 1, visit)
+        board.unmake_move()
+
+
+def run_eval(board, depth, repeats = 10, out = sys.stdout, as_json = False):
+
+    """ Scores every position up to the given depth incrementally, from
+    scratch and with mobility, repeats times each, and reports the
+    evaluations per second of each. Raises AssertionError if the kept score
+    of any position differs from the one computed from scratch. Returns the
+    results dictionary. """
+
+    clock = time.perf_counter
+    seconds = {"incremental": 0.0, "scratch": 0.0, "mobility": 0.0}
+    nodes = 0
+
+    def visit(board):
+        nonlocal nodes
+        nodes += 1
+        score = board.score
+        expected = mleval.score_data(board.data)
+        if score != expected:
+            raise AssertionError("kept score %d, from scratch %d after %s" % (
+                score, expected, " ".join(mlchess.Board.move_to_str(undo[0])
+                                          for undo in board.undo)))
+
+        start = clock()
+        for repeat in range(repeats):
+            mleval.evaluate(board)
+        middle = clock()
+        for repeat in range(repeats):
+            mleval.score_data(board.data)
+        end = clock()
+        for repeat in range(repeats):
+            mleval.evaluate(board, True)
+        seconds["incremental"] += middle - start
+        seconds["scratch"] += end - middle
+        seconds["mobility"] += clock() - end
+
+    eval_nodes(board, depth, visit)
+
+    results = {"depth": depth, "nodes": nodes, "repeats": repeats}
+    if not as_json:
+        out.write("%d positions to depth %d\n" % (nodes, depth))
+    for name, total in seconds.items():
+        per_second = int(nodes * repeats / total) if total > 0 else 0
+        results[name] = {"seconds": round(total, 6), "evals_per_second":
+                         per_second}
+        if not as_json:
+            out.write("%-12s %10d evals %10.3f s %12d evals/s\n" %
+                      (name, nodes * repeats, total, per_second))
+    return results
+
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(
+        description="Perft node counts for multi-level chess positions.")
+    parser.add_argument(
+        "game_file", nargs="?", default="newgame",
+        help="name of a game in saves/ or a path (default newgame)")
+    parser.add_argument(
+        "-d", "--depth", type=int, default=3, help="search depth (default 3)")
+    parser.add_argument(
+        "--divide", action="store_true",
+        help="also list the node count below each root move")
+    parser.add_argument(
+        "--json", action="store_true", help="print the results as JSON")
+    parser.add_argument(
+        "--backend", choices=sorted(BACKENDS), default="board",
+        help="board implementation to use (default board)")
+    parser.add_argument(
+        "--eval", action="store_true",
+        help="benchmark incremental against from scratch evaluation")
+    parser.add_argument(
+        "--repeats", type=int, default=10,
+        help="evaluations of each position with --eval (default 10)")
+    args = parser.parse_args(argv)
+
+    board = BACKENDS[args.backend].load(args.game_file)
+    if args.eval:
+        results = run_eval(board, args.depth, args.repeats,
+                           as_json=args.json)
+    else:
+        results = run(board, args.depth, args.divide, as_json=args.json)
+
+    if args.json:
+        results["game_file"] = args.game_file
+        results["backend"] = args.backend
+        print(json.dumps(results))
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""
+
+mlpiece.py
+Table-driven piece encoding for multi-level chess
+Samuel Bauman 2020
+
+"""
+
+# Every square of the board holds a piece byte: the sum of a side, a rank and
+# a state value (see the Piece class in mlchess.py). Splitting a byte back up
+# with Board.decode_piece builds three Piece Enum members, which is slow when
+# it is done for every square move generation looks at. The same values are
+# kept here as plain ints, together with lookup tables indexed by the piece
+# byte, so the hot paths of the game never have to touch the Enum. The values
+# must match the Piece class exactly.
+
+EMPTY           =   0
+
+WHITE           =   0
+BLACK           =   127
+
+KING            =   12
+QUEEN           =   24
+ROOK            =   36
+KNIGHT          =   48
+BISHOP          =   60
+PAWN            =   72
+
+UNMOVED         =   1
+NORMAL          =   2
+PROMOTED        =   3
+MOVED_DOUBLE    =   4
+CHECK_UNMOVED   =   5
+CHECK_NORMAL    =   6
+CHECKMATE       =   7
+
+STALEMATE       =   8
+DRAW            =   9
+
+MOVE            =   254
+TAKE            =   255
+
+SIDES = (WHITE, BLACK)
+RANKS = (KING, QUEEN, ROOK, KNIGHT, BISHOP, PAWN)
+STATES = (UNMOVED, NORMAL, PROMOTED, MOVED_DOUBLE, CHECK_UNMOVED, CHECK_NORMAL,
+          CHECKMATE)
+
+
+def encode(side, rank, state):
+
+    """ Converts side, rank and state values into a piece byte """
+
+    return side + rank + state
+
+
+# The side, rank and state values of every byte, split up the same way as
+# Board.decode_piece does.
+
+SIDE = tuple(byte // 127 * 127 for byte in range(256))
+RANK = tuple((byte - SIDE[byte]) // 12 * 12 for byte in range(256))
+STATE = tuple(byte - SIDE[byte] - RANK[byte] for byte in range(256))
+
+# The side index (0 for white, 1 for black) of every byte, as used by the
+# per-side tables in mlgeometry.py and mlbitboard.py.
+SIDE_INDEX = tuple(byte // 127 for byte in range(256))
+
+# True for every byte that is made up of a valid side, rank and state.
+VALID = tuple(
+    byte == EMPTY or (SIDE[byte] in SIDES and RANK[byte] in RANKS and
+                      STATE[byte] in STATES)
+    for byte in range(256)
+)
+
+# The byte a piece has after it has moved: unmoved pieces and kings in check
+# become normal.
+MOVED = tuple(
+    byte - STATE[byte] + NORMAL
+    if STATE[byte] in (UNMOVED, CHECK_UNMOVED, CHECK_NORMAL) else byte
+    for byte in range(256)
+)
+
+# ENEMY[side][byte] and FRIEND[side][byte] are true if the byte holds a piece
+# of the other side or of the same side. Indexing them replaces a call to one
+# of the predicates below in tight loops.
+ENEMY = {
+    side: tuple(byte != EMPTY and SIDE[byte] != side for byte in range(256))
+    for side in SIDES
+}
+FRIEND = {
+    side: tuple(byte != EMPTY and SIDE[byte] == side for byte in range(256))
+    for side in SIDES
+}
+
+
+def is_empty(byte):
+
+    """ Returns true if the byte holds no piece """
+
+    return byte == EMPTY
+
+
+def is_enemy(byte, side):
+
+    """ Returns true if the byte holds a piece of the other side """
+
+    return ENEMY[side][byte]
+
+
+def is_friend(byte, side):
+
+    """ Returns true if the byte holds a piece of the given side """
+
+    return FRIEND[side][byte]
+
+
+def opponent(side):
+
+    """ Returns the side value of the other side """
+
+    return BLACK if side == WHITE else WHITE
@@ -0,0 +1,287 @@
+"""
+
+mlposdb.py
+Memory-mapped position database for multi-level chess
+Samuel Bauman 2020
+
+"""
+
+import argparse
+import collections
+import fcntl
+import mmap
+import os
+import struct
+
+import mlbitboard
+import mlrecord
+from mlchess import Board
+
+# Results worth keeping from one run to the next are stored per position: the
+# best move, score and depth of a search, and how many recorded games went
+# through the position and how they ended. A position is looked up by its key,
+# the board's 64-bit Zobrist hash of the turn and the 192 board bytes.
+#
+# The file is a header followed by a power of two number of fixed size
+# records, an open-addressed hash table: a key is stored in the slot given by
+# its low bits or, if that slot is taken, the next free one after it. Key 0
+# marks an empty slot, and the table is never more than half full, so a
+# lookup reads a slot or two and stops at the first empty one. Readers map
+# the file instead of reading it, so opening it costs nothing no matter how
+# big it is, only the pages actually probed are ever loaded, and any number
+# of processes share the same pages in memory.
+#
+# Only one process ever writes: merge holds a lock on the database, builds
+# the new table in a temporary file next to it and renames it over the old
+# one. Readers that opened the old file keep reading it unchanged; the next
+# ones to open the database see the new one.
+#
+# Usage: python3 mlposdb.py merge positions.mldb games.mlg other.mldb ...
+#        python3 mlposdb.py probe positions.mldb [game file]
+#        python3 mlposdb.py stats positions.mldb
+#        python3 mlsearch.py [game file] --positions positions.mldb [--store]
+
+MAGIC = b"MLPD"
+VERSION = 1
+# Magic, version, number of slots and number of positions.
+HEADER = struct.Struct(">4sB3xQQ8x")
+# Key, best move, score, depth, visits, wins and draws for the side to move.
+RECORD = struct.Struct(">QIiB3xIII")
+KEY = struct.Struct(">Q")
+
+EXTENSION = ".mldb"
+
+# The most positions per slot a table is written with, and the fewest slots.
+MAX_LOAD = 0.5
+MIN_SLOTS = 1024
+
+# The plies of each recorded game counted by merge (see merge_games).
+GAME_PLIES = 40
+
+Entry = collections.namedtuple(
+    "Entry", "key move score depth visits wins draws")
+
+
+def position_key(board):
+
+    """ Returns the database key of a board's position """
+
+    # 0 marks an empty slot, so a hash of 0 is stored as 1 instead.
+    return board.hash or 1
+
+
+def combine(old, new):
+
+    """ Returns the entry that merges two entries for the same position: the
+    counts are added up and the deeper search result is kept """
+
+    search = new if new.depth >= old.depth else old
+    return Entry(old.key, search.move, search.score, search.depth,
+                 old.visits + new.visits, old.wins + new.wins,
+                 old.draws + new.draws)
+
+
+class PositionDB:
+
+    """ A position database file, read through a memory map """
+
+    def __init__(self, path):
+
+        self.path = path
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.slots, self.count = HEADER.unpack_from(self.map)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a position database" % path)
+        if self.slots & (self.slots - 1) or \
+                len(self.map) != HEADER.size + self.slots * RECORD.size:
+            raise ValueError("%s has the wrong size" % path)
+        self.mask = self.slots - 1
+
+    def close(self):
+
+        self.map.close()
+        self.file.close()
+
+    def __len__(self):
+
+        return self.count
+
+    def get(self, key):
+
+        """ Returns the Entry of a key, or None """
+
+        key = key or 1
+        slot = key & self.mask
+        while True:
+            offset = HEADER.size + slot * RECORD.size
+            stored = KEY.unpack_from(self.map, offset)[0]
+            if stored == key:
+                return Entry._make(RECORD.unpack_from(self.map, offset))
+            if not stored:
+                return None
+            slot = (slot + 1) & self.mask
+
+    def probe(self, board):
+
+        """ Returns the Entry of a board's position, or None """
+
+        return self.get(position_key(board))
+
+    def entries(self):
+
+        """ Generates every Entry in the database """
+
+        for slot in range(self.slots):
+            offset = HEADER.size + slot * RECORD.size
+            if KEY.unpack_from(self.map, offset)[0]:
+                yield Entry._make(RECORD.unpack_from(self.map, offset))
+
+
+def table_slots(count):
+
+    """ Returns the number of slots of a table for count positions """
+
+    slots = MIN_SLOTS
+    while count > slots * MAX_LOAD:
+        slots *= 2
+    return slots
+
+
+def write_table(path, entries):
+
+    """ Writes a dictionary of entries by key as a new database file, replacing
+    the file at path in one step """
+
+    slots = table_slots(len(entries))
+    mask = slots - 1
+    data = bytearray(HEADER.size + slots * RECORD.size)
+    HEADER.pack_into(data, 0, MAGIC, VERSION, slots, len(entries))
+    for key, entry in entries.items():
+        slot = key & mask
+        while KEY.unpack_from(data, HEADER.size + slot * RECORD.size)[0]:
+            slot = (slot + 1) & mask
+        RECORD.pack_into(data, HEADER.size + slot * RECORD.size, *entry)
+
+    temporary = "%s.%d.tmp" % (path, os.getpid())
+    with open(temporary, "wb") as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+
+
+def merge_entries(entries, new_entries):
+
+    """ Merges entries into a dictionary of entries by key """
+
+    for entry in new_entries:
+        old = entries.get(entry.key)
+        entries[entry.key] = entry if old is None else combine(old, entry)
+
+
+def game_entries(path, plies = GAME_PLIES):
+
+    """ Generates an entry for every position of the first plies of every
+    game in a record file, counting the game's result for the side to move """
+
+    for game in mlrecord.read_file(path):
+        board = game.board(mlbitboard.BitBoard)
+        for ply, move in enumerate(game.moves()):
+            if ply >= plies:
+                break
+            side = board.turn.value // 127
+            win = game.result == ("1-0" if side == 0 else "0-1")
+            draw = game.result == "1/2-1/2"
+            yield Entry(position_key(board), 0, 0, 0, 1, int(win), int(draw))
+            board.make_move(move)
+
+
+def merge(path, sources, plies = GAME_PLIES, report = None):
+
+    """ Merges database files (.mldb), game record files and lists of entries
+    into the database at path, creating it if needed. Only one merge runs on
+    a database at a time; others wait for the lock. Returns the number of
+    positions in the database. """
+
+    with open(path + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        entries = {}
+        if os.path.exists(path):
+            database = PositionDB(path)
+            merge_entries(entries, database.entries())
+            database.close()
+
+        for source in sources:
+            if isinstance(source, str) and source.endswith(EXTENSION):
+                database = PositionDB(source)
+                merge_entries(entries, database.entries())
+                database.close()
+            elif isinstance(source, str):
+                merge_entries(entries, game_entries(source, plies))
+            else:
+                merge_entries(entries, source)
+            if report:
+                report("%s: %d positions" % (
+                    source if isinstance(source, str) else "entries",
+                    len(entries)))
+
+        write_table(path, entries)
+        return len(entries)
+
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(
+        description="Build and probe multi-level chess position databases.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    merge_parser = commands.add_parser(
+        "merge", help="merge databases and game record files into a database")
+    merge_parser.add_argument("database", help="database file to write")
+    merge_parser.add_argument(
+        "sources", nargs="+",
+        help=".mldb databases and game record files (see mlrecord.py)")
+    merge_parser.add_argument(
+        "--plies", type=int, default=GAME_PLIES,
+        help="plies of each game to count (default %d)" % GAME_PLIES)
+
+    probe_parser = commands.add_parser("probe", help="probe a saved game")
+    probe_parser.add_argument("database")
+    probe_parser.add_argument(
+        "game_file", nargs="?", default="newgame",
+        help="name of a game in saves/ or a path (default newgame)")
+
+    stats_parser = commands.add_parser("stats", help="summarise a database")
+    stats_parser.add_argument("database")
+    args = parser.parse_args(argv)
+
+    if args.command == "merge":
+        count = merge(args.database, args.sources, args.plies, print)
+        print("%d positions in %s" % (count, args.database))
+
+    elif args.command == "probe":
+        database = PositionDB(args.database)
+        entry = database.probe(Board.load(args.game_file))
+        if entry is None:
+            print("not found")
+        else:
+            print("move %s score %d depth %d visits %d wins %d draws %d" % (
+                Board.move_to_str(entry.move) if entry.depth else "none",
+                entry.score, entry.depth, entry.visits, entry.wins,
+                entry.draws))
+
+    elif args.command == "stats":
+        database = PositionDB(args.database)
+        searched = visits = 0
+        for entry in database.entries():
+            searched += entry.depth > 0
+            visits += entry.visits
+        print("%d positions in %d slots (%d bytes), %d searched, %d visits" % (
+            len(database), database.slots, len(database.map), searched,
+            visits))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,295 @@
+"""
+
+mlprotocol.py
+Binary wire protocol for multi-level chess
+Samuel Bauman 2020
+
+"""
+
+import socket
+import struct
+
+# Every message is a frame: a 4 byte header of the protocol version, the
+# message type and the payload length (big endian), followed by the payload.
+# The length makes it possible to split a stream of bytes back up into
+# messages however TCP happens to deliver it, and a sender can write several
+# frames at once without waiting for the other side (pipelining).
+#
+#   HELLO       0 bytes     sent by a client to ask for the binary protocol
+#   POSITION  193 bytes     the turn byte followed by the 192 board bytes
+#   START       1 byte      the side value (Piece.WHITE/BLACK) to play
+#   MOVE        3 bytes     from index, to index, moved piece
+#   ACK         4 bytes     number of moves received so far
+#   HEARTBEAT   0 bytes     keeps an idle connection alive
+#   WATCH       4 bytes     sent by a spectator instead of HELLO: the number
+#                           of the game to watch, 0 for the newest game
+#
+# A spectator is sent a POSITION followed by an ACK with the number of moves
+# played before that position, then every MOVE from there on. A later
+# POSITION and ACK replace the position being followed; they are sent to
+# spectators that fell behind instead of the moves they missed.
+#
+# Older clients and servers send the game data as hex text and moves as 6 hex
+# characters instead. A new client never writes before it has heard from the
+# server: an old server sends its game data straight away, while a new server
+# waits for HELLO first. A new server that hears nothing for a while falls
+# back to the hex format as well.
+
+VERSION = 1
+
+HELLO = 1
+POSITION = 2
+START = 3
+MOVE = 4
+ACK = 5
+HEARTBEAT = 6
+WATCH = 7
+
+PAYLOAD_SIZES = {
+    HELLO: 0,
+    POSITION: 193,
+    START: 1,
+    MOVE: 3,
+    ACK: 4,
+    HEARTBEAT: 0,
+    WATCH: 4
+}
+
+HEADER = struct.Struct(">BBH")
+ACK_COUNT = struct.Struct(">I")
+GAME_NUMBER = struct.Struct(">I")
+
+# How long a new client waits for an old server to speak first, and how long
+# a new server waits for HELLO before assuming an old client.
+CLIENT_WAIT = 0.5
+SERVER_WAIT = 2.0
+
+# Seconds without a message after which a waiting peer sends a heartbeat.
+HEARTBEAT_INTERVAL = 15.0
+
+
+class ProtocolError(Exception):
+
+    """ Raised for data that is not a valid frame """
+
+
+def encode_frame(kind, payload = b""):
+
+    """ Returns the bytes of a frame of the given type and payload """
+
+    return HEADER.pack(VERSION, kind, len(payload)) + payload
+
+
+def encode_hello():
+
+    return encode_frame(HELLO)
+
+
+def encode_position(position):
+
+    """ Encodes a 193 byte turn + board data position """
+
+    return encode_frame(POSITION, bytes(position))
+
+
+def encode_start(side_value):
+
+    return encode_frame(START, bytes([side_value]))
+
+
+def encode_move(from_index, to_index, piece):
+
+    return encode_frame(MOVE, bytes([from_index, to_index, piece]))
+
+
+def encode_ack(count):
+
+    return encode_frame(ACK, ACK_COUNT.pack(count))
+
+
+def encode_heartbeat():
+
+    return encode_frame(HEARTBEAT)
+
+
+def encode_watch(number):
+
+    return encode_frame(WATCH, GAME_NUMBER.pack(number))
+
+
+def decode_ack(payload):
+
+    """ Returns the move count of an ACK payload """
+
+    return ACK_COUNT.unpack(payload)[0]
+
+
+def decode_watch(payload):
+
+    """ Returns the game number of a WATCH payload """
+
+    return GAME_NUMBER.unpack(payload)[0]
+
+
+def check_frame(kind, length):
+
+    """ Raises ProtocolError if a frame of the given type can not have a
+    payload of the given length """
+
+    if kind not in PAYLOAD_SIZES:
+        raise ProtocolError("unknown message type %d" % kind)
+    if length != PAYLOAD_SIZES[kind]:
+        raise ProtocolError(
+            "message type %d with %d byte payload" % (kind, length))
+
+
+def is_binary(data):
+
+    """ Returns true if data received first starts a frame rather than the
+    hex text of the old format """
+
+    return data[:1] == bytes([VERSION])
+
+
+class FrameReader:
+
+    """ Splits a stream of received bytes back up into frames """
+
+    def __init__(self):
+
+        self.buffer = bytearray()
+
+    def feed(self, data):
+
+        """ Adds received bytes and returns the list of (type, payload) frames
+        completed by them """
+
+        self.buffer += data
+        frames = []
+        while len(self.buffer) >= HEADER.size:
+            version, kind, length = HEADER.unpack_from(self.buffer)
+            if version != VERSION:
+                raise ProtocolError("unsupported version %d" % version)
+            check_frame(kind, length)
+            end = HEADER.size + length
+            if len(self.buffer) < end:
+                break
+            frames.append((kind, bytes(self.buffer[HEADER.size:end])))
+            del self.buffer[:end]
+        return frames
+
+
+class FrameSocket:
+
+    """ Sends and receives frames over a blocking socket """
+
+    def __init__(self, sock, received = b""):
+
+        # received holds any bytes already read from the socket, e.g. while
+        # finding out which format the other side speaks.
+        self.sock = sock
+        self.reader = FrameReader()
+        self.frames = self.reader.feed(received)
+        self.moves_received = 0
+
+    def send(self, *frames):
+
+        """ Sends one or more encoded frames in a single write """
+
+        self.sock.sendall(b"".join(frames))
+
+    def recv_frame(self, timeout = None):
+
+        """ Returns the next (type, payload) frame, or None if there was none
+        within the timeout (seconds, None waits forever) """
+
+        while not self.frames:
+            self.sock.settimeout(timeout)
+            try:
+                data = self.sock.recv(4096)
+            except socket.timeout:
+                return None
+            finally:
+                self.sock.settimeout(None)
+            if not data:
+                raise ConnectionError("connection closed")
+            self.frames = self.reader.feed(data)
+        return self.frames.pop(0)
+
+    def recv_move(self, heartbeat = HEARTBEAT_INTERVAL):
+
+        """ Waits for the next move and returns its 3 bytes. Every move is
+        acknowledged, acks and heartbeats are skipped, and a heartbeat is sent
+        whenever nothing arrives for the heartbeat interval. """
+
+        while True:
+            frame = self.recv_frame(heartbeat)
+            if frame is None:
+                self.send(encode_heartbeat())
+                continue
+            kind, payload = frame
+            if kind == MOVE:
+                self.moves_received += 1
+                self.send(encode_ack(self.moves_received))
+                return payload
+            if kind not in [ACK, HEARTBEAT]:
+                raise ProtocolError("unexpected message type %d" % kind)
+
+
+def server_handshake(sock, wait = SERVER_WAIT):
+
+    """ Waits for a client's HELLO and returns a FrameSocket, or None if the
+    client speaks the old hex format """
+
+    sock.settimeout(wait)
+    try:
+        data = sock.recv(4096)
+    except socket.timeout:
+        return None
+    finally:
+        sock.settimeout(None)
+    if not data:
+        raise ConnectionError("connection closed")
+    if not is_binary(data):
+        raise ProtocolError("unexpected data before the game started")
+    frames = FrameSocket(sock, data)
+    kind, payload = frames.recv_frame()
+    if kind != HELLO:
+        raise ProtocolError("expected HELLO, got message type %d" % kind)
+    return frames
+
+
+def client_handshake(sock, wait = CLIENT_WAIT):
+
+    """ Finds out which format a server speaks. Returns a FrameSocket and
+    None for the binary protocol, or None and the data received so far for
+    the old hex format. """
+
+    sock.settimeout(wait)
+    try:
+        data = sock.recv(512)
+    except socket.timeout:
+        data = None
+    finally:
+        sock.settimeout(None)
+
+    if data is None:
+        sock.sendall(encode_hello())
+        return FrameSocket(sock), None
+    if not data:
+        raise ConnectionError("connection closed")
+    if is_binary(data):
+        return FrameSocket(sock, data), None
+    return None, data
+
+
+async def read_frame(reader):
+
+    """ Reads the next (type, payload) frame from an asyncio StreamReader """
+
+    header = await reader.readexactly(HEADER.size)
+    version, kind, length = HEADER.unpack(header)
+    if version != VERSION:
+        raise ProtocolError("unsupported version %d" % version)
+    check_frame(kind, length)
+    return kind, await reader.readexactly(length)
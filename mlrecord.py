@@ -0,0 +1,489 @@
+"""
+
+mlrecord.py
+Compact game records for multi-level chess
+Samuel Bauman 2020
+
+"""
+
+import argparse
+import re
+import sys
+
+import mlpiece
+from mlchess import Piece, Board
+
+# A game record is the position the game started from followed by its moves,
+# so the whole game can be replayed, instead of a snapshot of the board at the
+# end. In the binary form a game is:
+#
+#   193 bytes   the start position: the turn byte and the 192 board bytes,
+#               the same as a save file's hex data
+#   2 bytes     from index, to index                    for every move
+#   2 bytes     END, result                             at the end of the game
+#
+# Index positions only go up to 191, so a first byte of 192 or more marks a
+# record that is not a plain move. A move is written without the flags
+# Board.pack_move can pack into it (capture, castle, pawn double move), as
+# replaying the game works them out from the board, so a game has exactly one
+# encoding however its moves were made. Files written before that may also
+# hold 3 byte moves, FLAGGED + flags followed by the two index positions,
+# which are still read.
+#
+# Games follow each other directly, so files can be appended to or
+# concatenated. A game cut off before its END, such as the last one of a file
+# that is still being written, reads as unfinished; one cut off before the
+# end of its start position has nothing to replay and is left out. At 2
+# bytes per ply, a game of a few hundred plies takes about a kilobyte, where
+# a single hex snapshot takes 386 characters.
+#
+# The text form uses 3D algebraic notation: a square is its file a-h, rank
+# 1-8 and level A-C (x, y and z), and a move is the letter of the moved piece
+# (none for pawns), the from square, - or x for a capture and the to square,
+# e.g. Nb1A-c3B. Games are written like PGN: tags, then the numbered moves,
+# then the result.
+#
+# Usage: python3 mlrecord.py text games.mlg [-o games.txt]
+#        python3 mlrecord.py binary games.txt -o games.mlg
+#        python3 mlrecord.py check games.mlg
+#        python3 mlrecord.py position games.mlg [-n game] [-p ply]
+
+POSITION_SIZE = 193
+
+FLAGGED = 0xc0
+END = 0xff
+
+# The result strings by the byte written after END.
+RESULTS = ["*", "1-0", "0-1", "1/2-1/2"]
+
+# Bytes read from a file at a time.
+CHUNK_SIZE = 1 << 16
+
+FILES = "abcdefgh"
+LEVELS = "ABC"
+
+PIECE_LETTERS = {
+    mlpiece.KING: "K",
+    mlpiece.QUEEN: "Q",
+    mlpiece.ROOK: "R",
+    mlpiece.KNIGHT: "N",
+    mlpiece.BISHOP: "B",
+    mlpiece.PAWN: ""
+}
+
+TEXT_MOVE = re.compile(
+    r"^([KQRNB]?)([a-h][1-8][A-C])([-x])([a-h][1-8][A-C])$")
+TEXT_TAG = re.compile(r'^\[(\w+) "(.*)"\]$')
+
+
+class RecordError(Exception):
+
+    """ Raised for data that is not a valid game record """
+
+
+def square_name(index):
+
+    """ Returns the 3D algebraic name of an index position, e.g. e2A """
+
+    x, y, z = Board.index_to_vector(index)
+    return "%s%d%s" % (FILES[x], y + 1, LEVELS[z])
+
+
+def square_index(name):
+
+    """ Returns the index position of a 3D algebraic square name """
+
+    return Board.vector_to_index(
+        [FILES.index(name[0]), int(name[1]) - 1, LEVELS.index(name[2])])
+
+
+def result_of(board):
+
+    """ Returns the result string of the game on a board """
+
+    if board.turn == Piece.CHECKMATE:
+        white_king = board.data[board.king[Piece.WHITE]]
+        return "0-1" if mlpiece.STATE[white_king] == mlpiece.CHECKMATE \
+            else "1-0"
+    if board.turn in [Piece.STALEMATE, Piece.DRAW]:
+        return "1/2-1/2"
+    return "*"
+
+
+def encode_move(move):
+
+    """ Returns the 2 record bytes of a packed move, leaving out its flags """
+
+    return bytes([move & 0xff, move >> 8 & 0xff])
+
+
+def encode_game(position, moves, result = "*"):
+
+    """ Returns the binary record of a game from its 193 byte start position,
+    its packed moves and its result string """
+
+    if len(position) != POSITION_SIZE:
+        raise RecordError("start position of %d bytes" % len(position))
+    return b"".join(
+        [bytes(position)] + [encode_move(move) for move in moves] +
+        [bytes([END, RESULTS.index(result)])])
+
+
+class Game:
+
+    """ A game read from a record. The moves are kept as their record bytes
+    and only decoded when they are asked for. """
+
+    def __init__(self, position, records, plies, result = "*"):
+
+        self.position = bytes(position)
+        self.records = bytes(records)
+        self.plies = plies
+        self.result = result
+
+    def moves(self):
+
+        """ Generates the packed moves of the game one at a time """
+
+        records = self.records
+        offset = 0
+        while offset < len(records):
+            first = records[offset]
+            if first >= FLAGGED:
+                yield records[offset + 1] | records[offset + 2] << 8 | \
+                    (first & 0x3f) << 16
+                offset += 3
+            else:
+                yield first | records[offset + 1] << 8
+                offset += 2
+
+    def board(self, board_class = Board):
+
+        """ Returns a new board at the start position of the game """
+
+        return board_class(bytearray(self.position))
+
+    def replay(self, board_class = Board, check = False):
+
+        """ Generates every move of the game with the board it has been made
+        on, one move at a time. With check set, a move that is not legal
+        raises RecordError. """
+
+        board = self.board(board_class)
+        for ply, move in enumerate(self.moves()):
+            if check and not is_legal(board, move):
+                raise RecordError("illegal move %s at ply %d" % (
+                    Board.move_to_str(move), ply + 1))
+            board.make_move(move)
+            yield move, board
+
+    def encode(self):
+
+        """ Returns the binary record of the game. Moves read with flags are
+        written without them. """
+
+        return encode_game(self.position, self.moves(), self.result)
+
+
+def save_game(path, game):
+
+    """ Writes the record of a MultilevelChess game so far to a file: its
+    start position and every move made on its board """
+
+    with open(path, "wb") as file:
+        file.write(encode_game(
+            game.start_data, [entry[0] for entry in game.board.undo],
+            result_of(game.board)))
+
+
+def is_legal(board, move):
+
+    """ Returns true if the from and to index positions of a packed move are
+    those of a legal move on the board """
+
+    if board.turn not in [Piece.WHITE, Piece.BLACK]:
+        return False
+    from_to = move & 0xffff
+    return any(legal & 0xffff == from_to
+               for legal in board.generate_legal_moves(board.turn))
+
+
+def read_games(file):
+
+    """ Generates the games of a binary record file one at a time, reading
+    the file a chunk at a time """
+
+    buffer = b""
+    offset = 0
+    ended = False
+
+    def fill(count):
+        # Makes sure count bytes from the offset are in the buffer, reading
+        # more of the file if needed. Returns false at the end of the file.
+        nonlocal buffer, offset, ended
+        while len(buffer) - offset < count and not ended:
+            chunk = file.read(CHUNK_SIZE)
+            if not chunk:
+                ended = True
+                break
+            buffer = buffer[offset:] + chunk
+            offset = 0
+        return len(buffer) - offset >= count
+
+    while fill(1):
+        if not fill(POSITION_SIZE):
+            # A file cut off in the middle of a start position ends with the
+            # games before it.
+            break
+        position = buffer[offset:offset + POSITION_SIZE]
+        if position[0] not in [mlpiece.WHITE, mlpiece.BLACK]:
+            raise RecordError("bad turn byte %d" % position[0])
+        offset += POSITION_SIZE
+
+        records = bytearray()
+        plies = 0
+        result = "*"
+        while fill(1):
+            first = buffer[offset]
+            if first == END:
+                if not fill(2):
+                    # Cut off before the result, so the game is unfinished.
+                    offset = len(buffer)
+                    break
+                if buffer[offset + 1] >= len(RESULTS):
+                    raise RecordError("bad end of game")
+                result = RESULTS[buffer[offset + 1]]
+                offset += 2
+                break
+            size = 3 if first >= FLAGGED else 2
+            if not fill(size):
+                # A file cut off in the middle of a move ends with the
+                # unfinished game before it.
+                offset = len(buffer)
+                break
+            records += buffer[offset:offset + size]
+            offset += size
+            plies += 1
+        yield Game(position, records, plies, result)
+
+
+def read_file(path):
+
+    """ Generates the games of a binary record file by its path """
+
+    with open(path, "rb") as file:
+        yield from read_games(file)
+
+
+class GameWriter:
+
+    """ Writes games to a binary record file one move at a time """
+
+    def __init__(self, file):
+
+        self.file = file
+        self.playing = False
+
+    def begin(self, position):
+
+        """ Starts a game from a 193 byte start position, ending any game
+        still being written as unfinished """
+
+        if self.playing:
+            self.end()
+        if len(position) != POSITION_SIZE:
+            raise RecordError("start position of %d bytes" % len(position))
+        self.file.write(bytes(position))
+        self.playing = True
+
+    def move(self, move):
+
+        self.file.write(encode_move(move))
+
+    def end(self, result = "*"):
+
+        self.file.write(bytes([END, RESULTS.index(result)]))
+        self.playing = False
+
+    def write_game(self, position, moves, result = "*"):
+
+        """ Writes a whole game at once """
+
+        if self.playing:
+            self.end()
+        self.file.write(encode_game(position, moves, result))
+
+
+def move_text(board, move):
+
+    """ Returns the 3D algebraic text of a packed move on the board it is
+    about to be made on """
+
+    from_index = move & 0xff
+    to_index = move >> 8 & 0xff
+    return "%s%s%s%s" % (
+        PIECE_LETTERS.get(mlpiece.RANK[board.data[from_index]], ""),
+        square_name(from_index),
+        "x" if board.data[to_index] != mlpiece.EMPTY else "-",
+        square_name(to_index))
+
+
+def game_to_text(game, board_class = Board):
+
+    """ Returns the text form of a game """
+
+    lines = ['[Position "%s"]' % game.position.hex(),
+             '[Result "%s"]' % game.result]
+    tokens = []
+    board = game.board(board_class)
+    for ply, move in enumerate(game.moves()):
+        if ply % 2 == 0:
+            tokens.append("%d." % (ply // 2 + 1))
+        tokens.append(move_text(board, move))
+        board.make_move(move)
+    tokens.append(game.result)
+
+    # The moves are wrapped at about 80 columns.
+    line = ""
+    for token in tokens:
+        if line and len(line) + len(token) >= 80:
+            lines.append(line)
+            line = ""
+        line = (line + " " + token) if line else token
+    lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+def text_game(tags, tokens, board_class = Board):
+
+    """ Returns the Game of the tags and move tokens of a text game. Every
+    move is looked up among the legal moves, so an illegal one raises
+    RecordError. """
+
+    if "Position" not in tags:
+        raise RecordError("game without a Position tag")
+    position = bytes.fromhex(tags["Position"])
+    board = board_class(bytearray(position))
+    moves = []
+    result = tags.get("Result", "*")
+    for token in tokens:
+        if token in RESULTS:
+            result = token
+            continue
+        if token.endswith("."):
+            continue
+        match = TEXT_MOVE.match(token)
+        if not match:
+            raise RecordError("bad move %r" % token)
+        from_to = square_index(match.group(2)) | \
+            square_index(match.group(4)) << 8
+        legal = [move for move in board.legal_moves(board.turn)
+                 if move & 0xffff == from_to] \
+            if board.turn in [Piece.WHITE, Piece.BLACK] else []
+        if not legal:
+            raise RecordError("illegal move %s at ply %d" % (
+                token, len(moves) + 1))
+        moves.append(legal[0])
+        board.make_move(legal[0])
+    records = b"".join(encode_move(move) for move in moves)
+    return Game(position, records, len(moves), result)
+
+
+def read_text_games(file, board_class = Board):
+
+    """ Generates the games of a text file one at a time, reading it a line
+    at a time """
+
+    tags = {}
+    tokens = []
+    for line in file:
+        line = line.strip()
+        match = TEXT_TAG.match(line)
+        if match:
+            if tokens:
+                yield text_game(tags, tokens, board_class)
+                tags, tokens = {}, []
+            tags[match.group(1)] = match.group(2)
+        elif line:
+            tokens += line.split()
+    if tags or tokens:
+        yield text_game(tags, tokens, board_class)
+
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(
+        description="Convert and check multi-level chess game records.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    text = commands.add_parser(
+        "text", help="write the games of a binary file as text")
+    text.add_argument("path", help="binary record file")
+    text.add_argument("-o", "--output", default=None,
+                      help="text file to write (default standard output)")
+
+    binary = commands.add_parser(
+        "binary", help="write the games of a text file as binary records")
+    binary.add_argument("path", help="text record file")
+    binary.add_argument("-o", "--output", required=True,
+                        help="binary record file to write")
+
+    check = commands.add_parser(
+        "check", help="replay every game, testing that its moves are legal")
+    check.add_argument("path", help="binary record file")
+
+    position = commands.add_parser(
+        "position", help="print the hex data of a position of a game, which "
+                         "can be saved to saves/ and loaded")
+    position.add_argument("path", help="binary record file")
+    position.add_argument("-n", "--game", type=int, default=1,
+                          help="number of the game, from 1 (default 1)")
+    position.add_argument("-p", "--ply", type=int, default=None,
+                          help="number of plies to play (default all)")
+    args = parser.parse_args(argv)
+
+    if args.command == "text":
+        output = open(args.output, "w") if args.output else sys.stdout
+        try:
+            for number, game in enumerate(read_file(args.path)):
+                if number:
+                    output.write("\n")
+                output.write(game_to_text(game))
+        finally:
+            if output is not sys.stdout:
+                output.close()
+
+    elif args.command == "binary":
+        with open(args.path, "r") as file, open(args.output, "wb") as output:
+            writer = GameWriter(output)
+            for game in read_text_games(file):
+                writer.write_game(game.position, game.moves(), game.result)
+
+    elif args.command == "check":
+        games = plies = size = 0
+        for game in read_file(args.path):
+            for move, board in game.replay(check=True):
+                pass
+            games += 1
+            plies += game.plies
+            size += len(game.encode())
+        print("%d games %d plies %d bytes, %.2f bytes per ply of moves" % (
+            games, plies, size,
+            (size - games * (POSITION_SIZE + 2)) / plies if plies else 0.0))
+
+    elif args.command == "position":
+        for number, game in enumerate(read_file(args.path)):
+            if number + 1 == args.game:
+                board = game.board()
+                if args.ply != 0:
+                    for ply, (move, board) in enumerate(game.replay(), 1):
+                        if ply == args.ply:
+                            break
+                print("%02x" % board.turn.value + board.data.hex())
+                break
+        else:
+            parser.error("no game %d in %s" % (args.game, args.path))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,518 @@
+"""
+
+mlsearch.py
+Alpha-beta search engine for multi-level chess
+Samuel Bauman 2020
+
+"""
+
+import argparse
+import os
+import time
+from array import array
+
+import mlbitboard
+import mlbook
+import mleval
+import mlpiece
+import mlposdb
+import mltablebase
+from mlchess import Piece, Board, DRAW_PLIES
+
+# The engine searches with negamax alpha-beta and iterative deepening: it
+# searches to depth 1, then 2, and so on until it runs out of time or nodes,
+# always keeping the best move of the last depth it finished. Each iteration
+# is cheap compared to the next one, and the transposition table and move
+# ordering heuristics filled in by earlier iterations make the later ones cut
+# off far more of the tree.
+#
+# Usage: python3 mlsearch.py [game file] [-t seconds] [-n nodes] [-d depth]
+
+INFINITY = 1000000
+MATE = 100000
+
+# Material values used for ordering captures, indexed by rank value // 12.
+RANK_VALUES = mleval.RANK_VALUES
+
+# The rank value // 12 of every encoded piece byte, used for move ordering.
+RANK_INDEX = [0] * 256
+for _byte in range(1, 256):
+    if mlpiece.VALID[_byte]:
+        RANK_INDEX[_byte] = mlpiece.RANK[_byte] // 12
+
+# Transposition table entry bounds.
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+MAX_PLY = 64
+
+
+def to_tt(score, ply):
+
+    """ Converts a mate score from distance to the root to distance to the
+    position it is stored for """
+
+    if score >= MATE - MAX_PLY:
+        return score + ply
+    if score <= -MATE + MAX_PLY:
+        return score - ply
+    return score
+
+
+def from_tt(score, ply):
+
+    """ Converts a stored mate score back to distance to the root """
+
+    if score >= MATE - MAX_PLY:
+        return score - ply
+    if score <= -MATE + MAX_PLY:
+        return score + ply
+    return score
+
+
+class SearchTimeout(Exception):
+
+    """ Raised inside the search when the deadline or node limit is hit """
+
+
+class SearchResult:
+
+    """ The outcome of a search """
+
+    def __init__(self):
+
+        self.best_move = None
+        self.score = 0
+        self.pv = []
+        self.depth = 0
+        self.nodes = 0
+        self.seconds = 0.0
+        self.tt_hits = 0
+
+    def nps(self):
+
+        """ Returns the nodes searched per second """
+
+        return int(self.nodes / self.seconds) if self.seconds > 0 else 0
+
+    def to_dict(self):
+
+        """ Returns the result as a dictionary, with moves as strings """
+
+        return {
+            "best_move": Board.move_to_str(self.best_move)
+                if self.best_move is not None else None,
+            "score": self.score,
+            "pv": [Board.move_to_str(move) for move in self.pv],
+            "depth": self.depth,
+            "nodes": self.nodes,
+            "seconds": round(self.seconds, 6),
+            "nps": self.nps(),
+            "tt_hits": self.tt_hits
+        }
+
+
+class TranspositionTable:
+
+    """ A fixed size hash table of search results indexed by position hash """
+
+    # Every entry is two 64-bit values: the position hash and the packed
+    # move, depth, bound and score. Both are kept in flat arrays so the table
+    # uses exactly the memory it is given no matter how many positions are
+    # stored in it.
+
+    ENTRY_BYTES = 16
+    SCORE_OFFSET = 1 << 20
+
+    def __init__(self, megabytes = 16):
+
+        entries = 1
+        while entries * 2 * self.ENTRY_BYTES <= megabytes * 1024 * 1024:
+            entries *= 2
+        self.mask = entries - 1
+        self.keys = array("Q", bytes(8 * entries))
+        self.values = array("Q", bytes(8 * entries))
+
+    def clear(self):
+
+        """ Empties the table """
+
+        entries = self.mask + 1
+        self.keys = array("Q", bytes(8 * entries))
+        self.values = array("Q", bytes(8 * entries))
+
+    def probe(self, key):
+
+        """ Returns [move, depth, bound, score] for the key, or None """
+
+        slot = key & self.mask
+        if self.keys[slot] != key:
+            return None
+        value = self.values[slot]
+        return [value & 0xffffff, (value >> 24) & 0xff, (value >> 32) & 0x3,
+                (value >> 34) - self.SCORE_OFFSET]
+
+    def store(self, key, move, depth, bound, score):
+
+        """ Stores a search result, replacing whatever was in its slot unless
+        it is a deeper result for the same position """
+
+        slot = key & self.mask
+        if self.keys[slot] == key and (self.values[slot] >> 24) & 0xff > depth:
+            return
+        self.keys[slot] = key
+        self.values[slot] = ((move or 0) | (depth << 24) | (bound << 32) |
+                             ((score + self.SCORE_OFFSET) << 34))
+
+
+class Engine:
+
+    """ A negamax alpha-beta searcher for a Board """
+
+    def __init__(self, tt_megabytes = 16, tablebases = None, mobility = False,
+                 positions = None):
+
+        # tablebases, a mltablebase.Tablebases, gives the exact result of
+        # the positions it has tables for instead of searching them.
+        # mobility adds the mobility term to every evaluation, which costs a
+        # pass of the move generator over all pieces at every leaf.
+        # positions, a mlposdb.PositionDB, holds the results of earlier
+        # searches, which are used like transposition table entries.
+        self.tt = TranspositionTable(tt_megabytes)
+        self.tablebases = tablebases
+        self.mobility = mobility
+        self.positions = positions
+        self.history = {}
+        self.killers = [[None, None] for ply in range(MAX_PLY + 1)]
+
+        self.board = None
+        self.nodes = 0
+        self.tt_hits = 0
+        self.deadline = None
+        self.node_limit = None
+        self.root_moves = None
+        self.pv = [[] for ply in range(MAX_PLY + 1)]
+
+    def evaluate(self, board):
+
+        """ Returns the static score of the position for the side to move """
+
+        # The material and square score is kept up to date by the board as
+        # moves are made and taken back (see mleval.py).
+        return mleval.evaluate(board, self.mobility)
+
+    def order_moves(self, board, moves, tt_move, ply):
+
+        """ Sorts moves so the ones most likely to cause a cut-off come first:
+        the transposition table move, then captures by most valuable victim
+        and least valuable attacker, then killer moves, then quiet moves by
+        their history score """
+
+        data = board.data
+        killers = self.killers[ply]
+        history = self.history
+        keys = []
+        for move in moves:
+            from_to = move & 0xffff
+            if tt_move is not None and from_to == tt_move & 0xffff:
+                key = 1 << 40
+            elif move >> 16 & Board.MOVE_CAPTURE:
+                victim = RANK_VALUES[RANK_INDEX[data[move >> 8 & 0xff]]]
+                attacker = RANK_VALUES[RANK_INDEX[data[move & 0xff]]]
+                key = (1 << 30) + victim * 16 - attacker // 64
+            elif from_to == killers[0]:
+                key = (1 << 29) + 1
+            elif from_to == killers[1]:
+                key = 1 << 29
+            else:
+                key = history.get(from_to, 0)
+            keys.append(key)
+        order = sorted(range(len(moves)), key=keys.__getitem__, reverse=True)
+        return [moves[i] for i in order]
+
+    def count_node(self):
+
+        """ Counts a node, raising SearchTimeout instead once the node limit
+        is hit or, looked at every 1024 nodes, the deadline has passed """
+
+        # The node limit is a single compare and is tested at every node, so
+        # a search never visits more nodes than it was allowed; reading the
+        # clock costs more and is only done now and then.
+        if self.node_limit is not None and self.nodes >= self.node_limit:
+            raise SearchTimeout()
+        self.nodes += 1
+        if not self.nodes & 1023 and self.deadline is not None and \
+                time.perf_counter() >= self.deadline:
+            raise SearchTimeout()
+
+    def quiesce(self, alpha, beta, ply):
+
+        """ Searches captures only until the position is quiet """
+
+        board = self.board
+        self.count_node()
+
+        stand_pat = self.evaluate(board)
+        if stand_pat >= beta or ply >= MAX_PLY:
+            return stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+
+        captures = board.legal_moves(board.turn, True)
+        for move in self.order_moves(board, captures, None, ply):
+            board.make_move(move)
+            score = -self.quiesce(-beta, -alpha, ply + 1)
+            board.unmake_move()
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        return alpha
+
+    def negamax(self, depth, alpha, beta, ply):
+
+        """ Returns the score of the position for the side to move, searched
+        to the given depth """
+
+        board = self.board
+        self.pv[ply] = []
+        if depth <= 0:
+            return self.quiesce(alpha, beta, ply)
+
+        self.count_node()
+
+        # A position reached before on the way here, or after too many plies
+        # without a capture or pawn move, is a draw.
+        if ply > 0 and (board.is_repetition() or
+                        board.quiet_plies >= DRAW_PLIES):
+            return 0
+
+        if self.tablebases is not None and ply > 0 and \
+                len(board.pieces[0]) + len(board.pieces[1]) <= \
+                self.tablebases.max_pieces:
+            result = self.tablebases.probe(board)
+            if result is not None:
+                outcome, plies = result
+                if outcome == "win":
+                    return MATE - ply - plies
+                if outcome == "loss":
+                    return -MATE + ply + plies
+                return 0
+
+        original_alpha = alpha
+        entry = self.tt.probe(board.hash)
+        tt_move = None
+        if entry:
+            tt_move, entry_depth, bound, score = entry
+            score = from_tt(score, ply)
+            self.tt_hits += 1
+            if entry_depth >= depth and ply > 0:
+                if (bound == EXACT or
+                        (bound == LOWER and score >= beta) or
+                        (bound == UPPER and score <= alpha)):
+                    return score
+        elif self.positions is not None:
+            stored = self.positions.get(board.hash)
+            if stored is not None and stored.depth:
+                tt_move = stored.move
+                if stored.depth >= depth and ply > 0:
+                    return from_tt(stored.score, ply)
+
+        side = board.turn
+        moves = board.legal_moves(side)
+        if not moves:
+            # Checkmate or stalemate. Mates found sooner score higher.
+            opponent_side = Piece.WHITE if side == Piece.BLACK else Piece.BLACK
+            if board.is_attacked(board.king[side], opponent_side):
+                return -MATE + ply
+            return 0
+        if ply == 0 and self.root_moves is not None:
+            moves = [move for move in moves if move in self.root_moves]
+
+        best_score = -INFINITY
+        best_move = None
+        for move in self.order_moves(board, moves, tt_move, ply):
+            board.make_move(move)
+            score = -self.negamax(depth - 1, -beta, -alpha, ply + 1)
+            board.unmake_move()
+
+            if score > best_score:
+                best_score = score
+                best_move = move
+                if score > alpha:
+                    alpha = score
+                    self.pv[ply] = [move] + self.pv[ply + 1]
+                    if score >= beta:
+                        if not move >> 16 & Board.MOVE_CAPTURE:
+                            # Remember quiet moves that cause cut-offs.
+                            from_to = move & 0xffff
+                            killers = self.killers[ply]
+                            if killers[0] != from_to:
+                                killers[1] = killers[0]
+                                killers[0] = from_to
+                            self.history[from_to] = \
+                                self.history.get(from_to, 0) + depth * depth
+                        break
+
+        if best_score <= original_alpha:
+            bound = UPPER
+        elif best_score >= beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        self.tt.store(board.hash, best_move, depth, bound,
+                      to_tt(best_score, ply))
+        return best_score
+
+    def search(self, board, time_limit = None, node_limit = None,
+               max_depth = None, deadline = None, callback = None,
+               root_moves = None):
+
+        """ Searches the board's position with iterative deepening until the
+        time limit (seconds), absolute deadline (time.perf_counter() value),
+        node limit or maximum depth is reached. The callback, if any, is
+        called with the SearchResult after each completed depth. If root_moves
+        is given, only those moves are searched from the position. The board
+        is left as it was. Returns the SearchResult of the last completed
+        depth. """
+
+        start = time.perf_counter()
+        self.board = board
+        self.root_moves = None if root_moves is None else set(root_moves)
+        self.nodes = 0
+        self.tt_hits = 0
+        self.node_limit = node_limit
+        self.deadline = deadline
+        if time_limit is not None:
+            limit = start + time_limit
+            self.deadline = limit if deadline is None else min(deadline, limit)
+        self.killers = [[None, None] for ply in range(MAX_PLY + 1)]
+        max_depth = MAX_PLY if max_depth is None else min(max_depth, MAX_PLY)
+
+        result = SearchResult()
+        undo_depth = len(board.undo)
+        if board.turn not in [Piece.WHITE, Piece.BLACK]:
+            return result
+
+        # Without any limit, stop after a single depth.
+        if self.deadline is None and node_limit is None and \
+                max_depth == MAX_PLY:
+            max_depth = 1
+
+        for depth in range(1, max_depth + 1):
+            try:
+                score = self.negamax(depth, -INFINITY, INFINITY, 0)
+            except SearchTimeout:
+                # Take back any moves left on the board by the aborted search.
+                while len(board.undo) > undo_depth:
+                    board.unmake_move()
+                break
+
+            result.depth = depth
+            result.score = score
+            result.pv = list(self.pv[0])
+            result.best_move = result.pv[0] if result.pv else None
+            result.nodes = self.nodes
+            result.tt_hits = self.tt_hits
+            result.seconds = time.perf_counter() - start
+            if callback:
+                callback(result)
+            if abs(score) >= MATE - MAX_PLY:
+                break
+
+        # Always have a move to play if there is one, even if not a single
+        # depth could be finished.
+        if result.best_move is None:
+            moves = [
+                move for move in board.legal_moves(board.turn)
+                if self.root_moves is None or move in self.root_moves
+            ]
+            if moves:
+                result.best_move = moves[0]
+                result.pv = [moves[0]]
+
+        result.nodes = self.nodes
+        result.tt_hits = self.tt_hits
+        result.seconds = time.perf_counter() - start
+        return result
+
+
+def search(board, time_limit = None, node_limit = None, max_depth = None,
+           deadline = None, tt_megabytes = 16):
+
+    """ Searches a board with a new Engine and returns the SearchResult """
+
+    return Engine(tt_megabytes).search(
+        board, time_limit, node_limit, max_depth, deadline)
+
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(
+        description="Search a multi-level chess position.")
+    parser.add_argument(
+        "game_file", nargs="?", default="newgame",
+        help="name of a game in saves/ or a path (default newgame)")
+    parser.add_argument(
+        "-t", "--time", type=float, default=1.0,
+        help="time limit in seconds (default 1)")
+    parser.add_argument(
+        "-n", "--nodes", type=int, default=None, help="node limit")
+    parser.add_argument(
+        "-d", "--depth", type=int, default=None, help="maximum depth")
+    parser.add_argument(
+        "--hash", type=int, default=16,
+        help="transposition table size in megabytes (default 16)")
+    parser.add_argument(
+        "--tablebases", default=None, metavar="DIR",
+        help="directory of endgame tablebases to use")
+    parser.add_argument(
+        "--mobility", action="store_true",
+        help="add the mobility term to the evaluation (slower)")
+    parser.add_argument(
+        "--positions", default=None, metavar="FILE",
+        help="position database (see mlposdb.py) of earlier results to use")
+    parser.add_argument(
+        "--store", action="store_true",
+        help="store the result in the position database")
+    parser.add_argument(
+        "--book", default=None, metavar="FILE",
+        help="opening book (see mlbook.py) to play from before searching")
+    args = parser.parse_args(argv)
+    if args.store and not args.positions:
+        parser.error("--store needs --positions")
+
+    board = mlbitboard.BitBoard.load(args.game_file)
+    if args.book:
+        move = mlbook.Book(args.book).choose(board)
+        if move is not None:
+            print("bookmove %s" % Board.move_to_str(move))
+            return
+
+    tablebases = None
+    if args.tablebases:
+        tablebases = mltablebase.Tablebases(args.tablebases)
+    positions = None
+    if args.positions and os.path.exists(args.positions):
+        positions = mlposdb.PositionDB(args.positions)
+
+    def report(result):
+        print("depth %2d score %6d nodes %9d nps %7d time %7.3f pv %s" % (
+            result.depth, result.score, result.nodes, result.nps(),
+            result.seconds,
+            " ".join(Board.move_to_str(move) for move in result.pv)))
+
+    result = Engine(args.hash, tablebases, args.mobility, positions).search(
+        board, args.time, args.nodes, args.depth, callback=report)
+    print("bestmove %s" % (Board.move_to_str(result.best_move)
+                           if result.best_move is not None else "none"))
+
+    if args.store and result.depth:
+        mlposdb.merge(args.positions, [[mlposdb.Entry(
+            mlposdb.position_key(board), result.best_move, result.score,
+            result.depth, 0, 0, 0)]])
+
+
+if __name__ == '__main__':
+    main()
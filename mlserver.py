@@ -0,0 +1,908 @@
+"""
+
+mlserver.py
+Multi-game server for multi-level chess
+Samuel Bauman 2020
+
+"""
+
+import argparse
+import asyncio
+import collections
+import os
+import random
+import socket
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import mlbitboard
+import mlprotocol
+from mlchess import Piece, Board
+
+# A headless server that hosts any number of games at once. Players connect,
+# are paired in the order they arrive, and then talk the same protocol as the
+# server mode of tmlchess.py: clients that say HELLO get the binary protocol
+# of mlprotocol.py, with the position and their side followed by 3 byte
+# moves. Older clients get the game data as hex and moves as 6 hex
+# characters. They have no way to be told their side and always play black,
+# so they are only paired with clients of the binary protocol, which then
+# play white; two old clients are never paired with each other. Every move
+# is checked against the movement masks of the game's board on the server
+# before it is relayed to the opponent, and an illegal move or a move out of
+# turn ends the game. Each game also keeps the hashes of its positions since
+# the last capture or pawn move, so the server ends a game drawn by
+# repetition or by the quiet-ply rule at the same move as the clients do.
+# Checking a move is done in an executor so a slow check never holds up the
+# other games.
+#
+# A connection that says WATCH instead of HELLO is a spectator of a game in
+# progress. Each game keeps a Broadcast of its moves: every move is encoded
+# once and the same bytes are written to all of the game's spectators, without
+# waiting for any of them, so watchers never slow down the players. A
+# spectator that joins late gets a snapshot of the position followed by the
+# moves played since it was taken. A spectator that does not keep up stops
+# being sent moves and is sent a fresh snapshot once it has caught up instead,
+# or is dropped if it does not catch up at all.
+#
+# Usage: python3 mlserver.py serve [--host 0.0.0.0] [--port 51239]
+#        python3 mlserver.py loadtest [--games 2000] [--concurrency 500]
+#        python3 mlserver.py watchtest [--games 4] [--watchers 500]
+
+DEFAULT_PORT = 51239
+
+# Length of a move in the old hex format.
+HEX_MOVE_LENGTH = 6
+
+# The number of moves kept in a game's broadcast log. Once the log is full the
+# current position becomes the snapshot sent to new spectators and the log
+# starts over, so a late spectator is sent at most this many moves to catch
+# up with.
+LOG_MOVES = 64
+
+# Bytes that may be waiting to be sent to a spectator before it is taken to
+# be falling behind, and the seconds it then has to catch up before it is
+# dropped. Past a few hundred moves a fresh position is shorter than the moves
+# it replaces anyway.
+SPECTATOR_BUFFER = 2048
+SPECTATOR_TIMEOUT = 5.0
+
+# The send buffer size asked of the system for spectator connections. By
+# default the system buffers megabytes for a connection that is not being
+# read, and the server would never find out that a spectator fell behind.
+SPECTATOR_SNDBUF = 4096
+
+
+def encode_position(board):
+
+    """ Returns the 193 byte turn + board data encoding of a board """
+
+    return bytes([board.turn.value]) + bytes(board.data)
+
+
+def apply_move(position, move, history = None):
+
+    """ Checks a move, given as the 3 bytes of a binary protocol move, against
+    the position, given as its 193 byte turn + board data encoding, and the
+    game's position history (see Board.set_history). Returns the encoding of
+    the position after the move and the history after it, or None if the move
+    is not legal. """
+
+    from_index = move[0]
+    to_index = move[1]
+    if not (Board.index_in_bounds(from_index) and
+            Board.index_in_bounds(to_index)):
+        return None
+
+    board = mlbitboard.BitBoard(bytearray(position))
+    if history:
+        board.set_history(history)
+    if board.turn not in [Piece.WHITE, Piece.BLACK] or \
+            board.is_empty(from_index) or \
+            board.get_info(from_index)["side"] != board.turn or \
+            not board.generate_move_mask(from_index)[to_index]:
+        return None
+
+    board.move_piece(Board.index_to_vector(from_index),
+                     Board.index_to_vector(to_index))
+    return encode_position(board), tuple(board.history)
+
+
+class Player:
+
+    """ One connection to the server """
+
+    def __init__(self, reader, writer):
+
+        self.reader = reader
+        self.writer = writer
+        self.paired = asyncio.get_running_loop().create_future()
+        self.binary = False
+        self.moves_received = 0
+
+    def send_start(self, position, side):
+
+        """ Sends the position and the side the player plays """
+
+        # Old clients read the game data alone and always play black.
+        if self.binary:
+            self.writer.write(mlprotocol.encode_position(position) +
+                              mlprotocol.encode_start(side.value))
+        else:
+            self.writer.write(position.hex().encode() + b"\n")
+
+    async def read_move(self):
+
+        """ Returns the 3 bytes of the player's next move, or None if the
+        player sent something that is not a move """
+
+        if not self.binary:
+            message = await self.reader.readexactly(HEX_MOVE_LENGTH)
+            try:
+                return bytes.fromhex(message.decode("ascii"))
+            except ValueError:
+                return None
+
+        while True:
+            kind, payload = await mlprotocol.read_frame(self.reader)
+            if kind == mlprotocol.MOVE:
+                self.moves_received += 1
+                return payload
+            if kind not in [mlprotocol.ACK, mlprotocol.HEARTBEAT]:
+                return None
+
+    def send_ack(self):
+
+        """ Acknowledges the moves received from the player so far """
+
+        if self.binary:
+            self.writer.write(mlprotocol.encode_ack(self.moves_received))
+
+    def send_move(self, move):
+
+        """ Sends a move of the opponent """
+
+        if self.binary:
+            self.writer.write(mlprotocol.encode_frame(mlprotocol.MOVE, move))
+        else:
+            self.writer.write(move.hex().encode())
+
+
+class Spectator:
+
+    """ A connection watching a game """
+
+    def __init__(self, reader, writer):
+
+        self.reader = reader
+        self.writer = writer
+        # Set when the spectator stops watching: at the end of the game or
+        # when it is dropped.
+        self.done = asyncio.get_running_loop().create_future()
+        # The task waiting for a spectator that fell behind to catch up.
+        self.catching_up = None
+
+    def send(self, data, broadcast):
+
+        """ Writes data without waiting for it to be sent. A spectator with
+        too much data still waiting is not sent any more until it has caught
+        up. """
+
+        if self.catching_up is not None:
+            return
+        if self.writer.transport.get_write_buffer_size() > SPECTATOR_BUFFER:
+            self.catching_up = asyncio.ensure_future(
+                self.catch_up(broadcast))
+            return
+        self.writer.write(data)
+
+    async def catch_up(self, broadcast):
+
+        """ Waits for the data already written to be sent, then sends the
+        current position in place of the moves that were skipped """
+
+        try:
+            await asyncio.wait_for(self.writer.drain(), SPECTATOR_TIMEOUT)
+        except (asyncio.TimeoutError, ConnectionError):
+            broadcast.drop(self)
+            return
+        self.catching_up = None
+        if not self.done.done():
+            broadcast.spectators_coalesced += 1
+            self.writer.write(broadcast.current())
+
+    def stop(self):
+
+        if self.catching_up is not None:
+            self.catching_up.cancel()
+        if not self.done.done():
+            self.done.set_result(None)
+
+
+class Broadcast:
+
+    """ Streams the moves of one game to its spectators """
+
+    def __init__(self, position, log_moves = LOG_MOVES):
+
+        # snapshot is the position after the first snapshot_moves moves,
+        # and log holds the encoded moves played since then.
+        self.snapshot = position
+        self.snapshot_moves = 0
+        self.log = []
+        self.log_moves = log_moves
+        self.position = position
+        self.moves = 0
+        self.spectators = set()
+        self.spectators_coalesced = 0
+        self.spectators_dropped = 0
+
+    def current(self):
+
+        """ Returns the frames that start a spectator off at the current
+        position """
+
+        return mlprotocol.encode_position(self.position) + \
+            mlprotocol.encode_ack(self.moves)
+
+    def add(self, spectator):
+
+        """ Starts a spectator off with the snapshot and the moves since """
+
+        spectator.writer.write(
+            mlprotocol.encode_position(self.snapshot) +
+            mlprotocol.encode_ack(self.snapshot_moves) + b"".join(self.log))
+        self.spectators.add(spectator)
+
+    def remove(self, spectator):
+
+        self.spectators.discard(spectator)
+        spectator.stop()
+
+    def drop(self, spectator):
+
+        """ Removes a spectator that does not keep up and closes it """
+
+        if spectator in self.spectators:
+            self.spectators_dropped += 1
+        self.remove(spectator)
+        spectator.writer.close()
+
+    def publish(self, move, position):
+
+        """ Sends a move to every spectator. position is the position after
+        the move. """
+
+        frame = mlprotocol.encode_frame(mlprotocol.MOVE, move)
+        self.position = position
+        self.moves += 1
+        if len(self.log) < self.log_moves:
+            self.log.append(frame)
+        else:
+            self.snapshot = position
+            self.snapshot_moves = self.moves
+            self.log = []
+        for spectator in list(self.spectators):
+            spectator.send(frame, self)
+
+    def close(self):
+
+        """ Ends the broadcast; the data written so far is still sent, and
+        spectators that fell behind are sent the final position """
+
+        for spectator in list(self.spectators):
+            if spectator.catching_up is not None:
+                self.spectators_coalesced += 1
+                spectator.writer.write(self.current())
+            self.remove(spectator)
+
+
+class Game:
+
+    """ A game between two paired players """
+
+    def __init__(self, number, position, white, black):
+
+        self.number = number
+        self.position = position
+        # The hashes of the positions since the last capture or pawn move,
+        # which the draw rules are applied to; None at the start.
+        self.history = None
+        self.players = {Piece.WHITE: white, Piece.BLACK: black}
+        self.moves = 0
+        self.done = asyncio.get_running_loop().create_future()
+        self.broadcast = Broadcast(position)
+
+    def turn(self):
+
+        return Piece(self.position[0])
+
+
+class GameServer:
+
+    """ Pairs connecting players into games and relays their moves """
+
+    def __init__(self, game_hex_data, executor = None,
+                 hello_wait = mlprotocol.SERVER_WAIT):
+
+        # executor is used to check moves; None checks them on the event loop
+        # itself, which is faster when there are few games. hello_wait is how
+        # long a new connection has to say HELLO before it is taken to be an
+        # old hex format client.
+        self.position = bytes(bytearray.fromhex(game_hex_data.strip()))
+        self.executor = executor
+        self.hello_wait = hello_wait
+        # The binary protocol player waiting for an opponent, and the old
+        # hex format players waiting for a binary protocol opponent.
+        self.waiting = None
+        self.waiting_hex = collections.deque()
+        # The games being played, by number.
+        self.playing = {}
+        self.games = 0
+        self.active = 0
+        self.moves = 0
+        self.rejected = 0
+        self.spectators_coalesced = 0
+        self.spectators_dropped = 0
+
+    async def start(self, host = "0.0.0.0", port = DEFAULT_PORT):
+
+        """ Starts listening and returns the asyncio server """
+
+        return await asyncio.start_server(
+            self.handle, host, port, backlog=4096)
+
+    async def handle(self, reader, writer):
+
+        """ Handles one connection from start to end """
+
+        player = Player(reader, writer)
+        try:
+            # A client that says nothing is taken to speak the old hex
+            # format.
+            try:
+                kind, payload = await asyncio.wait_for(
+                    mlprotocol.read_frame(reader), self.hello_wait)
+            except asyncio.TimeoutError:
+                kind = None
+            if kind == mlprotocol.WATCH:
+                await self.watch(reader, writer,
+                                 mlprotocol.decode_watch(payload))
+                return
+            if kind not in [None, mlprotocol.HELLO]:
+                raise mlprotocol.ProtocolError(
+                    "expected HELLO, got message type %d" % kind)
+            player.binary = kind == mlprotocol.HELLO
+
+            # Waiting players that have gone away are forgotten instead of
+            # being paired.
+            if self.waiting is not None and \
+                    self.waiting.reader.at_eof():
+                self.waiting.paired.cancel()
+                self.waiting = None
+            for waiting in [waiting for waiting in self.waiting_hex
+                            if waiting.reader.at_eof()]:
+                waiting.paired.cancel()
+                self.waiting_hex.remove(waiting)
+
+            # The first of two binary protocol players plays white, and an
+            # old hex format player always plays black.
+            white = black = None
+            if player.binary and self.waiting_hex:
+                white, black = player, self.waiting_hex.popleft()
+            elif self.waiting is not None:
+                white, black = self.waiting, player
+                self.waiting = None
+
+            if white is None:
+                # Wait for an opponent; they will run the game.
+                if player.binary:
+                    self.waiting = player
+                else:
+                    self.waiting_hex.append(player)
+                game = await player.paired
+                await game.done
+            else:
+                self.games += 1
+                game = Game(self.games, self.position, white, black)
+                (black if white is player else white).paired.set_result(game)
+                await self.play(game)
+        except (ConnectionError, asyncio.IncompleteReadError,
+                asyncio.CancelledError, mlprotocol.ProtocolError):
+            pass
+        finally:
+            if self.waiting is player:
+                self.waiting = None
+            if player in self.waiting_hex:
+                self.waiting_hex.remove(player)
+            writer.close()
+
+    async def watch(self, reader, writer, number):
+
+        """ Streams a game to a spectator until the game ends, the spectator
+        leaves or it is dropped. Number 0 is the newest game. """
+
+        if number == 0 and self.playing:
+            number = max(self.playing)
+        game = self.playing.get(number)
+        if game is None:
+            return
+
+        sock = writer.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF,
+                            SPECTATOR_SNDBUF)
+        # Waiting for the writer to drain then waits for everything written
+        # to be sent rather than only until the buffer is under a limit.
+        writer.transport.set_write_buffer_limits(SPECTATOR_BUFFER, 0)
+        spectator = Spectator(reader, writer)
+        game.broadcast.add(spectator)
+        # Anything a spectator sends is ignored; reading it only notices
+        # when the spectator goes away.
+        async def read_until_closed():
+            while await reader.read(4096):
+                pass
+        reading = asyncio.ensure_future(read_until_closed())
+        try:
+            await asyncio.wait([spectator.done, reading],
+                               return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            reading.cancel()
+            game.broadcast.remove(spectator)
+
+    async def play(self, game):
+
+        """ Runs a game until it ends or a player leaves """
+
+        loop = asyncio.get_running_loop()
+        self.active += 1
+        self.playing[game.number] = game
+        try:
+            for side in game.players:
+                game.players[side].send_start(game.position, side)
+
+            while game.turn() in [Piece.WHITE, Piece.BLACK]:
+                turn = game.turn()
+                player = game.players[turn]
+                opponent = game.players[
+                    Piece.BLACK if turn == Piece.WHITE else Piece.WHITE]
+
+                move = await player.read_move()
+                if move is None:
+                    result = None
+                elif self.executor is None:
+                    result = apply_move(game.position, move, game.history)
+                else:
+                    result = await loop.run_in_executor(
+                        self.executor, apply_move, game.position, move,
+                        game.history)
+                if result is None:
+                    self.rejected += 1
+                    break
+
+                position, game.history = result
+                game.position = position
+                game.moves += 1
+                self.moves += 1
+                player.send_ack()
+                opponent.send_move(move)
+                game.broadcast.publish(move, position)
+                await opponent.writer.drain()
+        finally:
+            self.active -= 1
+            del self.playing[game.number]
+            game.broadcast.close()
+            self.spectators_coalesced += game.broadcast.spectators_coalesced
+            self.spectators_dropped += game.broadcast.spectators_dropped
+            if not game.done.done():
+                game.done.set_result(game)
+            for side in game.players:
+                game.players[side].writer.close()
+
+
+def record_game(game_hex_data, plies, seed):
+
+    """ Plays random legal moves from the game data and returns them as the
+    list of 3 byte moves a client would send """
+
+    rng = random.Random(seed)
+    board = mlbitboard.BitBoard(bytearray.fromhex(game_hex_data.strip()))
+    messages = []
+    for ply in range(plies):
+        if board.turn not in [Piece.WHITE, Piece.BLACK]:
+            break
+        moves = board.legal_moves(board.turn)
+        if not moves:
+            break
+        from_index, to_index = Board.unpack_move(rng.choice(moves))[:2]
+        piece = Board.moved_piece(board.data[from_index])
+        board.move_piece(Board.index_to_vector(from_index),
+                         Board.index_to_vector(to_index))
+        messages.append(bytes([from_index, to_index, piece]))
+    return messages
+
+
+async def read_move(reader):
+
+    """ Reads frames from a simulated player's connection until a move """
+
+    while True:
+        kind, payload = await mlprotocol.read_frame(reader)
+        if kind == mlprotocol.MOVE:
+            return payload
+
+
+async def simulated_game(host, port, script, latencies, connecting,
+                         move_delay = 0.0, sent = None):
+
+    """ Connects two players and plays the script through the server, adding
+    the time each move took to reach the opponent to latencies. connecting is
+    a lock held until both players have started, so the server pairs the two
+    players with each other. move_delay is the time between moves, and the
+    time each move is sent at is added to sent if it is given. """
+
+    players = []
+    async with connecting:
+        for player in range(2):
+            reader, writer = await asyncio.open_connection(host, port)
+            writer.write(mlprotocol.encode_hello())
+            players.append((reader, writer))
+        # The server says which side each connection plays.
+        for reader, writer in list(players):
+            side = None
+            while side is None:
+                kind, payload = await mlprotocol.read_frame(reader)
+                if kind == mlprotocol.START:
+                    side = payload[0]
+            if side == Piece.BLACK.value:
+                players.remove((reader, writer))
+                players.append((reader, writer))
+
+    try:
+        moves_received = [0, 0]
+        for ply, move in enumerate(script):
+            sender = players[ply % 2][1]
+            receiver, receiver_writer = players[1 - ply % 2]
+            start = time.perf_counter()
+            if sent is not None:
+                sent.append(start)
+            sender.write(mlprotocol.encode_frame(mlprotocol.MOVE, move))
+            await read_move(receiver)
+            latencies.append(time.perf_counter() - start)
+            moves_received[1 - ply % 2] += 1
+            receiver_writer.write(
+                mlprotocol.encode_ack(moves_received[1 - ply % 2]))
+            if move_delay:
+                await asyncio.sleep(move_delay)
+    finally:
+        for reader, writer in players:
+            writer.close()
+
+
+async def load_test(host, port, games, concurrency, plies, game_hex_data):
+
+    """ Plays the given number of simulated games against a server, at most
+    concurrency at a time, and returns a dictionary of the results """
+
+    # A handful of recorded games are replayed over and over, so the load
+    # test itself spends no time choosing moves.
+    scripts = [record_game(game_hex_data, plies, seed) for seed in range(8)]
+    latencies = []
+    limit = asyncio.Semaphore(concurrency)
+    connecting = asyncio.Lock()
+    failed = 0
+
+    async def run(number):
+        nonlocal failed
+        async with limit:
+            try:
+                await simulated_game(
+                    host, port, scripts[number % len(scripts)], latencies,
+                    connecting)
+            except (ConnectionError, asyncio.IncompleteReadError, OSError,
+                    mlprotocol.ProtocolError):
+                failed += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run(number) for number in range(games)))
+    seconds = time.perf_counter() - start
+
+    results = {
+        "games": games,
+        "failed": failed,
+        "moves": len(latencies),
+        "seconds": round(seconds, 6),
+        "moves_per_second": int(len(latencies) / seconds) if seconds else 0
+    }
+    results.update(percentiles(latencies))
+    return results
+
+
+def percentiles(latencies, prefix = ""):
+
+    """ Returns the p50, p99 and max of a list of seconds in milliseconds """
+
+    latencies = sorted(latencies)
+    def percentile(p):
+        if not latencies:
+            return 0.0
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+    return {
+        prefix + "p50_ms": round(percentile(0.50) * 1000, 3),
+        prefix + "p99_ms": round(percentile(0.99) * 1000, 3),
+        prefix + "max_ms": round(percentile(1.0) * 1000, 3)
+    }
+
+
+async def simulated_watcher(host, port, number, sent, latencies, delay,
+                            stall):
+
+    """ Watches a game after waiting delay seconds and returns the number of
+    moves and positions received. The time each move played after joining
+    took to arrive after its player sent it is added to latencies. A slow
+    watcher, with a stall of more than 0, reads nothing for that many seconds
+    after joining. """
+
+    await asyncio.sleep(delay)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    if stall:
+        # The smallest receive buffer the system allows, so the server soon
+        # has to hold back what it sends.
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1)
+    sock.setblocking(False)
+    await asyncio.get_running_loop().sock_connect(sock, (host, port))
+    reader, writer = await asyncio.open_connection(sock=sock)
+    joined = time.perf_counter()
+    writer.write(mlprotocol.encode_watch(number))
+    if stall:
+        # The stream would otherwise go on reading into its own buffer.
+        writer.transport.pause_reading()
+        await asyncio.sleep(stall)
+        writer.transport.resume_reading()
+
+    moves = 0
+    positions = 0
+    ply = None
+    try:
+        while True:
+            kind, payload = await mlprotocol.read_frame(reader)
+            if kind == mlprotocol.POSITION:
+                positions += 1
+            elif kind == mlprotocol.ACK:
+                ply = mlprotocol.decode_ack(payload)
+            elif kind == mlprotocol.MOVE:
+                if not stall and sent[ply] > joined:
+                    latencies.append(time.perf_counter() - sent[ply])
+                moves += 1
+                ply += 1
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+    return moves, positions
+
+
+async def watch_test(games, watchers, late, slow, stall, plies, move_delay,
+                     game_hex_data):
+
+    """ Plays the given number of simulated games on a server started in this
+    process while watchers watch them, and returns a dictionary of the
+    results. late and slow are the fractions of watchers that join after the
+    game has started and that stop reading for stall seconds. """
+
+    server = GameServer(game_hex_data)
+    listener = await server.start("127.0.0.1", 0)
+    host, port = "127.0.0.1", listener.sockets[0].getsockname()[1]
+
+    rng = random.Random(0)
+    scripts = [record_game(game_hex_data, plies, seed) for seed in range(8)]
+    connecting = asyncio.Lock()
+    latencies = []
+    watch_latencies = []
+    sent = {}
+
+    # The lock pairs the players of each game in turn, so the server numbers
+    # the games in the order they are started here.
+    playing = []
+    for number in range(1, games + 1):
+        sent[number] = []
+        playing.append(asyncio.ensure_future(simulated_game(
+            host, port, scripts[number % len(scripts)], latencies,
+            connecting, move_delay, sent[number])))
+    while server.games < games:
+        await asyncio.sleep(0.001)
+
+    start = time.perf_counter()
+    length = min(len(script) for script in scripts) * move_delay
+    watching = [asyncio.ensure_future(simulated_watcher(
+        host, port, 1 + watcher % games, sent[1 + watcher % games],
+        watch_latencies,
+        rng.random() * length if rng.random() < late else 0.0,
+        stall if rng.random() < slow else 0.0))
+        for watcher in range(watchers)]
+
+    try:
+        await asyncio.gather(*playing)
+        received = await asyncio.gather(*watching)
+        seconds = time.perf_counter() - start
+    finally:
+        listener.close()
+        await listener.wait_closed()
+
+    results = {
+        "games": games,
+        "watchers": watchers,
+        "moves": len(latencies),
+        "seconds": round(seconds, 6),
+        "moves_sent_to_watchers": sum(moves for moves, positions in received),
+        "positions_sent_to_watchers": sum(
+            positions for moves, positions in received),
+        "watchers_coalesced": server.spectators_coalesced,
+        "watchers_dropped": server.spectators_dropped
+    }
+    results.update(percentiles(latencies))
+    results.update(percentiles(watch_latencies, "watch_"))
+    return results
+
+
+def make_executor(kind, workers):
+
+    """ Returns the executor used to check moves, or None """
+
+    # With a single CPU the worker processes only add overhead.
+    if kind == "auto":
+        kind = "process" if (os.cpu_count() or 1) > 1 else "inline"
+    if kind == "process":
+        return ProcessPoolExecutor(max_workers=workers)
+    return None
+
+
+def read_game(game_file):
+
+    """ Reads the hex game data of a game file name in saves/ or a path """
+
+    path = game_file
+    if "/" not in path and not path.endswith(".txt"):
+        path = "saves/" + path + ".txt"
+    with open(path, "r") as file:
+        return file.read().strip()
+
+
+async def serve(args):
+
+    server = GameServer(read_game(args.game_file),
+                        make_executor(args.executor, args.workers))
+    listener = await server.start(args.host, args.port)
+    print("listening on %s:%d" % (args.host, args.port), flush=True)
+    async with listener:
+        await listener.serve_forever()
+
+
+async def run_load_test(args):
+
+    game_hex_data = read_game(args.game_file)
+    listener = None
+    executor = None
+    if args.connect is None:
+        # Without a server to connect to, one is started in this process.
+        executor = make_executor(args.executor, args.workers)
+        server = GameServer(game_hex_data, executor)
+        listener = await server.start("127.0.0.1", 0)
+        host, port = "127.0.0.1", listener.sockets[0].getsockname()[1]
+    else:
+        host, port = args.connect.rsplit(":", 1)
+        port = int(port)
+
+    try:
+        results = await load_test(host, port, args.games, args.concurrency,
+                                  args.plies, game_hex_data)
+    finally:
+        if listener is not None:
+            listener.close()
+            await listener.wait_closed()
+        if executor is not None:
+            executor.shutdown()
+
+    print("%d games (%d failed), %d moves in %.3f s: %d moves/s, "
+          "relay latency p50 %.3f ms p99 %.3f ms max %.3f ms" % (
+              results["games"], results["failed"], results["moves"],
+              results["seconds"], results["moves_per_second"],
+              results["p50_ms"], results["p99_ms"], results["max_ms"]))
+    return results
+
+
+async def run_watch_test(args):
+
+    results = await watch_test(args.games, args.watchers, args.late,
+                               args.slow, args.stall, args.plies, args.move_delay,
+                               read_game(args.game_file))
+
+    print("%d games, %d moves in %.3f s: relay latency p50 %.3f ms "
+          "p99 %.3f ms max %.3f ms" % (
+              results["games"], results["moves"], results["seconds"],
+              results["p50_ms"], results["p99_ms"], results["max_ms"]))
+    print("%d watchers: %d moves and %d positions sent, latency p50 %.3f ms "
+          "p99 %.3f ms max %.3f ms, %d coalesced, %d dropped" % (
+              results["watchers"], results["moves_sent_to_watchers"],
+              results["positions_sent_to_watchers"],
+              results["watch_p50_ms"], results["watch_p99_ms"],
+              results["watch_max_ms"], results["watchers_coalesced"],
+              results["watchers_dropped"]))
+    return results
+
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(
+        description="Multi-game server for multi-level chess.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = commands.add_parser("serve", help="run the server")
+    serve_parser.add_argument("--host", default="0.0.0.0")
+    serve_parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+
+    load_parser = commands.add_parser(
+        "loadtest", help="measure a server with simulated games")
+    load_parser.add_argument(
+        "--connect", default=None, metavar="HOST:PORT",
+        help="server to test (default: start one in this process)")
+    load_parser.add_argument(
+        "--games", type=int, default=2000,
+        help="number of games to play (default 2000)")
+    load_parser.add_argument(
+        "--concurrency", type=int, default=500,
+        help="number of games played at once (default 500)")
+    load_parser.add_argument(
+        "--plies", type=int, default=40,
+        help="number of moves per game (default 40)")
+
+    watch_parser = commands.add_parser(
+        "watchtest", help="measure spectators watching simulated games")
+    watch_parser.add_argument(
+        "--games", type=int, default=4,
+        help="number of games to play (default 4)")
+    watch_parser.add_argument(
+        "--watchers", type=int, default=500,
+        help="number of spectators, spread over the games (default 500)")
+    watch_parser.add_argument(
+        "--late", type=float, default=0.5,
+        help="fraction of spectators that join during the game (default 0.5)")
+    watch_parser.add_argument(
+        "--slow", type=float, default=0.1,
+        help="fraction of spectators that stop reading (default 0.1)")
+    watch_parser.add_argument(
+        "--stall", type=float, default=8.0,
+        help="seconds slow spectators do not read for (default 8.0)")
+    watch_parser.add_argument(
+        "--plies", type=int, default=1000,
+        help="number of moves per game (default 1000)")
+    watch_parser.add_argument(
+        "--move-delay", type=float, default=0.002,
+        help="seconds between the moves of a game (default 0.002)")
+
+    for command_parser in [serve_parser, load_parser]:
+        command_parser.add_argument(
+            "--executor", choices=["auto", "process", "inline"],
+            default="auto",
+            help="where moves are checked: worker processes, the event loop, "
+                 "or processes if there is more than one CPU (default auto)")
+        command_parser.add_argument(
+            "--workers", type=int, default=os.cpu_count(),
+            help="number of processes checking moves")
+
+    for command_parser in [serve_parser, load_parser, watch_parser]:
+        command_parser.add_argument(
+            "--game-file", default="newgame",
+            help="name of a game in saves/ or a path (default newgame)")
+
+    args = parser.parse_args(argv)
+    if args.command == "serve":
+        asyncio.run(serve(args))
+    elif args.command == "loadtest":
+        asyncio.run(run_load_test(args))
+    else:
+        asyncio.run(run_watch_test(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,273 @@
+"""
+
+mlstats.py
+Opt-in instrumentation of the multi-level chess rules engine
+Samuel Bauman 2020
+
+"""
+
+import atexit
+import json
+import time
+
+import mlbitboard
+import mlpiece
+from mlchess import Board
+
+# Counts the calls of the rules engine's methods and adds up the time spent in
+# them, to find out which part of the rules a slow frame or a slow move was
+# spent in. Nothing is measured until enable is called: it replaces the
+# methods of Board and BitBoard with timing wrappers, and disable puts the
+# original methods back, so a game that never enables the instrumentation
+# runs exactly the same code as without this module.
+#
+# Times include the time of everything called inside: the time of
+# move_results_in_check is also part of the check filter phase of the mask
+# that called it.
+#
+# Recorded names:
+#   generate_move_mask          every movement mask generated
+#   generate_move_mask.<rank>   the masks of one rank, e.g. .knight
+#   generate_move_mask.pseudo   finding the squares the piece can reach
+#   generate_move_mask.filter   removing the moves that leave the king in check
+#   move_results_in_check, decode_piece, checkmate_scan, draw_scan,
+#   select_piece
+# and the counts select_piece.hit and select_piece.miss of selections that
+# found their mask already generated or had to generate it.
+#
+# Usage: mlstats.enable("stats.json") and the stats are written to the file
+# when the program exits; mlstats.snapshot() returns them at any time.
+
+RANK_NAMES = {
+    mlpiece.KING: "king",
+    mlpiece.QUEEN: "queen",
+    mlpiece.ROOK: "rook",
+    mlpiece.KNIGHT: "knight",
+    mlpiece.BISHOP: "bishop",
+    mlpiece.PAWN: "pawn"
+}
+
+# [calls, seconds, longest call in seconds] by name.
+timers = {}
+# Event counts by name.
+counts = {}
+
+# The (class, name, attribute) of every method replaced by enable.
+originals = []
+
+# The number of movement masks being generated, so the phase methods, which
+# are also used by move generation for the search, only count towards the
+# phases of a mask.
+mask_depth = 0
+
+clock = time.perf_counter
+
+
+def record(name, seconds):
+
+    """ Adds a call of the given length to a timer """
+
+    timer = timers.get(name)
+    if timer is None:
+        timers[name] = [1, seconds, seconds]
+    else:
+        timer[0] += 1
+        timer[1] += seconds
+        if seconds > timer[2]:
+            timer[2] = seconds
+
+
+def count(name):
+
+    """ Adds one to a count """
+
+    counts[name] = counts.get(name, 0) + 1
+
+
+def timed(name, function):
+
+    """ Returns a wrapper of function that times it under the given name """
+
+    def wrapper(*args, **kwargs):
+        start = clock()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            record(name, clock() - start)
+    return wrapper
+
+
+def timed_mask(function):
+
+    """ Returns a wrapper of generate_move_mask that times it in total and by
+    the rank of the piece """
+
+    def wrapper(self, index, test_piece = None):
+        global mask_depth
+        piece = self.data[index] if test_piece is None else test_piece
+        mask_depth += 1
+        start = clock()
+        try:
+            return function(self, index, test_piece)
+        finally:
+            seconds = clock() - start
+            mask_depth -= 1
+            record("generate_move_mask", seconds)
+            record("generate_move_mask." +
+                   RANK_NAMES.get(mlpiece.RANK[piece], "none"), seconds)
+    return wrapper
+
+
+def timed_phase(phase, function):
+
+    """ Returns a wrapper of a method that times it as a phase of movement
+    mask generation when it is called while generating a mask """
+
+    name = "generate_move_mask." + phase
+
+    def wrapper(*args, **kwargs):
+        if not mask_depth:
+            return function(*args, **kwargs)
+        start = clock()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            record(name, clock() - start)
+    return wrapper
+
+
+def counted_select(function):
+
+    """ Returns a wrapper of select_piece that counts whether the mask it
+    selects was already generated """
+
+    def wrapper(self, index):
+        if self.data[index] != mlpiece.EMPTY:
+            count("select_piece.hit" if index in self.masks
+                  else "select_piece.miss")
+        start = clock()
+        try:
+            return function(self, index)
+        finally:
+            record("select_piece", clock() - start)
+    return wrapper
+
+
+# The wrapper of every instrumented method by name. Each class only has the
+# methods it defines itself replaced, so a subclass that overrides a method
+# is measured with its own version.
+WRAPPERS = {
+    "generate_move_mask": timed_mask,
+    "move_targets": lambda function: timed_phase("pseudo", function),
+    "pseudo_move_bits": lambda function: timed_phase("pseudo", function),
+    "filter_targets": lambda function: timed_phase("filter", function),
+    "filter_move_bits": lambda function: timed_phase("filter", function),
+    "move_results_in_check":
+        lambda function: timed("move_results_in_check", function),
+    "decode_piece": lambda function: timed("decode_piece", function),
+    "update_checkmate": lambda function: timed("checkmate_scan", function),
+    "update_draw": lambda function: timed("draw_scan", function),
+    "select_piece": counted_select
+}
+
+CLASSES = [Board, mlbitboard.BitBoard]
+
+
+def is_enabled():
+
+    return bool(originals)
+
+
+def enable(dump_path = None):
+
+    """ Starts measuring. If dump_path is given, the stats are written to it
+    as JSON when the program exits. """
+
+    if not originals:
+        for cls in CLASSES:
+            for name, wrap in WRAPPERS.items():
+                if name not in cls.__dict__:
+                    continue
+                attribute = cls.__dict__[name]
+                originals.append((cls, name, attribute))
+                if isinstance(attribute, staticmethod):
+                    setattr(cls, name,
+                            staticmethod(wrap(attribute.__func__)))
+                else:
+                    setattr(cls, name, wrap(attribute))
+    if dump_path is not None:
+        atexit.register(dump, dump_path)
+
+
+def disable():
+
+    """ Stops measuring and puts the original methods back. The stats so far
+    are kept. """
+
+    while originals:
+        cls, name, attribute = originals.pop()
+        setattr(cls, name, attribute)
+
+
+def reset():
+
+    """ Clears the stats """
+
+    timers.clear()
+    counts.clear()
+
+
+def snapshot():
+
+    """ Returns the stats so far as a dictionary """
+
+    return {
+        "enabled": is_enabled(),
+        "timers": {
+            name: {
+                "calls": calls,
+                "seconds": round(seconds, 6),
+                "mean_us": round(seconds * 1e6 / calls, 3),
+                "max_us": round(longest * 1e6, 3)
+            }
+            for name, (calls, seconds, longest) in sorted(timers.items())
+        },
+        "counts": dict(sorted(counts.items()))
+    }
+
+
+def dump(path):
+
+    """ Writes a snapshot of the stats to a file as JSON """
+
+    with open(path, "w") as file:
+        json.dump(snapshot(), file, indent=2)
+        file.write("\n")
+
+
+class PeriodicLog:
+
+    """ Appends a snapshot of the stats to a file as a JSON line at most once
+    every interval seconds """
+
+    def __init__(self, path, interval = 10.0):
+
+        self.path = path
+        self.interval = interval
+        self.last = clock()
+
+    def tick(self):
+
+        """ Writes a line if the interval has passed since the last one """
+
+        now = clock()
+        if now - self.last >= self.interval:
+            self.last = now
+            self.write()
+
+    def write(self):
+
+        line = snapshot()
+        line["time"] = round(time.time(), 3)
+        with open(self.path, "a") as file:
+            file.write(json.dumps(line) + "\n")
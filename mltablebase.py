@@ -0,0 +1,771 @@
+"""
+
+mltablebase.py
+Endgame tablebases for multi-level chess
+Samuel Bauman 2020
+
+"""
+
+import argparse
+import mmap
+import os
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import mlbitboard
+import mlpiece
+from mlchess import Piece, Board
+
+# A tablebase holds the result with perfect play of every position of a small
+# set of pieces, e.g. king and queen against king ("KQvK"): whether the side
+# to move wins, draws or loses, and in how many plies the game ends in mate.
+# It is generated by retrograde analysis with the movement rules of Board:
+# the mates are found first, then the positions one move away from a mate,
+# and so on backwards, until no more positions can be resolved. Whatever is
+# left over is a draw.
+#
+# Without pawns the rules look the same after flipping the board left to
+# right, front to back or top to bottom, and after swapping the x and y axes,
+# so every position has up to 16 mirror images with the same result. Only one
+# of them is stored: the white king is always moved into one of 20 squares
+# (x <= 3, y <= x, z <= 1) and the position is numbered by the squares of the
+# pieces from there. Numbers that are not the lowest of any of a position's
+# mirror images are never used. Castling, pawns and promotion are left out.
+#
+# The file is a header followed by one byte per position number with white
+# to move, then one byte per position number with black to move. The probe
+# maps the file instead of reading it, so only the pages actually probed are
+# ever loaded.
+#
+# Usage: python3 mltablebase.py generate KQvK [-w workers] [--dir tablebases]
+#        python3 mltablebase.py probe [game file] [--dir tablebases]
+#        python3 mltablebase.py stats KQvK [--dir tablebases]
+
+MAGIC = b"MLTB"
+VERSION = 1
+# Magic, version, material and positions per side to move.
+HEADER = struct.Struct(">4sB3x16sI")
+
+DIRECTORY = "tablebases"
+EXTENSION = ".mltb"
+
+# Values of the result byte: 0 is a draw, 1 to 127 a win in that many plies
+# and 128 + n a loss in n plies. ILLEGAL marks position numbers that are not
+# used.
+DRAW = 0
+LOSS = 128
+ILLEGAL = 255
+MAX_PLIES = 126
+
+# Only used while generating, for positions not resolved yet.
+UNKNOWN = 254
+
+LETTERS = {
+    "K": mlpiece.KING,
+    "Q": mlpiece.QUEEN,
+    "R": mlpiece.ROOK,
+    "B": mlpiece.BISHOP,
+    "N": mlpiece.KNIGHT
+}
+RANK_LETTERS = {rank: letter for letter, rank in LETTERS.items()}
+ORDER = "QRBN"
+
+SQUARES = 192
+
+
+def symmetry_tables():
+
+    """ Returns the 16 mirror images of the board as tuples mapping every
+    square to its image """
+
+    tables = []
+    for swap in [False, True]:
+        for flip_x in [False, True]:
+            for flip_y in [False, True]:
+                for flip_z in [False, True]:
+                    table = []
+                    for index in range(SQUARES):
+                        x, y, z = Board.index_to_vector(index)
+                        if swap:
+                            x, y = y, x
+                        if flip_x:
+                            x = 7 - x
+                        if flip_y:
+                            y = 7 - y
+                        if flip_z:
+                            z = 2 - z
+                        table.append(Board.vector_to_index([x, y, z]))
+                    tables.append(tuple(table))
+    return tables
+
+SYMMETRIES = symmetry_tables()
+
+# The squares the white king is moved into, and the number of each.
+KING_SQUARES = tuple(
+    Board.vector_to_index([x, y, z])
+    for z in range(2) for x in range(4) for y in range(x + 1)
+)
+KING_REGION = {square: i for i, square in enumerate(KING_SQUARES)}
+
+# The mirror images that move a white king on each square into the region.
+KING_SYMMETRIES = tuple(
+    tuple(table for table in SYMMETRIES if table[square] in KING_REGION)
+    for square in range(SQUARES)
+)
+
+
+def parse_material(material):
+
+    """ Returns the ranks of the white and the black pieces of a material
+    string such as "KRBvKR", kings first """
+
+    try:
+        white, black = material.upper().split("V")
+        sides = [[LETTERS[letter] for letter in side] for side in
+                 [white, black]]
+    except (ValueError, KeyError):
+        raise ValueError("%s is not a material string like KQvK" % material)
+    for ranks in sides:
+        if ranks.count(mlpiece.KING) != 1 or ranks[0] != mlpiece.KING:
+            raise ValueError("%s must have one king per side, given first"
+                             % material)
+    return sides
+
+
+def material_string(white, black):
+
+    """ Returns the material string of lists of white and black ranks """
+
+    def side(ranks):
+        others = sorted((rank for rank in ranks if rank != mlpiece.KING),
+                        key=lambda rank: ORDER.index(RANK_LETTERS[rank]))
+        return "K" + "".join(RANK_LETTERS[rank] for rank in others)
+    return side(white) + "v" + side(black)
+
+
+def encode_value(result, plies):
+
+    if result == "draw":
+        return DRAW
+    return plies if result == "win" else LOSS + plies
+
+
+def decode_value(value):
+
+    """ Returns the (result, plies) of a result byte, or None for a position
+    number that is not used """
+
+    if value == ILLEGAL or value == UNKNOWN:
+        return None
+    if value == DRAW:
+        return ("draw", 0)
+    if value < LOSS:
+        return ("win", value)
+    return ("loss", value - LOSS)
+
+
+class Material:
+
+    """ The piece set of a tablebase and the numbering of its positions """
+
+    def __init__(self, material):
+
+        white, black = parse_material(material)
+        self.name = material_string(white, black)
+        white, black = parse_material(self.name)
+
+        # Pieces are listed white king, black king, then the other white
+        # pieces and the other black pieces, each by rank.
+        self.pieces = (
+            [mlpiece.encode(mlpiece.WHITE, mlpiece.KING, mlpiece.NORMAL),
+             mlpiece.encode(mlpiece.BLACK, mlpiece.KING, mlpiece.NORMAL)] +
+            [mlpiece.encode(mlpiece.WHITE, rank, mlpiece.NORMAL)
+             for rank in white[1:]] +
+            [mlpiece.encode(mlpiece.BLACK, rank, mlpiece.NORMAL)
+             for rank in black[1:]]
+        )
+        self.count = len(self.pieces)
+        self.size = len(KING_SQUARES) * SQUARES ** (self.count - 1)
+
+        # Runs of identical pieces, whose squares are sorted so that swapping
+        # two of them does not give the position another number.
+        self.groups = []
+        start = 2
+        for i in range(3, self.count + 1):
+            if i == self.count or self.pieces[i] != self.pieces[start]:
+                if i - start > 1:
+                    self.groups.append((start, i))
+                start = i
+
+    def is_draw(self):
+
+        """ True if neither side has anything but its king """
+
+        return self.count == 2
+
+    def index(self, squares):
+
+        """ Returns the number of the position with the pieces on the given
+        squares, the lowest number of all of its mirror images """
+
+        best = None
+        for table in KING_SYMMETRIES[squares[0]]:
+            moved = [table[square] for square in squares]
+            for start, end in self.groups:
+                moved[start:end] = sorted(moved[start:end])
+            index = KING_REGION[moved[0]]
+            for square in moved[1:]:
+                index = index * SQUARES + square
+            if best is None or index < best:
+                best = index
+        return best
+
+    def squares(self, index):
+
+        """ Returns the squares of the pieces of a position number """
+
+        squares = []
+        for i in range(self.count - 1):
+            squares.append(index % SQUARES)
+            index //= SQUARES
+        squares.append(KING_SQUARES[index])
+        squares.reverse()
+        return squares
+
+    def after_capture(self, squares, captured):
+
+        """ Returns the Material and the squares of the position after the
+        piece at list position captured is taken """
+
+        pieces = self.pieces[:captured] + self.pieces[captured + 1:]
+        squares = squares[:captured] + squares[captured + 1:]
+        white = [mlpiece.RANK[piece] for piece in pieces
+                 if mlpiece.SIDE[piece] == mlpiece.WHITE]
+        black = [mlpiece.RANK[piece] for piece in pieces
+                 if mlpiece.SIDE[piece] == mlpiece.BLACK]
+        return Material(material_string(white, black)), \
+            reorder(pieces, squares)
+
+
+def reorder(pieces, squares):
+
+    """ Returns the squares in the order Material lists pieces: white king,
+    black king, then the other pieces by side and rank """
+
+    def key(i):
+        piece = pieces[i]
+        rank = mlpiece.RANK[piece]
+        return (rank != mlpiece.KING, mlpiece.SIDE[piece],
+                -1 if rank == mlpiece.KING else
+                ORDER.index(RANK_LETTERS[rank]))
+    return [squares[i] for i in sorted(range(len(pieces)), key=key)]
+
+
+def swapped(material):
+
+    """ Returns the material string with the colours swapped """
+
+    white, black = material.split("v")
+    return black + "v" + white
+
+
+def path_of(directory, material):
+
+    return os.path.join(directory, material + EXTENSION)
+
+
+class Tablebase:
+
+    """ A tablebase file, probed through a memory map """
+
+    def __init__(self, path):
+
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, name, size = HEADER.unpack_from(self.map)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a tablebase file" % path)
+        self.material = Material(name.rstrip(b"\0").decode())
+        if size != self.material.size or \
+                len(self.map) != HEADER.size + 2 * size:
+            raise ValueError("%s has the wrong size" % path)
+
+    def close(self):
+
+        self.map.close()
+        self.file.close()
+
+    def probe_squares(self, squares, side):
+
+        """ Returns the (result, plies) of the side to move (0 for white, 1
+        for black) with the pieces on the given squares, or None if the
+        position is not legal """
+
+        if len(set(squares)) != len(squares):
+            return None
+        index = self.material.index(squares)
+        return decode_value(
+            self.map[HEADER.size + side * self.material.size + index])
+
+
+class Tablebases:
+
+    """ The tablebases in a directory, opened the first time they are
+    probed """
+
+    def __init__(self, directory = DIRECTORY):
+
+        self.directory = directory
+        self.tables = {}
+        self.max_pieces = 0
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                if name.endswith(EXTENSION):
+                    material = Material(name[:-len(EXTENSION)])
+                    self.max_pieces = max(self.max_pieces, material.count)
+
+    def table(self, material):
+
+        """ Returns the Tablebase of a material string, or None """
+
+        if material not in self.tables:
+            path = path_of(self.directory, material)
+            self.tables[material] = Tablebase(path) \
+                if os.path.exists(path) else None
+        return self.tables[material]
+
+    def probe_squares(self, material, squares, side):
+
+        """ Probes a position given as a Material, the squares in its order
+        and the side to move. A position without a table of its own is
+        looked up with the colours swapped. Returns None if there is no
+        table. """
+
+        if material.is_draw():
+            return ("draw", 0)
+        table = self.table(material.name)
+        if table is not None:
+            return table.probe_squares(squares, side)
+        table = self.table(swapped(material.name))
+        if table is not None:
+            count = len(material.pieces)
+            whites = sum(1 for piece in material.pieces
+                         if mlpiece.SIDE[piece] == mlpiece.WHITE)
+            return table.probe_squares(
+                [squares[1], squares[0]] + squares[whites + 1:] +
+                squares[2:whites + 1], 1 - side)
+        return None
+
+    def probe(self, board):
+
+        """ Returns the (result, plies) of the side to move of a board, or
+        None if there is no table for it """
+
+        if board.turn not in [Piece.WHITE, Piece.BLACK]:
+            return None
+        count = len(board.pieces[0]) + len(board.pieces[1])
+        if count > self.max_pieces and count > 2:
+            return None
+
+        data = board.data
+        pieces = []
+        squares = []
+        for side_pieces in board.pieces:
+            for index in side_pieces:
+                piece = data[index]
+                rank = mlpiece.RANK[piece]
+                if rank == mlpiece.PAWN:
+                    return None
+                # A king and rook that have not moved may still castle.
+                if rank in [mlpiece.KING, mlpiece.ROOK] and \
+                        mlpiece.STATE[piece] in [mlpiece.UNMOVED,
+                                                 mlpiece.CHECK_UNMOVED]:
+                    if any(mlpiece.RANK[data[other]] in
+                           [mlpiece.KING, mlpiece.ROOK] and
+                           mlpiece.RANK[data[other]] != rank and
+                           mlpiece.STATE[data[other]] in
+                           [mlpiece.UNMOVED, mlpiece.CHECK_UNMOVED]
+                           for other in side_pieces):
+                        return None
+                pieces.append(mlpiece.encode(mlpiece.SIDE[piece], rank,
+                                             mlpiece.NORMAL))
+                squares.append(index)
+
+        white = [mlpiece.RANK[piece] for piece in pieces
+                 if mlpiece.SIDE[piece] == mlpiece.WHITE]
+        black = [mlpiece.RANK[piece] for piece in pieces
+                 if mlpiece.SIDE[piece] == mlpiece.BLACK]
+        material = Material(material_string(white, black))
+        return self.probe_squares(material, reorder(pieces, squares),
+                                  0 if board.turn == Piece.WHITE else 1)
+
+    def close(self):
+
+        for table in self.tables.values():
+            if table is not None:
+                table.close()
+        self.tables = {}
+
+
+# Every worker process keeps a board per material and the smaller tables it
+# looks captures up in.
+worker_boards = {}
+worker_tables = {}
+
+
+def worker_board(material):
+
+    """ Returns the worker's board for a material, with nothing on it """
+
+    if material.name not in worker_boards:
+        data = bytearray(SQUARES + 1)
+        data[1] = material.pieces[0]
+        data[2] = material.pieces[1]
+        board = mlbitboard.BitBoard(data)
+        board.set_piece(1, mlpiece.EMPTY)
+        board.set_piece(2, mlpiece.EMPTY)
+        worker_boards[material.name] = board
+    return worker_boards[material.name]
+
+
+def place(board, material, squares, side):
+
+    """ Puts the pieces of a position on an empty board """
+
+    for piece, square in zip(material.pieces, squares):
+        board.set_piece(square, piece)
+    board.king[Piece.WHITE] = squares[0]
+    board.king[Piece.BLACK] = squares[1]
+    board.turn = Piece.WHITE if side == 0 else Piece.BLACK
+
+
+def clear(board, squares):
+
+    for square in squares:
+        board.set_piece(square, mlpiece.EMPTY)
+
+
+def is_legal(board, squares, side):
+
+    """ True if the side that is not to move is not in check """
+
+    return not board.is_attacked(
+        squares[1 - side], Piece.WHITE if side == 0 else Piece.BLACK)
+
+
+def initial_values(name, directory, start, stop):
+
+    """ Works out what can be known about positions start to stop (numbered
+    across both sides to move) without looking at other positions of the
+    same table. Returns four byte strings with, for every position: its
+    value (ILLEGAL, UNKNOWN or a result if it is already over), the number of
+    its distinct moves that stay in the table, the plies of the fastest win
+    by a capture, and the plies of the longest loss by a capture. """
+
+    material = Material(name)
+    if directory not in worker_tables:
+        worker_tables[directory] = Tablebases(directory)
+    tables = worker_tables[directory]
+    board = worker_board(material)
+
+    values = bytearray(stop - start)
+    counts = []
+    capture_wins = bytearray(stop - start)
+    capture_losses = bytearray(stop - start)
+
+    for number in range(start, stop):
+        side, index = divmod(number, material.size)
+        offset = number - start
+        squares = material.squares(index)
+        if len(set(squares)) != material.count or \
+                material.index(squares) != index:
+            values[offset] = ILLEGAL
+            counts.append(0)
+            continue
+
+        place(board, material, squares, side)
+        if not is_legal(board, squares, side):
+            values[offset] = ILLEGAL
+            counts.append(0)
+            clear(board, squares)
+            continue
+
+        moves = board.legal_moves(board.turn)
+        if not moves:
+            in_check = not is_legal(board, squares, 1 - side)
+            values[offset] = LOSS if in_check else DRAW
+            counts.append(0)
+            clear(board, squares)
+            continue
+
+        children = set()
+        draws = 0
+        for move in moves:
+            from_index = move & 0xff
+            to_index = move >> 8 & 0xff
+            moved = [to_index if square == from_index else square
+                     for square in squares]
+            if not move >> 16 & Board.MOVE_CAPTURE:
+                children.add(material.index(moved))
+                continue
+
+            captured = squares.index(to_index)
+            moved[squares.index(from_index)] = to_index
+            child, child_squares = material.after_capture(moved, captured)
+            result = tables.probe_squares(child, child_squares, 1 - side)
+            if result is None:
+                raise ValueError("no tablebase for %s" % child.name)
+            outcome, plies = result
+            if outcome == "loss":
+                if not capture_wins[offset] or \
+                        plies + 1 < capture_wins[offset]:
+                    capture_wins[offset] = plies + 1
+            elif outcome == "win":
+                capture_losses[offset] = max(capture_losses[offset],
+                                             plies + 1)
+            else:
+                draws += 1
+
+        values[offset] = UNKNOWN
+        counts.append(len(children) + draws)
+        clear(board, squares)
+
+    return bytes(values), struct.pack("<%dH" % len(counts), *counts), \
+        bytes(capture_wins), bytes(capture_losses)
+
+
+def predecessors(name, numbers):
+
+    """ Returns the numbers of the positions one move before each of the
+    given positions, each listed once per position it leads to """
+
+    material = Material(name)
+    board = worker_board(material)
+    found = []
+
+    for number in numbers:
+        side, index = divmod(number, material.size)
+        squares = material.squares(index)
+        place(board, material, squares, side)
+        occupied = board.sides[0] | board.sides[1]
+
+        # The pieces of the side that just moved are moved back to every
+        # empty square they could have come from. Without pawns, a piece can
+        # come from exactly the squares it could move to.
+        previous = set()
+        other = 1 - side
+        for i, square in enumerate(squares):
+            piece = material.pieces[i]
+            if mlpiece.SIDE_INDEX[piece] != other:
+                continue
+            bits = board.pseudo_move_bits(square, piece) & ~occupied
+            while bits:
+                low = bits & -bits
+                bits ^= low
+                moved = list(squares)
+                moved[i] = low.bit_length() - 1
+                previous.add(other * material.size + material.index(moved))
+        found.extend(previous)
+        clear(board, squares)
+
+    return found
+
+
+def chunks(numbers, size):
+
+    return [numbers[i:i + size] for i in range(0, len(numbers), size)]
+
+
+def generate(name, directory = DIRECTORY, workers = None, report = print):
+
+    """ Generates the tablebase of a material string, and first those of
+    every material it can reach by captures that do not exist yet. Returns a
+    dictionary of stats. """
+
+    material = Material(name)
+    for piece in range(2, material.count):
+        smaller, squares = material.after_capture(
+            list(range(material.count)), piece)
+        if not smaller.is_draw() and \
+                not os.path.exists(path_of(directory, smaller.name)) and \
+                not os.path.exists(path_of(directory, swapped(smaller.name))):
+            generate(smaller.name, directory, workers, report)
+
+    os.makedirs(directory, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    total = 2 * material.size
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        step = max(1, min(65536, total // (workers * 8) + 1))
+        futures = [
+            pool.submit(initial_values, material.name, directory, first,
+                        min(total, first + step))
+            for first in range(0, total, step)
+        ]
+        values = bytearray()
+        counts = []
+        capture_wins = bytearray()
+        capture_losses = bytearray()
+        for future in futures:
+            chunk_values, chunk_counts, chunk_wins, chunk_losses = \
+                future.result()
+            values += chunk_values
+            counts.extend(struct.unpack(
+                "<%dH" % len(chunk_values), chunk_counts))
+            capture_wins += chunk_wins
+            capture_losses += chunk_losses
+
+        positions = total - values.count(ILLEGAL)
+        report("%s: %d positions, set up in %.1f s" % (
+            material.name, positions, time.perf_counter() - start))
+
+        # levels[plies] holds the positions that end in that many plies:
+        # losses at even plies and wins at odd plies.
+        levels = {0: [number for number in range(total)
+                      if values[number] == LOSS]}
+        for number in range(total):
+            if values[number] != UNKNOWN:
+                continue
+            if capture_wins[number]:
+                levels.setdefault(capture_wins[number], []).append(number)
+            elif counts[number] == 0:
+                levels.setdefault(capture_losses[number], []).append(number)
+
+        # Mates were stored as losses already and are marked unknown again so
+        # they are resolved with the rest of level 0.
+        for number in levels[0]:
+            values[number] = UNKNOWN
+
+        plies = 0
+        while levels:
+            if plies > MAX_PLIES:
+                raise ValueError("%s has mates longer than %d plies" % (
+                    material.name, MAX_PLIES))
+            resolved = []
+            for number in levels.pop(plies, []):
+                if values[number] == UNKNOWN:
+                    values[number] = encode_value(
+                        "loss" if plies % 2 == 0 else "win", plies)
+                    resolved.append(number)
+
+            futures = [
+                pool.submit(predecessors, material.name, part)
+                for part in chunks(resolved, 2048)
+            ]
+            for future in futures:
+                for number in future.result():
+                    if values[number] != UNKNOWN:
+                        continue
+                    if plies % 2 == 0:
+                        # One move before a loss is a win.
+                        levels.setdefault(plies + 1, []).append(number)
+                    else:
+                        # A position is lost once all of its moves lead to
+                        # positions the opponent wins.
+                        counts[number] -= 1
+                        if counts[number] == 0 and \
+                                not capture_wins[number]:
+                            levels.setdefault(
+                                max(plies + 1, capture_losses[number]),
+                                []).append(number)
+            if resolved:
+                report("  %3d plies: %d positions" % (plies, len(resolved)))
+            plies += 1
+
+    for number in range(total):
+        if values[number] == UNKNOWN:
+            values[number] = DRAW
+
+    path = path_of(directory, material.name)
+    with open(path + ".tmp", "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION, material.name.encode(),
+                               material.size))
+        file.write(values)
+    os.replace(path + ".tmp", path)
+
+    seconds = time.perf_counter() - start
+    stats = table_stats(values, material)
+    stats["seconds"] = round(seconds, 3)
+    stats["positions_per_second"] = int(stats["positions"] / seconds) \
+        if seconds else 0
+    report("%s: %d positions in %.1f s, %d positions/s, written to %s" % (
+        material.name, stats["positions"], seconds,
+        stats["positions_per_second"], path))
+    return stats
+
+
+def table_stats(values, material):
+
+    """ Counts the wins, draws and losses of each side to move """
+
+    stats = {"material": material.name, "positions": 0}
+    for side, name in enumerate(["white", "black"]):
+        part = values[side * material.size:(side + 1) * material.size]
+        wins = sum(part.count(plies) for plies in range(1, LOSS))
+        losses = sum(part.count(LOSS + plies)
+                     for plies in range(MAX_PLIES + 1))
+        draws = part.count(DRAW)
+        longest = max([plies for plies in range(1, LOSS) if part.count(plies)]
+                      or [0])
+        stats[name] = {"wins": wins, "draws": draws, "losses": losses,
+                       "longest_win": longest}
+        stats["positions"] += wins + draws + losses
+    return stats
+
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(
+        description="Generate and probe multi-level chess tablebases.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    generate_parser = commands.add_parser(
+        "generate", help="generate the tablebase of a material")
+    generate_parser.add_argument("material", help="e.g. KQvK or KRvK")
+    generate_parser.add_argument(
+        "-w", "--workers", type=int, default=os.cpu_count(),
+        help="number of worker processes (default one per CPU)")
+
+    probe_parser = commands.add_parser("probe", help="probe a saved game")
+    probe_parser.add_argument(
+        "game_file", help="name of a game in saves/ or a path")
+
+    stats_parser = commands.add_parser(
+        "stats", help="count the results in a tablebase")
+    stats_parser.add_argument("material")
+
+    for command_parser in [generate_parser, probe_parser, stats_parser]:
+        command_parser.add_argument(
+            "--dir", default=DIRECTORY,
+            help="tablebase directory (default %s)" % DIRECTORY)
+    args = parser.parse_args(argv)
+
+    if args.command == "generate":
+        try:
+            generate(args.material, args.dir, args.workers)
+        except ValueError as error:
+            parser.error(str(error))
+    elif args.command == "probe":
+        tables = Tablebases(args.dir)
+        result = tables.probe(mlbitboard.BitBoard.load(args.game_file))
+        if result is None:
+            print("not in the tablebases")
+        else:
+            print("%s in %d plies" % result if result[0] != "draw"
+                  else "draw")
+    else:
+        material = Material(args.material)
+        table = Tablebase(path_of(args.dir, material.name))
+        values = table.map[HEADER.size:]
+        stats = table_stats(values, material)
+        for side in ["white", "black"]:
+            print("%s to move: %d wins, %d draws, %d losses, longest win %d "
+                  "plies" % (side, stats[side]["wins"], stats[side]["draws"],
+                             stats[side]["losses"],
+                             stats[side]["longest_win"]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""
+
+test_mlchess.py
+Tests of the board and game rules
+Samuel Bauman 2020
+
+"""
+
+import collections
+import unittest
+
+from mlchess import Piece, Board
+
+# Usage: python3 -m pytest test_mlchess.py, or python3 -m unittest
+
+
+class KeepTurnTest(unittest.TestCase):
+
+    def assert_history_matches(self, board):
+
+        self.assertEqual(board.history[-1], board.hash)
+        self.assertEqual(board.seen, dict(collections.Counter(board.history)))
+
+    def test_update_turn_false_is_deprecated_but_keeps_history(self):
+
+        board = Board.load("newgame")
+        start_hash = board.hash
+        index = min(board.pieces[0], key=lambda index: (
+            not board.legal_targets(index), index))
+        target = board.legal_targets(index)[0]
+
+        with self.assertWarns(DeprecationWarning):
+            board.move_piece(Board.index_to_vector(index),
+                             Board.index_to_vector(target), False)
+        self.assertEqual(board.turn, Piece.WHITE)
+        self.assertEqual(board.hash, board.compute_hash())
+        self.assert_history_matches(board)
+
+        board.unmake_move()
+        self.assertEqual(board.hash, start_hash)
+        self.assert_history_matches(board)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,29 @@
+"""
+
+test_mlmatch.py
+Tests of the match runner
+Samuel Bauman 2020
+
+"""
+
+import contextlib
+import io
+import unittest
+
+import mlmatch
+
+# Usage: python3 -m pytest test_mlmatch.py, or python3 -m unittest
+
+
+class ArgumentsTest(unittest.TestCase):
+
+    def test_zero_games_is_rejected(self):
+
+        with contextlib.redirect_stderr(io.StringIO()) as errors:
+            with self.assertRaises(SystemExit):
+                mlmatch.main(["random", "greedy", "-n", "0"])
+        self.assertIn("at least 1", errors.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+"""
+
+test_mlrecord.py
+Tests of the binary and text game records
+Samuel Bauman 2020
+
+"""
+
+import io
+import unittest
+
+import mlrecord
+from mlchess import Board
+
+# Usage: python3 -m pytest test_mlrecord.py, or python3 -m unittest
+
+
+def play(plies):
+
+    """ Returns the start position and the moves of a game of the given
+    number of plies, each move the last legal one, as generated with its
+    flags """
+
+    board = Board.load("newgame")
+    position = bytes([board.turn.value]) + bytes(board.data)
+    moves = []
+    for ply in range(plies):
+        move = board.legal_moves(board.turn)[-1]
+        moves.append(move)
+        board.make_move(move)
+    return position, moves
+
+
+def read(data):
+
+    return list(mlrecord.read_games(io.BytesIO(data)))
+
+
+class RoundTripTest(unittest.TestCase):
+
+    def test_game_without_flags_round_trips(self):
+
+        position, moves = play(12)
+        data = mlrecord.encode_game(
+            position, [move & 0xffff for move in moves], "1-0")
+
+        games = read(data)
+        self.assertEqual(len(games), 1)
+        self.assertEqual(games[0].encode(), data)
+        text = mlrecord.game_to_text(games[0])
+        text_games = list(mlrecord.read_text_games(io.StringIO(text)))
+        self.assertEqual(text_games[0].encode(), data)
+
+    def test_moves_with_flags_are_written_without_them(self):
+
+        position, moves = play(12)
+        self.assertTrue(any(move >> 16 for move in moves))
+        data = mlrecord.encode_game(position, moves, "0-1")
+        self.assertEqual(data, mlrecord.encode_game(
+            position, [move & 0xffff for move in moves], "0-1"))
+        self.assertEqual(len(data), mlrecord.POSITION_SIZE + 2 * 12 + 2)
+
+    def test_flagged_records_are_read_and_written_canonically(self):
+
+        position, moves = play(6)
+        records = b"".join(
+            bytes([mlrecord.FLAGGED | move >> 16 & 0x3f,
+                   move & 0xff, move >> 8 & 0xff])
+            for move in moves)
+        old = position + records + bytes([mlrecord.END, 0])
+
+        game = read(old)[0]
+        self.assertEqual(list(game.moves()), moves)
+        self.assertEqual(game.encode(), mlrecord.encode_game(position, moves))
+
+
+class TruncatedRecordTest(unittest.TestCase):
+
+    def test_cut_off_start_position_is_left_out(self):
+
+        position, moves = play(4)
+        first = mlrecord.encode_game(position, moves, "1/2-1/2")
+        games = read(first + position[:100])
+        self.assertEqual([game.encode() for game in games], [first])
+
+    def test_cut_off_result_reads_as_unfinished(self):
+
+        position, moves = play(4)
+        data = mlrecord.encode_game(position, moves, "1-0")
+        game = read(data[:-1])[0]
+        self.assertEqual(game.result, "*")
+        self.assertEqual(game.plies, 4)
+
+    def test_cut_off_move_reads_as_unfinished(self):
+
+        position, moves = play(4)
+        data = mlrecord.encode_game(position, moves, "1-0")
+        game = read(data[:-3])[0]
+        self.assertEqual(game.result, "*")
+        self.assertEqual(game.plies, 3)
+
+    def test_bad_result_raises(self):
+
+        position, moves = play(2)
+        data = mlrecord.encode_game(position, moves)[:-1] + bytes([9])
+        with self.assertRaises(mlrecord.RecordError):
+            read(data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+"""
+
+test_mlsearch.py
+Tests of the alpha-beta search engine
+Samuel Bauman 2020
+
+"""
+
+import unittest
+
+import mlsearch
+from mlchess import Board
+
+# Usage: python3 -m pytest test_mlsearch.py, or python3 -m unittest
+
+
+class NodeLimitTest(unittest.TestCase):
+
+    def test_node_limit_is_never_exceeded(self):
+
+        for node_limit in [1, 100, 300, 2000]:
+            engine = mlsearch.Engine(tt_megabytes=1)
+            board = Board.load("newgame")
+            result = engine.search(board, node_limit=node_limit)
+            self.assertLessEqual(engine.nodes, node_limit)
+            self.assertLessEqual(result.nodes, node_limit)
+            # A move is played even when no depth could be finished.
+            self.assertIsNotNone(result.best_move)
+
+    def test_board_is_restored_after_a_stopped_search(self):
+
+        board = Board.load("newgame")
+        data, position_hash = bytes(board.data), board.hash
+        mlsearch.Engine(tt_megabytes=1).search(board, node_limit=150)
+        self.assertEqual(bytes(board.data), data)
+        self.assertEqual(board.hash, position_hash)
+        self.assertEqual(board.undo, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
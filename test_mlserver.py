@@ -0,0 +1,117 @@
+"""
+
+test_mlserver.py
+Tests of the multi-game server
+Samuel Bauman 2020
+
+"""
+
+import asyncio
+import unittest
+
+import mlpiece
+import mlprotocol
+import mlserver
+from mlchess import Piece, Board, MultilevelChess
+
+# Usage: python3 -m pytest test_mlserver.py, or python3 -m unittest
+
+# A white king, a white queen and a black king, white to move. White moves its
+# king, black moves its king next to the queen's target and the queen mates.
+START = [(104, mlpiece.KING, mlpiece.WHITE),
+         (94, mlpiece.QUEEN, mlpiece.WHITE),
+         (162, mlpiece.KING, mlpiece.BLACK)]
+MOVES = [(104, 33), (162, 154), (94, 90)]
+
+
+def start_hex():
+
+    """ Returns the hex game data of the start position """
+
+    data = bytearray(192)
+    for index, rank, side in START:
+        data[index] = mlpiece.encode(side, rank, mlpiece.NORMAL)
+    return (bytes([Piece.WHITE.value]) + data).hex()
+
+
+async def connect(port):
+
+    """ Connects a binary protocol player and returns its reader and writer """
+
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(mlprotocol.encode_hello())
+    return reader, writer
+
+
+async def read_side(reader):
+
+    while True:
+        kind, payload = await mlprotocol.read_frame(reader)
+        if kind == mlprotocol.START:
+            return Piece(payload[0])
+
+
+async def read_move(reader):
+
+    while True:
+        kind, payload = await mlprotocol.read_frame(reader)
+        if kind == mlprotocol.MOVE:
+            return payload
+
+
+async def play_to_checkmate():
+
+    """ Plays MOVES through a server between two clients that send their moves
+    the way tmlchess does, and returns the server, the moves each client
+    received and the final turn of both clients' games """
+
+    server = mlserver.GameServer(start_hex(), hello_wait=0.2)
+    listener = await server.start("127.0.0.1", 0)
+    port = listener.sockets[0].getsockname()[1]
+    try:
+        players = {}
+        for reader, writer in [await connect(port), await connect(port)]:
+            side = await asyncio.wait_for(read_side(reader), 5)
+            players[side] = (
+                reader, writer, MultilevelChess([side], start_hex()))
+
+        received = {Piece.WHITE: [], Piece.BLACK: []}
+        for ply, (from_index, to_index) in enumerate(MOVES):
+            side = Piece.WHITE if ply % 2 == 0 else Piece.BLACK
+            other = Piece.BLACK if side == Piece.WHITE else Piece.WHITE
+            reader, writer, game = players[side]
+            game.board.move_piece(Board.index_to_vector(from_index),
+                                  Board.index_to_vector(to_index))
+            writer.write(mlprotocol.encode_move(*game.last_move()))
+            move = await asyncio.wait_for(read_move(players[other][0]), 5)
+            received[other].append((move[0], move[1]))
+            players[other][2].opponent_move(move)
+
+        # The server closes both connections once the game has ended.
+        for side in players:
+            reader = players[side][0]
+            while await asyncio.wait_for(reader.read(4096), 5):
+                pass
+            players[side][1].close()
+        turns = [players[side][2].board.turn for side in players]
+        return server, received, turns
+    finally:
+        listener.close()
+        await listener.wait_closed()
+
+
+class CheckmateTest(unittest.TestCase):
+
+    def test_game_is_played_to_checkmate(self):
+
+        server, received, turns = asyncio.run(play_to_checkmate())
+        self.assertEqual(received[Piece.BLACK], [MOVES[0], MOVES[2]])
+        self.assertEqual(received[Piece.WHITE], [MOVES[1]])
+        self.assertEqual(turns, [Piece.CHECKMATE, Piece.CHECKMATE])
+        self.assertEqual(server.moves, len(MOVES))
+        self.assertEqual(server.rejected, 0)
+        self.assertEqual(server.active, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,12 +6,20 @@ Samuel Bauman 2020
 
 """
 
+import argparse
+import os
+import random
 import socket
+import tempfile
 import curses, curses.panel
+import mlbook
 import mlchess
+import mlprotocol
+import mlrecord
+import mlstats
 
 import sys
-from time import sleep
+from time import sleep, perf_counter
 import errno
 
 # Offset values for drawing to the terminal
@@ -36,35 +44,314 @@ def menu_input(stdscr, r, c, prompt_string):
     stdscr.clear()
     return user_in
 
+def init_colors():
+    curses.start_color()
+    curses.use_default_colors()
+
+    # Set up all of the colors pairs (FG, BG) to be used
+    curses.init_pair(2, 255, 179)
+    curses.init_pair(3, 255, 130)
+    curses.init_pair(4, 232, 179)
+    curses.init_pair(5, 232, 130)
+
+    curses.init_pair(6, 184, 232)
+
+    curses.init_pair(7, 232, 234)
+    curses.init_pair(8, 232, -1)
+
+    curses.init_pair(9, 22, 179)
+    curses.init_pair(10, 34, 130)
+    curses.init_pair(11, 160, 232)
+
+    curses.init_pair(12, 135, 232)
+
+class BoardRenderer:
+
+    """ Draws the three boards, redrawing only the cells that changed since
+    the last frame """
+
+    # Every cell is remembered as the (text, color pair) it was last drawn
+    # with. Cursor moves, selections and moves only change a handful of cells,
+    # so comparing against the remembered state and skipping the cells that
+    # are unchanged saves most of the addstr calls of a frame. Anything that
+    # draws over the boards, such as a menu or a message, has to call
+    # invalidate so the next frame draws everything again.
+
+    def __init__(self, stdscr, charset, incremental = True, book = None):
+        # book, a mlbook.Book, has the book moves of the position shown
+        # below the boards.
+        self.stdscr = stdscr
+        self.charset = charset
+        self.incremental = incremental
+        self.cells = {}
+        self.cells_drawn = 0
+        self.book = book
+        self.book_hash = None
+        self.book_text = ""
+
+    def invalidate(self):
+        # Forgets what is on screen so the next frame redraws every cell.
+        self.cells.clear()
+
+    def cell_state(self, game, x, y, z, select_pos):
+        # Returns the (text, color pair) the cell at [x,y,z] should show.
+
+        # Gets information about current position.
+        board_data = game.get_board_at(x,y,z)
+
+        # Piece ID  Used for selecting corresponding symbol.
+        p_id = board_data[1]
+
+        # Sets the color pair to be used.
+        color_P = ((x + y) % 2) + 2 + (board_data[0] * 2)
+
+        # Highligts current square if it currently selected
+        if select_pos == [x,y,z]:
+            color_P = 6
+
+        if game.old_select_pos == [x,y,z] and game.selected:
+            color_P = 12
+
+        # This sets the text to be drawn for the current grid position based
+        # on board_data[1], which is the piece rank. Also, based on
+        # board_data[2], it draws a green circle if the current grid position
+        # is a valid move position in the movement mask, or highlights
+        # opponent pieces red.
+
+        if board_data[1] >= 0:
+            text = "{:2}".format(piece[self.charset][p_id] + " ")
+            if board_data[2] == 1:
+                color_P = 11
+        elif board_data[2] == 1:
+            text = piece[self.charset][6]
+            color_P += 7
+        else:
+            text = "  "
+
+        return text, color_P
+
+    def draw(self, game):
+        # Draws all cells that changed and returns how many were drawn. The
+        # screen itself is only updated by update.
+        stdscr = self.stdscr
+        full = not self.incremental or not self.cells
+        select_pos = game.get_select_pos()
+        drawn = 0
+
+        for z in range(3):
+            for y in range(8):
+                for x in range(8):
+
+                    state = self.cell_state(game, x, y, z, select_pos)
+                    if not full and self.cells[(x, y, z)] == state:
+                        continue
+                    self.cells[(x, y, z)] = state
+                    drawn += 1
+
+                    # Sets the screen X and Y position
+                    pos_y = os_y + y - z
+                    pos_x = os_x + (x * 2) + (z * 18)
+
+                    # Performs the drawing to the curses panel
+                    stdscr.addstr(
+                            pos_y,
+                            pos_x,
+                            state[0],
+                            curses.color_pair(state[1]))
+
+                    # Optional: Draws a shadow below the boards for 3D-ish
+                    # effect. Shadows never change, so they are only drawn
+                    # along with a full frame.
+                    if full and (x == 0 or y in range(7-z,8)):
+                        stdscr.addstr(
+                            pos_y + z + 1,
+                            pos_x - 1,
+                            "  " if y in range(7-z,8) else " ",
+                            curses.color_pair(7))
+
+        stdscr.addstr(0,2,"Turn: " + game.turn_str())
+        if self.book is not None:
+            stdscr.addstr(os_y + 10, 2, self.book_line(game).ljust(52))
+        self.cells_drawn = drawn
+        return drawn
+
+    def book_line(self, game):
+        # The three most played book moves of the position, looked up again
+        # only when the position changes.
+        board = game.board
+        if board.hash != self.book_hash:
+            self.book_hash = board.hash
+            moves = self.book.moves(board) if board.turn in [
+                mlchess.Piece.WHITE, mlchess.Piece.BLACK] else []
+            self.book_text = "Book: " + ("  ".join(
+                "%s %d" % (mlrecord.move_text(board, move.move), move.games)
+                for move in moves[:3]) if moves else "-")
+        return self.book_text
+
+    def update(self):
+        # Sends everything drawn since the last update to the terminal in a
+        # single batch.
+        self.stdscr.noutrefresh()
+        curses.doupdate()
+
+def bench_render(charset, frames, seed = 1):
+    # Plays a scripted session of cursor moves, selections and moves and
+    # reports the time, cells drawn and bytes sent to the terminal per frame,
+    # once redrawing every cell each frame and once only the changed cells.
+    # The terminal output goes to a temporary file so it can be measured, as
+    # written for a 256 color xterm, which the color pairs need.
+    os.environ["TERM"] = "xterm-256color"
+    with open("saves/newgame.txt", "r") as file:
+        game_hex_data = file.read()
+
+    sys.stdout.flush()
+    saved_stdout = os.dup(1)
+    output = tempfile.TemporaryFile()
+    os.dup2(output.fileno(), 1)
+    results = []
+    try:
+        stdscr = curses.initscr()
+        init_colors()
+        for incremental in [False, True]:
+            rng = random.Random(seed)
+            game = mlchess.MultilevelChess(
+                [mlchess.Piece.WHITE, mlchess.Piece.BLACK], game_hex_data)
+            renderer = BoardRenderer(stdscr, charset, incremental)
+            stdscr.clear()
+            renderer.draw(game)
+            renderer.update()
+
+            times = []
+            cells = 0
+            start_bytes = os.fstat(output.fileno()).st_size
+            for frame in range(frames):
+                bench_event(game, rng, frame)
+                start = perf_counter()
+                cells += renderer.draw(game)
+                renderer.update()
+                times.append(perf_counter() - start)
+            sent = os.fstat(output.fileno()).st_size - start_bytes
+
+            times.sort()
+            results.append([
+                "incremental" if incremental else "full", frames,
+                sum(times) / frames * 1000, times[len(times) // 2] * 1000,
+                times[-1] * 1000, cells / frames, sent / frames])
+        try:
+            curses.endwin()
+        except curses.error:
+            # Without a terminal on stdin there are no terminal settings to
+            # restore.
+            pass
+    finally:
+        sys.stdout.flush()
+        os.dup2(saved_stdout, 1)
+        os.close(saved_stdout)
+        output.close()
+
+    for row in results:
+        print("%-11s %5d frames  mean %7.3f ms  median %7.3f ms  "
+              "max %7.3f ms  %6.1f cells/frame  %8.1f bytes/frame" %
+              tuple(row))
+    return results
+
+def bench_event(game, rng, frame):
+    # Applies one scripted event to the game: mostly cursor moves, with a
+    # piece selection every few frames and a move every twelfth frame.
+    board = game.board
+    if board.turn not in [mlchess.Piece.WHITE, mlchess.Piece.BLACK]:
+        return
+    if frame % 12 == 11:
+        moves = board.legal_moves(board.turn)
+        if moves:
+            from_index, to_index = mlchess.Board.unpack_move(
+                rng.choice(moves))[:2]
+            game.selected = False
+            board.move_piece(mlchess.Board.index_to_vector(from_index),
+                             mlchess.Board.index_to_vector(to_index))
+    elif frame % 4 == 3:
+        side = 0 if board.turn == mlchess.Piece.WHITE else 1
+        index = rng.choice(sorted(board.pieces[side]))
+        game.selected = False
+        game.set_select_pos(None, mlchess.Board.index_to_vector(index))
+        game.set_select(True)
+    else:
+        game.set_select_pos(rng.choice([
+            [-1, 0, 0], [ 1, 0, 0], [ 0,-1, 0], [ 0, 1, 0], [ 0, 0, 1],
+            [ 0, 0,-1]]))
+
 def display_msg(stdscr, msg):
     #stdscr.clear()
     stdscr.addstr(1, 1, msg)
     stdscr.refresh()
 
-def main():
+def read_key(stdscr, game, precompute):
+    # Waits for the next key press. With precompute set, movement masks are
+    # generated one at a time while no key is waiting, so moving the cursor
+    # onto a piece finds its mask ready instead of generating it then.
+    if precompute:
+        stdscr.nodelay(True)
+        try:
+            while game.precompute_masks(1):
+                c = stdscr.getch()
+                if c != -1:
+                    return c
+        finally:
+            stdscr.nodelay(False)
+    return stdscr.getch()
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(
+        description="Multi-level chess terminal client.")
+    parser.add_argument(
+        "--precompute", action="store_true",
+        help="generate movement masks in the background while waiting for "
+             "keys")
+    parser.add_argument(
+        "--full-redraw", action="store_true",
+        help="redraw every cell each frame instead of only changed ones")
+    parser.add_argument(
+        "--bench-render", action="store_true",
+        help="measure the renderer on a scripted session and exit")
+    parser.add_argument(
+        "--frames", type=int, default=240,
+        help="number of frames for --bench-render (default 240)")
+    parser.add_argument(
+        "--charset", choices=["a", "u"], default="u",
+        help="character set for --bench-render (default u)")
+    parser.add_argument(
+        "--stats", default=None, metavar="FILE",
+        help="measure the rules engine and write the stats to FILE as JSON "
+             "on exit")
+    parser.add_argument(
+        "--stats-log", default=None, metavar="FILE",
+        help="measure the rules engine and append the stats to FILE as a "
+             "JSON line every --stats-interval seconds")
+    parser.add_argument(
+        "--stats-interval", type=float, default=10.0,
+        help="seconds between lines of --stats-log (default 10)")
+    parser.add_argument(
+        "--book", default=None, metavar="FILE",
+        help="opening book (see mlbook.py) whose moves are shown below the "
+             "boards")
+    args = parser.parse_args(argv)
+    book = mlbook.Book(args.book) if args.book else None
+
+    stats_log = None
+    if args.stats or args.stats_log:
+        mlstats.enable(args.stats)
+    if args.stats_log:
+        stats_log = mlstats.PeriodicLog(args.stats_log, args.stats_interval)
+
+    if args.bench_render:
+        bench_render(args.charset, args.frames)
+        return
+
     try:
         stdscr = curses.initscr()
         charset = ''
         game_type = ''
-        curses.start_color()
-        curses.use_default_colors()
-
-        # Set up all of the colors pairs (FG, BG) to be used
-        curses.init_pair(2, 255, 179)
-        curses.init_pair(3, 255, 130)
-        curses.init_pair(4, 232, 179)
-        curses.init_pair(5, 232, 130)
-
-        curses.init_pair(6, 184, 232)
-
-        curses.init_pair(7, 232, 234)
-        curses.init_pair(8, 232, -1)
-
-        curses.init_pair(9, 22, 179)
-        curses.init_pair(10, 34, 130)
-        curses.init_pair(11, 160, 232)
-
-        curses.init_pair(12, 135, 232)
+        init_colors()
 
         while charset not in ['u', 'a']:
             charset = menu_input(stdscr, 2, 3, "(a)scii or (u)nicode?")
@@ -99,12 +386,23 @@ def main():
             display_msg(stdscr, "Waiting for a client to connect...")
 
             conn,addr = serv.accept()
-            conn.sendall(game_hex_data.encode())
+
+            # Clients that say HELLO get the binary protocol, older ones the
+            # game data as hex.
+            frames = mlprotocol.server_handshake(conn)
+            if frames is None:
+                conn.sendall(game_hex_data.encode())
+            else:
+                frames.send(
+                    mlprotocol.encode_position(
+                        bytearray.fromhex(game_hex_data)),
+                    mlprotocol.encode_start(mlchess.Piece.BLACK.value))
 
             player_sides = [mlchess.Piece.WHITE]
             stdscr.clear()
 
         elif game_type == "c":
+            frames = None
             HOST = menu_input(stdscr, 2, 3, "Enter server address: ")
             PORT = menu_input(
                 stdscr, 2, 3, "Enter server port (default %s): " % DEFAULT_PORT)
@@ -114,8 +412,21 @@ def main():
             conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             conn.connect((HOST,int(PORT)))
             try:
-                game_hex_data = conn.recv(512)
-            except socket.error as e:
+                frames, game_hex_data = mlprotocol.client_handshake(conn)
+                if frames is not None:
+                    # The binary protocol sends the position and the side to
+                    # play as separate messages.
+                    position = None
+                    side = None
+                    while position is None or side is None:
+                        kind, payload = frames.recv_frame()
+                        if kind == mlprotocol.POSITION:
+                            position = payload
+                        elif kind == mlprotocol.START:
+                            side = payload[0]
+                    game_hex_data = position.hex().encode() + b" " + \
+                        (b"w" if side == mlchess.Piece.WHITE.value else b"b")
+            except (socket.error, mlprotocol.ProtocolError) as e:
                 err = e.args[0]
                 if err == errno.EAGAIN or err == errno.EWOULDBLOCK:
                     display_msg(stdscr, "No data available")
@@ -127,6 +438,14 @@ def main():
             else:
                 game_hex_data = game_hex_data.decode()
             player_sides = [mlchess.Piece.BLACK]
+
+            # The side to play from the binary protocol follows the game
+            # data; a server using the hex format always plays white.
+            fields = game_hex_data.split()
+            if len(fields) > 1:
+                game_hex_data = fields[0]
+                if fields[1] == "w":
+                    player_sides = [mlchess.Piece.WHITE]
             stdscr.clear()
         else:
             game_file = menu_input(stdscr, 2, 3, "Game file (default newgame):")
@@ -151,76 +470,19 @@ def main():
 
         click_select = False
 
+        renderer = BoardRenderer(stdscr, charset, not args.full_redraw, book)
+
         stdscr.refresh()
         # Game loop
         while 1:
-            # Gets the currently selected grid position
-            select_pos = game.get_select_pos()
             # Draw all three boards
-            for z in range(3):
-                for y in range(8):
-                    for x in range(8):
-
-                        # Gets information about current position.
-                        board_data = game.get_board_at(x,y,z)
-
-                        # Piece ID  Used for selecting corresponding symbol.
-                        p_id = board_data[1]
-
-                        # Sets the color pair to be used.
-                        color_P = ((x + y) % 2) + 2 + (board_data[0] * 2)
-
-                        # Sets the screen X and Y position
-                        pos_y = os_y + y - z
-                        pos_x = os_x + (x * 2) + (z * 18)
-
-                        # Highligts current square if it currently selected
-                        if select_pos == [x,y,z]:
-                            color_P = 6
-
-                        if game.old_select_pos == [x,y,z] and game.selected:
-                            color_P = 12
-
-
-                        # This sets the text to be drawn for the current grid 
-                        # position based on board_data[1], which is the piece 
-                        # rank. Also, based on board_data[2], it draws a green 
-                        # circle if the current grid position is a valid move 
-                        # position in the movement mask, or highlights opponent
-                        # pieces red.
-
-                        if board_data[1] >= 0:
-                            text = "{:2}".format(piece[charset][p_id] + " ")
-                            if board_data[2] == 1:
-                                color_P = 11
-                        elif board_data[2] == 1:
-                            text = piece[charset][6]
-                            color_P += 7
-                        else:
-                            text = "  "
-
-                        # Performs the drawing to the curses panel
-                        stdscr.addstr(
-                                pos_y,
-                                pos_x,
-                                text,
-                                curses.color_pair(color_P))
-
-                        # Optional: Draws a shadow below the boards for 3D-ish
-                        # effect.
-                        if x == 0 or y in range(7-z,8):
-                            stdscr.addstr(
-                                pos_y + z + 1,
-                                pos_x - 1,
-                                "  " if y in range(7-z,8) else " ",
-                                curses.color_pair(7))
-
-            stdscr.addstr(0,2,"Turn: " + game.turn_str())
+            renderer.draw(game)
+            renderer.update()
 
             if game.is_my_turn():
                 # Handle keyboard input from the player
 
-                c = stdscr.getch()
+                c = read_key(stdscr, game, args.precompute)
                 if c == ord("q"):
                     break
                 elif c == 260:
@@ -238,6 +500,8 @@ def main():
                 elif c == ord("s"):
                     filename = menu_input(stdscr, 2, 4, "Save name: ")
                     game.save_current_game(filename)
+                    mlrecord.save_game("saves/" + filename + ".mlg", game)
+                    renderer.invalidate()
                 elif c == 10:
                     game.set_select(True)
                 elif c == curses.KEY_MOUSE:
@@ -254,18 +518,21 @@ def main():
             # Checks if the client is currently playing a multiplayer game and
             # either waits for opponent move or waits for a local move then 
             # sends the last local move to the opponenet.
-            stdscr.refresh()
             if game_type in  ["s", "c"]:
 
                 if not game.is_my_turn() and not game.turn_done:
                     try:
                         stdscr.addstr(0,18,"Waiting for opponent . . .")
                         stdscr.refresh()
-                        data = conn.recv(6)
-                    except socket.error as e:
+                        if frames is None:
+                            data = conn.recv(6).decode()
+                        else:
+                            data = frames.recv_move()
+                    except (socket.error, mlprotocol.ProtocolError) as e:
                         err = e.args[0]
                         if err == errno.EAGAIN or err == errno.EWOULDBLOCK:
                             display_msg(stdscr, "No data available")
+                            renderer.invalidate()
                             sleep(2)
                             continue
                         else:
@@ -275,14 +542,22 @@ def main():
                     else:
                         stdscr.addstr(0,18,"                           ")
                         stdscr.refresh()
-                        game.opponent_move(data.decode())
+                        game.opponent_move(data)
 
                 elif game.turn_done:
-                    conn.sendall(game.my_move().encode())
+                    if frames is None:
+                        conn.sendall(game.my_move().encode())
+                    else:
+                        frames.send(mlprotocol.encode_move(*game.last_move()))
                     game.turn_done = False
 
+            if stats_log is not None:
+                stats_log.tick()
+
     finally:
         # Clean up and exit
+        if stats_log is not None:
+            stats_log.write()
         if game_type == "s":
             serv.close()
             conn.close()